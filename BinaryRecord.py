@@ -0,0 +1,174 @@
+#####################################################################################################################
+#
+#       Module name      : BinaryRecord.py
+#       Context          : Used by WriteXData.py and NewRawData.py (MW41 / IronPython) and by the readers (Python 3)
+#
+#       Original release : 2021
+#
+#       Binary record files written next to the text files : a self-describing header followed by
+#       fixed-size little-endian records, one per frame, which can be memory-mapped without parsing.
+#
+#       Header :  magic (8s) + version (H) + number of fields (H) + record size (I) + header size (I)
+#                 then for each field : name (32s) + struct format (8s), NUL padded.
+#
+#####################################################################################################################
+
+import calendar
+import struct
+
+Magic = b"RS41REC\0"
+Version = 1
+__MissingData__ = -32768.0
+NaN = float("nan")
+
+_Prefix = struct.Struct("<8sHHII")
+_Field = struct.Struct("<32s8s")
+
+# Common part of the XData records. Decoded instrument fields are appended (see XDataFields).
+XDataBaseFields = [
+  ("srv_time", "d"),            # DataSrvTime, seconds since 1970-01-01
+  ("rx_time", "d"),             # RadioRxTime [s]
+  ("offset", "f"),              # MeasurementOffset [s]
+  ("gps_offset", "f"),          # GpsTimeOffset [1/20 s]
+  ("instrument_type", "h"),
+  ("instrument_number", "h"),
+  ("xdata", "40s"),             # raw XData, truncated to 40 characters
+  ("qc_flags", "H"),            # XDataQC flags
+]
+
+PtuFields = [
+  ("time", "d"),                # RadioResetTime + RadioRxTime, seconds since 1970-01-01
+  ("rx_time", "d"),             # RadioRxTime [s]
+  ("pressure", "f"),            # hPa
+  ("temperature", "f"),
+  ("humidity", "f"),            # %
+  ("windDirection", "f"),       # deg
+  ("windSpeed", "f"),           # m/s
+  ("v", "f"),                   # m/s
+  ("u", "f"),                   # m/s
+  ("altitude", "f"),            # m
+  ("longitude", "d"),           # deg
+  ("latitude", "d"),            # deg
+  ("ascentRate", "f"),          # m/s
+]
+
+
+def XDataFields(registry):
+  """Record fields of the XData file : common fields + one field per decoded instrument value."""
+  fields = list(XDataBaseFields)
+  specs = []
+  if registry.Default is not None :
+    specs.append(registry.Default)
+  for spec in list(registry.Types.values()) + list(registry.Numbers.values()) :
+    if spec not in specs :
+      specs.append(spec)
+  for spec in specs :
+    for fname in spec.FieldNames :
+      fields.append((spec.Name + "_" + fname, "f"))
+  return fields
+
+
+def EpochSeconds(text):
+  """Returns seconds since 1970-01-01 of a 'yyyy-MM-dd HH:mm:ss[.fff]' string, NaN if invalid."""
+  try :
+    day, clock = text.split()
+    year, month, mday = day.split("-")
+    hour, minute, second = clock.split(":")
+    sec = float(second)
+    whole = int(sec)
+    return calendar.timegm((int(year), int(month), int(mday), int(hour), int(minute), whole, 0, 0, 0)) + (sec - whole)
+  except ValueError :
+    return NaN
+
+
+def Value(value):
+  """Returns value as float, NaN for missing data."""
+  if value is None or value == __MissingData__ :
+    return NaN
+  return float(value)
+
+
+class RecordFormat(object):
+  """Layout of fixed-size records : header bytes and packing of the values.
+
+  Arguments:
+  fields -- list of (name, struct format)
+  """
+
+  def __init__(self, fields):
+    self.Fields = list(fields)
+    self.Names = [f[0] for f in fields]
+    self.Struct = struct.Struct("<" + "".join([f[1] for f in fields]))
+    self.Defaults = []
+    for (name, fmt) in fields :
+      if fmt.endswith("s") :
+        self.Defaults.append(b"")
+      elif fmt in ("d", "f") :
+        self.Defaults.append(NaN)
+      else :
+        self.Defaults.append(-1)
+    header = [b""]
+    for (name, fmt) in fields :
+      header.append(_Field.pack(name.encode("ascii"), fmt.encode("ascii")))
+    headerSize = _Prefix.size + _Field.size * len(fields)
+    header[0] = _Prefix.pack(Magic, Version, len(fields), self.Struct.size, headerSize)
+    self.Header = b"".join(header)
+
+  def Pack(self, values):
+    """One record from a dict of values; absent fields are NaN, -1 or empty."""
+    record = list(self.Defaults)
+    for i in range(len(self.Names)) :
+      name = self.Names[i]
+      if name in values :
+        record[i] = values[name]
+    return self.Struct.pack(*record)
+
+
+class BinaryRecordWriter(object):
+  """Writes fixed-size records through a BufferedWriter.
+
+  Arguments:
+  writer -- BufferedWriter opened on an empty file
+  fields -- list of (name, struct format), or a RecordFormat
+  """
+
+  def __init__(self, writer, fields):
+    self.Writer = writer
+    if isinstance(fields, RecordFormat) :
+      self.Format = fields
+    else :
+      self.Format = RecordFormat(fields)
+    self.Writer.Write(self.Format.Header)
+    self.Writer.Flush()
+
+  def Write(self, values):
+    """Write one record from a dict of values; absent fields are NaN, -1 or empty."""
+    self.Writer.Write(self.Format.Pack(values))
+
+  def WritePacked(self, record):
+    """Write one record already packed by its RecordFormat."""
+    self.Writer.Write(record)
+
+  def FlushIfDue(self):
+    self.Writer.FlushIfDue()
+
+  def Close(self):
+    self.Writer.Close()
+
+
+def ReadHeader(data):
+  """Parse the header at the start of data (bytes).
+
+  Returns (fields, recordSize, headerSize) where fields is a list of
+  (name, struct format).
+  """
+  magic, version, count, recordSize, headerSize = _Prefix.unpack_from(data, 0)
+  if magic != Magic :
+    raise ValueError("Not a RS41 binary record file")
+  if version != Version :
+    raise ValueError("Unsupported binary record version %d" % version)
+  fields = []
+  for i in range(count) :
+    name, fmt = _Field.unpack_from(data, _Prefix.size + i * _Field.size)
+    fields.append((name.rstrip(b"\0").decode("ascii"), fmt.rstrip(b"\0").decode("ascii")))
+  return fields, recordSize, headerSize
@@ -0,0 +1,120 @@
+#####################################################################################################################
+#
+#       Module name      : BufferedWriter.py
+#       Context          : Used by WriteXData.py, NewRawData.py and WriteProfile.py (Vaisala MW41 Sounding System)
+#
+#       Original release : 2021
+#
+#       Output file kept open for the whole sounding. Lines are batched in memory and written
+#       when the buffer is big enough, when it is old enough, and at the end of the sounding.
+#
+#####################################################################################################################
+
+import os
+import time
+
+from RunStats import Clock
+
+# fsync policies
+FsyncNever = "never"
+FsyncOnFlush = "flush"
+FsyncOnClose = "close"
+FsyncPolicies = (FsyncNever, FsyncOnFlush, FsyncOnClose)
+
+
+def CheckFsync(fsync):
+  """Return fsync if it is one of FsyncPolicies, else raise ValueError."""
+  if fsync not in FsyncPolicies :
+    raise ValueError("Unknown fsync policy " + str(fsync))
+  return fsync
+
+
+class BufferedWriter(object):
+  """Buffered line writer for the sounding output files.
+
+  Arguments:
+  path -- output file
+  lineEnd -- end of line appended to every line
+  truncate -- True to empty the file, False to append to it
+  maxBytes -- buffered size which triggers a write to the file
+  maxDelay -- age in seconds of the oldest buffered line which triggers a write
+  fsync -- FsyncNever, FsyncOnFlush (data forced to disk at every write) or
+      FsyncOnClose (forced to disk at the end of the sounding only)
+  stats -- RunStats receiving the duration of every write to the file
+      ("flush" timer), None not to time them
+
+  BytesWritten counts the bytes written to the file.
+  """
+
+  def __init__(self, path, lineEnd="\n", truncate=False, maxBytes=16384,
+               maxDelay=1.0, fsync=FsyncNever, stats=None):
+    CheckFsync(fsync)
+    self.Path = path
+    self.LineEnd = lineEnd
+    self.MaxBytes = maxBytes
+    self.MaxDelay = maxDelay
+    self.Fsync = fsync
+    self.Stats = stats
+    self.BytesWritten = 0
+    self.Lines = []
+    self.Size = 0
+    self.FirstLineTime = None
+    if truncate :
+      self.File = open(path, "wb")
+    else :
+      self.File = open(path, "ab")
+
+  def WriteLine(self, line):
+    """Buffer one line and write the buffer if a threshold is reached."""
+    self.Write((line + self.LineEnd).encode("utf-8"))
+
+  def Write(self, data):
+    """Buffer raw bytes and write the buffer if a threshold is reached."""
+    if self.FirstLineTime is None :
+      self.FirstLineTime = time.time()
+    self.Lines.append(data)
+    self.Size += len(data)
+    if self.Size >= self.MaxBytes or time.time() - self.FirstLineTime >= self.MaxDelay :
+      self.Flush()
+
+  def FlushIfDue(self):
+    """Write the buffer if its oldest line is maxDelay old. To be called on
+    every event, so that buffered lines are written in time even when no
+    new line comes (frames stopped, telemetry lost)."""
+    if self.FirstLineTime is not None and time.time() - self.FirstLineTime >= self.MaxDelay :
+      self.Flush()
+
+  def Flush(self):
+    """Write buffered lines to the file."""
+    if self.File is None :
+      return
+    if self.Stats is not None :
+      start = Clock()
+    if self.Lines :
+      self.File.write(b"".join(self.Lines))
+      self.BytesWritten += self.Size
+      self.Lines = []
+      self.Size = 0
+      self.FirstLineTime = None
+    self.File.flush()
+    if self.Fsync == FsyncOnFlush :
+      self.Sync()
+    if self.Stats is not None :
+      self.Stats.Time("flush", Clock() - start)
+
+  def Sync(self):
+    """Force written data to disk."""
+    try :
+      os.fsync(self.File.fileno())
+    except (AttributeError, OSError) :
+      pass
+
+  def Close(self):
+    """Write buffered lines and close the file."""
+    if self.File is None :
+      return
+    self.Flush()
+    if self.Fsync == FsyncOnClose :
+      self.Sync()
+    self.File.close()
+    self.File = None
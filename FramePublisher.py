@@ -0,0 +1,125 @@
+#####################################################################################################################
+#
+#       Module name      : FramePublisher.py
+#       Context          : Used by WriteXData.py and NewRawData.py (MW41 / IronPython) and by the viewer (Python 3)
+#
+#       Original release : 2021
+#
+#       Publishing of the frames as they arrive, one UDP datagram per frame, to a multicast group
+#       (several viewers on the network) or to one address (e.g. 127.0.0.1). A frame is sent as the
+#       record of the binary record files (BinaryRecord) after a message prefix; the layout of the
+#       records is sent at the start of the sounding and again every few seconds, so a viewer can
+#       join during the flight. Sending never blocks the script : a datagram which cannot be sent is
+#       counted and lost.
+#
+#       Message : magic (4s) + version (B) + kind (B) + sequence (I) + sounding start (14s,
+#                 yyyyMMddHHmmss) + RadiosondeId (16s, NUL padded), then the BinaryRecord header
+#                 (layout message) or one record.
+#
+#####################################################################################################################
+
+import socket
+import struct
+
+from RunStats import Clock
+
+Magic = b"RS41"
+Version = 1
+
+# kinds of message, the layout of a kind has LayoutFlag set
+KindXData = 1
+KindPtu = 2
+LayoutFlag = 0x80
+
+DefaultGroup = "239.41.41.41"
+DefaultPort = 4141
+
+_Prefix = struct.Struct("<4sBBI14s16s")
+PrefixSize = _Prefix.size
+
+
+def ParseDestination(text):
+  """(host, port) of a 'host:port' or 'host' string, DefaultPort by default."""
+  if ":" in text :
+    host, port = text.rsplit(":", 1)
+    return (host or DefaultGroup, int(port))
+  return (text or DefaultGroup, DefaultPort)
+
+
+def IsMulticast(host):
+  """True for an IPv4 multicast address (224.0.0.0 to 239.255.255.255)."""
+  try :
+    first = int(host.split(".")[0])
+  except ValueError :
+    return False
+  return 224 <= first <= 239
+
+
+def ParseMessage(data):
+  """Returns (kind, layout, sequence, start, radiosondeId, payload) of a
+  message, None if data is not a message of this version."""
+  if len(data) < PrefixSize :
+    return None
+  magic, version, kind, sequence, start, radiosondeId = _Prefix.unpack_from(data, 0)
+  if magic != Magic or version != Version :
+    return None
+  return (kind & ~LayoutFlag, bool(kind & LayoutFlag), sequence,
+          start.rstrip(b"\0").decode("ascii"), radiosondeId.rstrip(b"\0").decode("ascii"),
+          data[PrefixSize:])
+
+
+class FramePublisher(object):
+  """Sends the records of a sounding as UDP datagrams.
+
+  Arguments:
+  destination -- 'host:port', a multicast group or an address
+  ttl -- hops of the multicast datagrams (1 : local network)
+  layoutInterval -- seconds between two layout messages of a kind
+  """
+
+  def __init__(self, destination, ttl=1, layoutInterval=5.0):
+    self.Address = ParseDestination(destination)
+    self.LayoutInterval = layoutInterval
+    self.Socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if IsMulticast(self.Address[0]) :
+      self.Socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    # un datagramme qui ne part pas est perdu, le script n'attend pas
+    self.Socket.setblocking(False)
+    self.Stream = None
+    self.Formats = {}
+    self.Sent = 0
+    self.Errors = 0
+
+  def Start(self, start, radiosondeId):
+    """Start publishing a sounding : start time 'yyyyMMddHHmmss' and RadiosondeId."""
+    self.Stream = (start.encode("ascii"), radiosondeId.encode("ascii", "replace"))
+    for kind in self.Formats :
+      self.Formats[kind] = [self.Formats[kind][0], 0, None]
+
+  def Declare(self, kind, recordFormat):
+    """Record layout (BinaryRecord.RecordFormat) of a kind of message."""
+    self.Formats[kind] = [recordFormat, 0, None]
+
+  def Publish(self, kind, record):
+    """Send one record packed by the RecordFormat of its kind; nothing is
+    sent before Start()."""
+    if self.Stream is None :
+      return
+    state = self.Formats[kind]
+    now = Clock()
+    if state[2] is None or now - state[2] >= self.LayoutInterval :
+      state[2] = now
+      self.Send(kind | LayoutFlag, state[1], state[0].Header)
+    self.Send(kind, state[1], record)
+    state[1] = (state[1] + 1) & 0xFFFFFFFF
+
+  def Send(self, kind, sequence, payload):
+    message = _Prefix.pack(Magic, Version, kind, sequence, self.Stream[0], self.Stream[1]) + payload
+    try :
+      self.Socket.sendto(message, self.Address)
+      self.Sent += 1
+    except socket.error :
+      self.Errors += 1
+
+  def Close(self):
+    self.Socket.close()
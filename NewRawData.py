@@ -19,7 +19,7 @@ import sys
 from System import Array
 from System import Type
 from System import DateTime
-from System.IO import Directory
+from System.IO import Directory, Path
 from System.Globalization import CultureInfo
 from math import *
 
@@ -27,6 +27,7 @@ clr.AddReference('IScripting')
 clr.AddReference('SystemEvent')
 clr.AddReference('DataTypes')
 clr.AddReference('ILogService')
+from Vaisala.Framework.Log import LogCategory
 from Vaisala.Soundings.Framework import IExecutableScript
 from Vaisala.Soundings.Framework import ISounding
 from Vaisala.Soundings.Framework.DataTypes import SystemEvent
@@ -34,6 +35,11 @@ from Vaisala.Soundings.Framework.DataTypes.GPS import GPSResult
 from Vaisala.Soundings.Framework.DataTypes.GPS import WindSolutionStatus
 from Vaisala.Soundings.Framework.DataTypes.PTU import RawPtu
 
+from BufferedWriter import BufferedWriter, FsyncNever, CheckFsync
+from BinaryRecord import BinaryRecordWriter, RecordFormat, PtuFields, EpochSeconds, Value
+from TimeJoin import TimeJoin
+from RunStats import RunStats, Clock
+from FramePublisher import FramePublisher, KindPtu
 
 CommentValue = 'FREE_TEXT'
 
@@ -46,15 +52,36 @@ class NewRawData(IExecutableScript):
     -f <directory path> 
         Directory where where location file is written.
         Files are named as RadiosondeLocation_[yyyyMMddHHmmss].txt.
+    -s <never|flush|close>
+        When written data is forced to disk (fsync), default never.
+    -b
+        Also write the data lines to a binary record file
+        RawData_[yyyyMMddHHmmss]_[RadiosondeId].bin.
+    -t <seconds>
+        Count the events and the lines written or dropped and time their
+        handling (RunStats); logged every <seconds> and at the end.
+    -p <address:port>
+        Also publish every data line as a UDP datagram holding its binary
+        record (FramePublisher), to a multicast group or to one address.
   """
   import sys
   LineEnd = "\r\n"
   MissingData = -32768
-  Version = "1.1." + filter(str.isdigit, "$Revision: 0 $")
+  Version = "1.1." + "".join(filter(str.isdigit, "$Revision: 0 $"))
   RadioResetTime = None
-  LatestLocation = None
-  LatestRawPTU = None
+  Join = None
+  # seconds to wait for the RawPtu or GPSResult of a second
+  JoinTimeout = 3
   WriteDir = "C:\\data"
+  Writer = None
+  Fsync = FsyncNever
+  Binary = False
+  BinaryWriter = None
+  Stats = None
+  StatsInterval = 60.0
+  LastStatsLog = 0.0
+  Publisher = None
+  Format = RecordFormat(PtuFields)
   
   def __init__(self, args):
     i = 0    
@@ -63,6 +90,24 @@ class NewRawData(IExecutableScript):
         i = i + 1
         if (i < len(args)) :
           self.WriteDir = args[i]
+      elif (args[i] == "-s") :
+        i = i + 1
+        if (i < len(args)) :
+          # erreur au chargement du script plutôt qu'au lâcher
+          self.Fsync = CheckFsync(args[i])
+      elif (args[i] == "-b") :
+        self.Binary = True
+      elif (args[i] == "-t") :
+        i = i + 1
+        if (i < len(args)) :
+          self.StatsInterval = float(args[i])
+        self.Stats = RunStats()
+        self.LastStatsLog = Clock()
+      elif (args[i] == "-p") :
+        i = i + 1
+        if (i < len(args)) :
+          self.Publisher = FramePublisher(args[i])
+          self.Publisher.Declare(KindPtu, self.Format)
       i = i + 1
 
     if not Directory.Exists(self.WriteDir) :
@@ -97,9 +142,43 @@ class NewRawData(IExecutableScript):
     
     """
     
-    method_name = 'handle_' + str(data.GetType().Name)
-    method = getattr(self, method_name)
+    dataname = str(data.GetType().Name)
+    method = getattr(self, 'handle_' + dataname)
+    if self.Stats == None :
+      method(data)
+      self.FlushIfDue()
+      return
+    start = Clock()
     method(data)
+    self.FlushIfDue()
+    self.Stats.Time(dataname, Clock() - start)
+    if start - self.LastStatsLog >= self.StatsInterval :
+      self.LogStats()
+
+  def FlushIfDue(self):
+    """Write the lines buffered for more than 1 s, even if no line comes."""
+    if self.Writer != None :
+      self.Writer.FlushIfDue()
+    if self.BinaryWriter != None :
+      self.BinaryWriter.FlushIfDue()
+
+  def LogStats(self):
+    """ Log the counters and timers of the script (option -t) """
+
+    self.LastStatsLog = Clock()
+    if self.Join != None :
+      self.Stats.Set("missing_ptu", self.Join.MissingPtu)
+      self.Stats.Set("missing_gps", self.Join.MissingGps)
+      self.Stats.Set("late_dropped", self.Join.Late)
+    if self.Writer != None :
+      self.Stats.Set("bytes", self.Writer.BytesWritten)
+    if self.BinaryWriter != None :
+      self.Stats.Set("binary_bytes", self.BinaryWriter.Writer.BytesWritten)
+    if self.Publisher != None :
+      self.Stats.Set("published", self.Publisher.Sent)
+      self.Stats.Set("publish_errors", self.Publisher.Errors)
+    for line in self.Stats.SummaryLines() :
+      SoundingInterface.Log(LogCategory.info, "RawData stats: " + line)
 
   def handle_SystemEvent(self, event):
     """ Handle sounding system events.
@@ -123,111 +202,165 @@ class NewRawData(IExecutableScript):
     self.RadiosondeId = SoundingInterface.GetRadiosonde().ID
     soundingInfo = SoundingInterface.GetSoundingInformation()
     self.RadioResetTime = soundingInfo.RadioResetTime
-    self.WriteFile = self.WriteDir + "\\RawData_" +  soundingInfo.SoundingStartTime.ToString("yyyyMMddHHmmss", CultureInfo.InvariantCulture)  + "_" + self.RadiosondeId + ".txt"
+    self.Join = TimeJoin(self.WriteDataLine, self.JoinTimeout)
+    self.WriteFile = Path.Combine(self.WriteDir, "RawData_" +  soundingInfo.SoundingStartTime.ToString("yyyyMMddHHmmss", CultureInfo.InvariantCulture)  + "_" + self.RadiosondeId + ".txt")
     self.CleanFile()
 #    self.WriteLine("");
 #    self.WriteLine("Radiosonde: " + self.RadiosondeId)
 #    self.WriteLine("");
     self.WriteLine("Date Time P T RH DD FF V U Height Lon Lat VV")
+    if self.Binary :
+      if self.BinaryWriter != None :
+        self.BinaryWriter.Close()
+      binFile = self.WriteFile[:-len(".txt")] + ".bin"
+      self.BinaryWriter = BinaryRecordWriter(BufferedWriter(binFile, truncate=True, fsync=self.Fsync,
+                                                            stats=self.Stats), self.Format)
+    if self.Publisher != None :
+      self.Publisher.Start(soundingInfo.SoundingStartTime.ToString("yyyyMMddHHmmss", CultureInfo.InvariantCulture), self.RadiosondeId)
     
   def Stop(self):
     """ Stop reporting radiosonde location """
     soundingInfo = SoundingInterface.GetSoundingInformation()
-    rawFile = open(self.WriteFile, "a")
+    if self.Join != None :
+      self.Join.Flush()
+      SoundingInterface.Log(LogCategory.info, "RawData lines: %d complete, %d without PTU, %d without GPS, %d late events dropped"
+                            % (self.Join.Complete, self.Join.MissingPtu, self.Join.MissingGps, self.Join.Late))
     comments = SoundingInterface.GetSoundingMetadata(CommentValue)
     if (comments) :
-      edtFile.write("Comments: " + comments + "\n")
-    rawFile.close()
+      self.WriteLine("Comments: " + comments)
+    if self.Writer != None :
+      self.Writer.Close()
+    if self.BinaryWriter != None :
+      self.BinaryWriter.Close()
+    if self.Stats != None :
+      self.LogStats()
+    if self.Publisher != None :
+      SoundingInterface.Log(LogCategory.info, "RawData lines published: %d datagrams, %d not sent"
+                            % (self.Publisher.Sent, self.Publisher.Errors))
+      self.Publisher.Close()
+      self.Publisher = None
+    self.Writer = None
+    self.BinaryWriter = None
 
   def handle_GPSResult(self, location):
-    """ Update latest location """
+    """ Queue location for its RadioRxTime second """
     
     if self.RadioResetTime != None :
       # MW41 updates GPS results. Here we are using unfiltered GPS results.
-      if self.LatestLocation == None or location.RadioRxTime > self.LatestLocation.RadioRxTime :
-        self.LatestLocation = location
-        self.WriteDataLine()
+      self.Join.AddGps(location.RadioRxTime, location)
     
   def handle_RawPtu(self, RawPTU):
-    """ Update latest RawPTU """
+    """ Queue RawPTU for its RadioRxTime second """
     
     if self.RadioResetTime != None :
       # MW41 updates RawPTU results. Here we are using unfiltered RawPTU results.
-      if self.LatestRawPTU == None or RawPTU.RadioRxTime > self.LatestRawPTU.RadioRxTime :
-        self.LatestRawPTU = RawPTU
-        self.WriteDataLine()
+      self.Join.AddPtu(RawPTU.RadioRxTime, RawPTU)
+
+  def WriteDataLine(self, second, ptu, location):
+    """ Write data line of one RadioRxTime second to output file
 
-  def WriteDataLine(self):
-    """ Write data line to output file """
+    Arguments:
+    second -- RadioRxTime second
+    ptu -- RawPtu of the second, None if it did not arrive in time
+    location -- GPSResult of the second, None if it did not arrive in time
+    """
     
-    if self.LatestRawPTU != None and self.LatestLocation != None and \
-       round(self.LatestRawPTU.RadioRxTime,0) == round(self.LatestLocation.RadioRxTime,0) :
-
-      # Date and time
-      date = self.RadioResetTime.AddSeconds(self.LatestRawPTU.RadioRxTime)
-      row = date.ToString("yyyy-MM-dd HH:mm:ss", CultureInfo.InvariantCulture)
-      # Pression
-      if self.LatestRawPTU.IsPressureOk == False :
-        row += " %.2f" % (self.MissingData)
-      else :
-        row += " %.2f" % (self.LatestRawPTU.Pressure)
-      # Temperature
-      if self.LatestRawPTU.IsTemperatureOk == False :
-        row += " %.2f" % (self.MissingData)
-      else :
-        row += " %.2f" % (self.LatestRawPTU.Temperature)
-      # Humidity (RS41 : T-corrected humidity)
-      if self.LatestRawPTU.IsHumidityOk == False :
-        row += " %.2f" % (self.MissingData)
-      else :
-        row += " %.2f" % (self.LatestRawPTU.Humidity1)
-
-     # GPS data
-      if self.LatestLocation.Status == WindSolutionStatus.Autonomous or \
-         self.LatestLocation.Status == WindSolutionStatus.Differential :
-        u = self.LatestLocation.WindEast
-        v = self.LatestLocation.WindNorth
-        if u != self.MissingData and v != self.MissingData:
-          dd = atan2(-u,-v) * 180/pi
-          if dd <= 0:
-            dd += 360
-          ff = sqrt(u*u + v*v)
-        else:
-          dd = self.MissingData
-          ff = self.MissingData
-        # Wind direction
-        row += " %.0f" % (dd)
-        # Wind speed
-        row += " %.2f" % (ff)
-        # Wind speed, north component (Filtered north wind)
-        row += " %.2f" % (v)
-        # Wind speed, east component (Filtered east wind)
-        row += " %.2f" % (u)
-        # Geometric height from sea level
-        row += " %.0f" % (self.LatestLocation.GeometricHeightFromSeaLevel)
-         # Longitude (Position WGS84 coordinates)
-        row += " %.6f" % (self.LatestLocation.PositionWgs84.Longitude)
-        # Latitude (Position WGS84 coordinates)
-        row += " %.6f" % (self.LatestLocation.PositionWgs84.Latitude)
-
-      # Ascent rate
-      row += " %.2f" % (self.LatestRawPTU.AscentRate)
-
-      wFile = open(self.WriteFile, "ab")
-      wFile.write(row + self.LineEnd)
-      wFile.close()  
+    # Date and time
+    if ptu != None :
+      date = self.RadioResetTime.AddSeconds(ptu.RadioRxTime)
+    else :
+      date = self.RadioResetTime.AddSeconds(location.RadioRxTime)
+    row = date.ToString("yyyy-MM-dd HH:mm:ss", CultureInfo.InvariantCulture)
+    # Same values for the binary record file, missing data stay NaN
+    record = {"time" : EpochSeconds(date.ToString("yyyy-MM-dd HH:mm:ss.fff", CultureInfo.InvariantCulture)),
+              "rx_time" : float(second)}
+    if ptu != None :
+      record["rx_time"] = Value(ptu.RadioRxTime)
+    # Pression
+    if ptu == None or ptu.IsPressureOk == False :
+      row += " %.2f" % (self.MissingData)
+    else :
+      row += " %.2f" % (ptu.Pressure)
+      record["pressure"] = Value(ptu.Pressure)
+    # Temperature
+    if ptu == None or ptu.IsTemperatureOk == False :
+      row += " %.2f" % (self.MissingData)
+    else :
+      row += " %.2f" % (ptu.Temperature)
+      record["temperature"] = Value(ptu.Temperature)
+    # Humidity (RS41 : T-corrected humidity)
+    if ptu == None or ptu.IsHumidityOk == False :
+      row += " %.2f" % (self.MissingData)
+    else :
+      row += " %.2f" % (ptu.Humidity1)
+      record["humidity"] = Value(ptu.Humidity1)
+
+   # GPS data
+    if location != None and \
+       (location.Status == WindSolutionStatus.Autonomous or \
+        location.Status == WindSolutionStatus.Differential) :
+      u = location.WindEast
+      v = location.WindNorth
+      if u != self.MissingData and v != self.MissingData:
+        dd = atan2(-u,-v) * 180/pi
+        if dd <= 0:
+          dd += 360
+        ff = sqrt(u*u + v*v)
+      else:
+        dd = self.MissingData
+        ff = self.MissingData
+      # Wind direction
+      row += " %.0f" % (dd)
+      # Wind speed
+      row += " %.2f" % (ff)
+      # Wind speed, north component (Filtered north wind)
+      row += " %.2f" % (v)
+      # Wind speed, east component (Filtered east wind)
+      row += " %.2f" % (u)
+      # Geometric height from sea level
+      row += " %.0f" % (location.GeometricHeightFromSeaLevel)
+       # Longitude (Position WGS84 coordinates)
+      row += " %.6f" % (location.PositionWgs84.Longitude)
+      # Latitude (Position WGS84 coordinates)
+      row += " %.6f" % (location.PositionWgs84.Latitude)
+      record["windDirection"] = Value(dd)
+      record["windSpeed"] = Value(ff)
+      record["v"] = Value(v)
+      record["u"] = Value(u)
+      record["altitude"] = Value(location.GeometricHeightFromSeaLevel)
+      record["longitude"] = Value(location.PositionWgs84.Longitude)
+      record["latitude"] = Value(location.PositionWgs84.Latitude)
+
+    # Ascent rate
+    if ptu == None :
+      row += " %.2f" % (self.MissingData)
+    else :
+      row += " %.2f" % (ptu.AscentRate)
+      record["ascentRate"] = Value(ptu.AscentRate)
+
+    self.WriteLine(row)
+    if self.Stats != None :
+      self.Stats.Count("lines")
+    if self.BinaryWriter != None or self.Publisher != None :
+      data = self.Format.Pack(record)
+      if self.BinaryWriter != None :
+        self.BinaryWriter.WritePacked(data)
+      if self.Publisher != None :
+        self.Publisher.Publish(KindPtu, data)
 
   def CleanFile(self):
-    """ Write empty output file """
+    """ Write empty output file, kept open until the end of the sounding """
 
-    wFile = open(self.WriteFile, "wb")
-    wFile.write('')
-    wFile.close()  
+    if self.Writer != None :
+      self.Writer.Close()
+    self.Writer = BufferedWriter(self.WriteFile, self.LineEnd, truncate=True, fsync=self.Fsync,
+                                 stats=self.Stats)
+    self.Writer.Flush()
 
   def WriteLine(self, line):
     """ Write line to output file """
 
-    wFile = open(self.WriteFile, "ab")
-    wFile.write(line + self.LineEnd)
-    wFile.close()  
+    if self.Writer == None :
+      self.Writer = BufferedWriter(self.WriteFile, self.LineEnd, fsync=self.Fsync, stats=self.Stats)
+    self.Writer.WriteLine(line)  
  
@@ -0,0 +1,144 @@
+#####################################################################################################################
+#
+#       Module name      : ProfileBins.py
+#       Context          : Used by WriteProfile.py (MW41 / IronPython) and by the viewer (Python 3)
+#
+#       Original release : 2021
+#
+#       Vertical profile of a sounding built as the samples arrive : each sample is added to the
+#       fixed altitude layer it belongs to, which keeps the count, sum, minimum and maximum of every
+#       field. Adding a sample costs the same whatever the length of the flight, and the profile is
+#       available at any time without reading the history again. Ascent and descent are kept apart.
+#
+#####################################################################################################################
+
+from math import floor
+
+from XDataInstruments import __MissingData__, IsMissing
+
+
+class LayerStats(object):
+  """Count, sum, minimum and maximum of the fields of one layer."""
+
+  def __init__(self):
+    self.Samples = 0
+    self.Count = {}
+    self.Sum = {}
+    self.Min = {}
+    self.Max = {}
+
+  def Add(self, values):
+    self.Samples += 1
+    for (name, value) in values.items() :
+      if IsMissing(value) :
+        continue
+      if name in self.Count :
+        self.Count[name] += 1
+        self.Sum[name] += value
+        if value < self.Min[name] :
+          self.Min[name] = value
+        elif value > self.Max[name] :
+          self.Max[name] = value
+      else :
+        self.Count[name] = 1
+        self.Sum[name] = value
+        self.Min[name] = value
+        self.Max[name] = value
+
+  def Mean(self, name):
+    """Mean of a field, None when the layer has no valid value of it."""
+    if not self.Count.get(name) :
+      return None
+    return self.Sum[name] / self.Count[name]
+
+
+class AltitudeProfile(object):
+  """Fields of a sounding binned in altitude layers.
+
+  Arguments:
+  layer -- thickness of the layers (m)
+  burstDrop -- drop (m) below the highest altitude reached from which the
+      samples go to the descent profile
+  """
+
+  Phases = ("ascent", "descent")
+
+  def __init__(self, layer=100.0, burstDrop=500.0):
+    self.Layer = float(layer)
+    self.BurstDrop = burstDrop
+    self.Fields = []
+    self.Known = set()
+    self.Layers = {"ascent" : {}, "descent" : {}}
+    self.MaxAltitude = None
+    self.Descending = False
+    self.Samples = 0
+
+  def Add(self, altitude, values):
+    """Add one sample : altitude (m) and a dict of field values. Returns
+    False when the altitude is missing and the sample is not used."""
+    if IsMissing(altitude) :
+      return False
+    if self.MaxAltitude is None or altitude > self.MaxAltitude :
+      self.MaxAltitude = altitude
+    elif not self.Descending and altitude < self.MaxAltitude - self.BurstDrop :
+      self.Descending = True
+    if self.Descending :
+      layers = self.Layers["descent"]
+    else :
+      layers = self.Layers["ascent"]
+    index = int(floor(altitude / self.Layer))
+    stats = layers.get(index)
+    if stats is None :
+      stats = layers[index] = LayerStats()
+    for name in values :
+      if name not in self.Known :
+        self.Known.add(name)
+        self.Fields.append(name)
+    stats.Add(values)
+    self.Samples += 1
+    return True
+
+  def AddColumns(self, altitudes, columns):
+    """Add samples given as an altitude sequence and a dict of sequences."""
+    names = list(columns.keys())
+    added = 0
+    for (altitude, row) in zip(altitudes, zip(*[columns[name] for name in names])) :
+      if self.Add(altitude, dict(zip(names, row))) :
+        added += 1
+    return added
+
+  def Columns(self, phase="ascent"):
+    """Profile of one phase as a dict of lists, one item per layer from the
+    lowest : bottom, top, count, then <field>_mean, _min and _max (None
+    when the layer has no valid value of the field)."""
+    layers = self.Layers[phase]
+    indexes = sorted(layers.keys())
+    columns = {"bottom" : [i * self.Layer for i in indexes],
+               "top" : [(i + 1) * self.Layer for i in indexes],
+               "count" : [layers[i].Samples for i in indexes]}
+    for name in self.Fields :
+      columns[name + "_mean"] = [layers[i].Mean(name) for i in indexes]
+      columns[name + "_min"] = [layers[i].Min.get(name) for i in indexes]
+      columns[name + "_max"] = [layers[i].Max.get(name) for i in indexes]
+    return columns
+
+  def SummaryLines(self, separator=" "):
+    """Lines of the profile summary : column names, then one line per layer
+    of the ascent and of the descent, missing values as -32768.00."""
+    names = ["phase", "bottom", "top", "count"]
+    for name in self.Fields :
+      names.extend([name + "_mean", name + "_min", name + "_max"])
+    lines = [separator.join(names)]
+    for phase in self.Phases :
+      columns = self.Columns(phase)
+      for i in range(len(columns["bottom"])) :
+        row = [phase, "%.0f" % columns["bottom"][i], "%.0f" % columns["top"][i],
+               "%d" % columns["count"][i]]
+        for name in names[4:] :
+          value = columns[name][i]
+          if value is None :
+            row.append("%.2f" % __MissingData__)
+          else :
+            row.append("%.6g" % value)
+        lines.append(separator.join(row))
+    return lines
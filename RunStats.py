@@ -0,0 +1,68 @@
+#####################################################################################################################
+#
+#       Module name      : RunStats.py
+#       Context          : Used by WriteXData.py and NewRawData.py (MW41 / IronPython) and by the viewer (Python 3)
+#
+#       Original release : 2021
+#
+#       Counters and timers of a running script or viewer stage : events received per type, lines
+#       written, bytes, time spent per call... A RunStats is only created when the statistics are
+#       asked for; the callers test it against None, so that nothing is counted nor timed otherwise.
+#       A RunStats is updated by one thread at a time.
+#
+#####################################################################################################################
+
+try :
+  from time import perf_counter as Clock
+except ImportError :
+  # IronPython 2.7 : time.clock is a high resolution counter
+  from time import clock as Clock
+
+
+class RunStats(object):
+  """Named counters and timers (count, total and maximum duration)."""
+
+  def __init__(self):
+    self.Counters = {}
+    self.Timers = {}
+    self.Started = Clock()
+
+  def Count(self, name, n=1):
+    """Add n to a counter."""
+    self.Counters[name] = self.Counters.get(name, 0) + n
+
+  def Set(self, name, value):
+    """Set a counter which is kept elsewhere (e.g. bytes written by a writer)."""
+    self.Counters[name] = value
+
+  def Time(self, name, seconds):
+    """Add one duration (s) to a timer."""
+    timer = self.Timers.get(name)
+    if timer is None :
+      self.Timers[name] = [1, seconds, seconds]
+    else :
+      timer[0] += 1
+      timer[1] += seconds
+      if seconds > timer[2] :
+        timer[2] = seconds
+
+  def Snapshot(self):
+    """Counters and timers as a dict of plain values (durations in ms)."""
+    timers = {}
+    for (name, timer) in list(self.Timers.items()) :
+      (count, total, longest) = timer
+      timers[name] = {"count" : count, "total_ms" : total * 1e3,
+                      "mean_ms" : total / count * 1e3, "max_ms" : longest * 1e3}
+    return {"elapsed_s" : Clock() - self.Started,
+            "counters" : dict(self.Counters), "timers" : timers}
+
+  def SummaryLines(self):
+    """Counters on one line, then one line per timer."""
+    snapshot = self.Snapshot()
+    counters = snapshot["counters"]
+    lines = [", ".join(["%s %s" % (name, counters[name]) for name in sorted(counters.keys())])]
+    for name in sorted(snapshot["timers"].keys()) :
+      timer = snapshot["timers"][name]
+      lines.append("%s: %d x %.3f ms (max %.3f ms, total %.0f ms)"
+                   % (name, timer["count"], timer["mean_ms"], timer["max_ms"], timer["total_ms"]))
+    return lines
@@ -0,0 +1,116 @@
+#####################################################################################################################
+#
+#       Module name      : TimeJoin.py
+#       Context          : Used by NewRawData.py (Vaisala MW41 Sounding System)
+#
+#       Original release : 2021
+#
+#       Pairs the RawPtu and GPSResult events of the same RadioRxTime second. Unmatched halves wait in a
+#       ring buffer indexed by the second; a second is emitted when both halves are there, or with the
+#       missing half as None once it is Timeout seconds older than the newest event. Seconds are emitted
+#       in increasing order. Work per event is constant (amortized).
+#
+#####################################################################################################################
+
+from math import floor
+
+
+def Second(rxTime):
+  """Integer RadioRxTime second of an event."""
+  return int(floor(rxTime + 0.5))
+
+
+class TimeJoin(object):
+  """Time-keyed join buffer of PTU and GPS records.
+
+  Arguments:
+  emit -- function called as emit(second, ptu, gps); ptu or gps is None
+      when that half did not arrive in time
+  timeout -- seconds to wait for a missing half
+  """
+
+  def __init__(self, emit, timeout=3):
+    self.Emit = emit
+    self.Timeout = timeout
+    self.Size = timeout + 1
+    # slot = [second, ptu, gps]
+    self.Slots = [[None, None, None] for i in range(self.Size)]
+    self.Next = None
+    self.Newest = None
+    # counters
+    self.Complete = 0
+    self.MissingPtu = 0
+    self.MissingGps = 0
+    self.Late = 0
+
+  def AddPtu(self, rxTime, ptu):
+    self.Add(Second(rxTime), 1, ptu)
+
+  def AddGps(self, rxTime, gps):
+    self.Add(Second(rxTime), 2, gps)
+
+  def Add(self, second, half, record):
+    """Store one half (1 = PTU, 2 = GPS) of a second and emit what is ready."""
+    if self.Next is None :
+      self.Next = second
+      self.Newest = second
+    if second < self.Next :
+      # second already emitted or given up
+      self.Late += 1
+      return
+    if second > self.Newest :
+      # seconds which no longer fit in the ring are emitted as they are
+      oldest = second - self.Size + 1
+      if self.Next < oldest :
+        for k in range(self.Next, min(oldest, self.Newest + 1)) :
+          self.EmitSlot(k)
+        self.Next = oldest
+      self.Newest = second
+    slot = self.Slots[second % self.Size]
+    if slot[0] != second :
+      slot[0] = second
+      slot[1] = None
+      slot[2] = None
+    # a newer event of the same second replaces the previous one
+    slot[half] = record
+    self.Drain()
+
+  def Drain(self):
+    """Emit the seconds which are complete or timed out, in order."""
+    while self.Next <= self.Newest :
+      slot = self.Slots[self.Next % self.Size]
+      if slot[0] == self.Next and slot[1] is not None and slot[2] is not None :
+        self.EmitSlot(self.Next)
+      elif self.Newest - self.Next >= self.Timeout :
+        self.EmitSlot(self.Next)
+      else :
+        break
+      self.Next += 1
+
+  def EmitSlot(self, second):
+    """Emit and clear the slot of a second, if it holds data of that second."""
+    slot = self.Slots[second % self.Size]
+    if slot[0] != second :
+      return
+    ptu = slot[1]
+    gps = slot[2]
+    slot[0] = None
+    slot[1] = None
+    slot[2] = None
+    if ptu is None and gps is None :
+      return
+    if ptu is None :
+      self.MissingPtu += 1
+    elif gps is None :
+      self.MissingGps += 1
+    else :
+      self.Complete += 1
+    self.Emit(second, ptu, gps)
+
+  def Flush(self):
+    """Emit every waiting second, at the end of the sounding."""
+    if self.Next is None :
+      return
+    while self.Next <= self.Newest :
+      self.EmitSlot(self.Next)
+      self.Next += 1
@@ -0,0 +1,226 @@
+#####################################################################################################################
+#
+#       Module name      : WriteProfile.py
+#       Context          : Applicable with Vaisala MW41 Sounding System
+#
+#       Original release : 2021
+#
+#       Script to bin the XData frames, with the pressure and temperature of the radiosonde, in
+#       altitude layers during the sounding and to write the profile summary at its end
+#       (Profile_[yyyyMMddHHmmss]_[RadiosondeId].txt).
+#
+#####################################################################################################################
+
+#####################################################################################################################
+#
+# Import required Python modules.
+#
+#####################################################################################################################
+
+import clr
+import sys
+from System import Array
+from System import Type
+from System.IO import Directory, Path
+from System.Globalization import CultureInfo
+
+clr.AddReference('IScripting')
+clr.AddReference('SystemEvent')
+clr.AddReference('DataTypes')
+clr.AddReference('ILogService')
+
+from Vaisala.Framework.Log import LogCategory
+from Vaisala.Soundings.Framework import IExecutableScript
+from Vaisala.Soundings.Framework import ISounding
+from Vaisala.Soundings.Framework.DataTypes import SystemEvent
+from Vaisala.Soundings.Framework.DataTypes import AdditionalSensorData
+from Vaisala.Soundings.Framework.DataTypes.GPS import GPSResult
+from Vaisala.Soundings.Framework.DataTypes.GPS import WindSolutionStatus
+from Vaisala.Soundings.Framework.DataTypes.PTU import RawPtu
+
+from BufferedWriter import BufferedWriter
+from XDataInstruments import Registry
+from ProfileBins import AltitudeProfile
+
+
+#####################################################################################################################
+# Defines used in the script.
+#####################################################################################################################
+
+__Version__ = "1.0." + "".join(filter(str.isdigit, "$Revision: 0 $"))
+__MissingData__ = -32768.0
+__ColumnSeparator__ = " "
+
+#################################################################################
+#
+# WriteProfile class for implementing the script.
+# Note that file should be named same as executed class.
+#
+#################################################################################
+
+class WriteProfile(IExecutableScript):
+  """Vertical profile of the XData frames.
+
+  Each XData frame is decoded (XDataInstruments.Registry) and added, with
+  the last pressure and temperature of the radiosonde, to the altitude
+  layer of the radiosonde at the time of the frame (ProfileBins). The
+  altitude is interpolated, or extrapolated, by RadioRxTime from the last
+  two GPS results. At SoundingCompleted the profile summary is written;
+  nothing is read again from the data files.
+
+  Command line options:
+    -f <directory path>
+        Directory where the profile file is written.
+    -l <meters>
+        Thickness of the layers, default 100 m.
+  """
+
+  # largest time distance (s) between a frame and the PTU or GPS data used for it
+  MaxGap = 2.0
+
+  def __init__(self, args):
+    """Initialize script
+
+      Arguments:
+      args -- Array of command line arguments.
+
+    """
+
+    self.WriteDir = "C:\\data"
+    self.LayerThickness = 100.0
+    self.Profile = None
+    self.Ptu = None
+    self.Gps = []
+
+    # Read command line options.
+    i = 0
+    while (i < len(args)) :
+      if (args[i] == "-f") :
+        i = i + 1
+        if (i < len(args)) :
+          self.WriteDir = args[i]
+      elif (args[i] == "-l") :
+        i = i + 1
+        if (i < len(args)) :
+          self.LayerThickness = float(args[i])
+      i = i + 1
+
+    if not Directory.Exists(self.WriteDir) :
+      Directory.CreateDirectory(self.WriteDir)
+
+    # Order notifications from Sounding system
+    types = Array[Type]([clr.GetClrType(SystemEvent),
+                         clr.GetClrType(GPSResult),
+                         clr.GetClrType(RawPtu),
+                         clr.GetClrType(AdditionalSensorData)])
+    SoundingInterface.OrderNotifications(types)
+
+  def get_SupportedScriptInterfaceVersion(self):
+    return 3
+
+  def get_Name(self):
+    return "XData profile"
+
+  def get_Description(self):
+    return "Script binning the XData frames in altitude layers."
+
+  def get_Author(self):
+    return "CNRM"
+
+  def get_Version(self):
+    return __Version__
+
+  def HandleData(self, data):
+    """ Handle sounding data.
+
+    Arguments:
+    data -- Sounding data
+
+    """
+
+    method_name = 'handle_' + str(data.GetType().Name)
+    method = getattr(self, method_name)
+    method(data)
+
+  def handle_SystemEvent(self, event):
+    """ Handle sounding system events.
+
+    Arguments:
+    event -- Sounding system event
+
+    """
+
+    if event.EventName == "ReadyForRelease":
+      self.Start()
+    elif event.EventName == "SoundingCompleted":
+      self.Stop()
+      # Done -> exit
+      SoundingInterface.StopScript()
+      sys.exit(0)
+
+  def Start(self):
+    """ Start a new profile """
+
+    self.RadiosondeId = SoundingInterface.GetRadiosonde().ID
+    soundingInfo = SoundingInterface.GetSoundingInformation()
+    self.WriteFile = Path.Combine(self.WriteDir, "Profile_" + soundingInfo.SoundingStartTime.ToString("yyyyMMddHHmmss", CultureInfo.InvariantCulture) + "_" + self.RadiosondeId + ".txt")
+    self.Profile = AltitudeProfile(self.LayerThickness)
+    self.Ptu = None
+    self.Gps = []
+
+  def Stop(self):
+    """ Write the profile summary """
+
+    if self.Profile == None :
+      return
+    writer = BufferedWriter(self.WriteFile, "\r\n", truncate=True)
+    for line in self.Profile.SummaryLines(__ColumnSeparator__) :
+      writer.WriteLine(line)
+    writer.Close()
+    SoundingInterface.Log(LogCategory.info, "Profile of %d frames in %d + %d layers written to %s"
+                          % (self.Profile.Samples, len(self.Profile.Layers["ascent"]),
+                             len(self.Profile.Layers["descent"]), self.WriteFile))
+    self.Profile = None
+
+  def handle_RawPtu(self, ptu):
+    """ Keep the last pressure and temperature """
+
+    if self.Profile == None :
+      return
+    self.Ptu = (ptu.RadioRxTime,
+                ptu.Pressure if ptu.IsPressureOk else __MissingData__,
+                ptu.Temperature if ptu.IsTemperatureOk else __MissingData__)
+
+  def handle_GPSResult(self, location):
+    """ Keep the altitude of the last two GPS solutions """
+
+    if self.Profile == None :
+      return
+    if location.Status == WindSolutionStatus.Autonomous or \
+       location.Status == WindSolutionStatus.Differential :
+      self.Gps = self.Gps[-1:] + [(location.RadioRxTime, location.GeometricHeightFromSeaLevel)]
+
+  def Altitude(self, rxTime):
+    """ Altitude at a RadioRxTime, __MissingData__ without recent GPS solution """
+
+    if len(self.Gps) == 0 or abs(rxTime - self.Gps[-1][0]) > self.MaxGap :
+      return __MissingData__
+    if len(self.Gps) == 1 or self.Gps[1][0] <= self.Gps[0][0] :
+      return self.Gps[-1][1]
+    (t0, h0), (t1, h1) = self.Gps
+    return h0 + (h1 - h0) * (rxTime - t0) / (t1 - t0)
+
+  def handle_AdditionalSensorData(self, xdata):
+    """ Add the decoded frame to the layer of the radiosonde """
+
+    if self.Profile == None :
+      return
+    rxTime = xdata.RadioRxTime
+    values = {}
+    if self.Ptu != None and abs(rxTime - self.Ptu[0]) <= self.MaxGap :
+      values["pressure"] = self.Ptu[1]
+      values["temperature"] = self.Ptu[2]
+    for (spec, number, decoded) in Registry.DecodeFrame("%s" % xdata.XData) :
+      for fname in spec.FieldNames :
+        values.setdefault(spec.Name + "_" + fname, decoded[fname])
+    self.Profile.Add(self.Altitude(rxTime), values)
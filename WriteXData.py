@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 #####################################################################################################################
 #
 #       Module name      : WriteXData.py
@@ -20,6 +21,7 @@
 import clr
 import System
 import math
+import os
 import sys
 import imp
 import datetime
@@ -57,12 +59,19 @@ from Vaisala.Soundings.Framework.DataTypes import OzoneInterfaceType
 from Vaisala.Soundings.Framework.DataTypes.PTU import RawPtu
 from Vaisala.Soundings.Framework.DataTypes.PTU import SynchronizedSoundingData
 
+from BufferedWriter import BufferedWriter, FsyncNever, CheckFsync
+from BinaryRecord import BinaryRecordWriter, RecordFormat, XDataFields, EpochSeconds, Value
+from XDataInstruments import Registry, ParseNumber
+from XDataQC import XDataQC, QcMissing
+from RunStats import RunStats, Clock
+from FramePublisher import FramePublisher, KindXData
+
 
 #####################################################################################################################
 # Defines used in the script.
 #####################################################################################################################
 
-__Version__ = "2.4." + filter(str.isdigit, "$Revision: 28610 $")
+__Version__ = "2.4." + "".join(filter(str.isdigit, "$Revision: 28610 $"))
 __MissingData__ = -32768.0
 __KelvinToC__ = 273.15
 __MissingValue__ = "////////"
@@ -94,6 +103,27 @@ class WriteXData(IExecutableScript):
     -d <message destination> 
         Add new destination where report is distributed.
         Note that destination should be created in sounding system configuration.  
+    -f <directory path>
+        Directory where XData file is written.
+    -s <never|flush|close>
+        When written data is forced to disk (fsync), default never.
+    -b
+        Also write the frames and their decoded values to a binary
+        record file XData_[yyyyMMddHHmmss]_[RadiosondeId].bin.
+
+    -t <seconds>
+        Count the events and time their handling and the writes to the
+        files (RunStats); the figures are logged every <seconds> and at
+        the end of the sounding.
+    -p <address:port>
+        Also publish every frame as it arrives, as a UDP datagram holding
+        its binary record (FramePublisher), to a multicast group such as
+        239.41.41.41:4141 or to one address.
+
+  Every frame goes through the quality control of XDataQC (gaps, repeated
+  frames, spikes, stuck values); the flags are written to the binary record
+  file and the health counters of the instruments are logged at the end of
+  the sounding.
   """
   def __init__(self, args):
     """Initialize script
@@ -106,7 +136,17 @@ class WriteXData(IExecutableScript):
     self.LaunchTime = 0
     self.WriteDir = "C:\\data"
     self.Destinations = []
-    self.WriteFile = "C:\\data\\xdata_test.txt"
+    self.Writer = None
+    self.Fsync = FsyncNever
+    self.Binary = False
+    self.BinaryWriter = None
+    self.QC = XDataQC()
+    self.Undecoded = 0
+    self.Stats = None
+    self.StatsInterval = 60.0
+    self.LastStatsLog = 0.0
+    self.Publisher = None
+    self.RecordFormat = RecordFormat(XDataFields(Registry))
     
     # Read command line options.
     i = 0
@@ -119,8 +159,28 @@ class WriteXData(IExecutableScript):
         i = i + 1
         if (i < len(args)) :
           self.WriteDir = args[i]
+      elif (args[i] == "-s") :
+        i = i + 1
+        if (i < len(args)) :
+          # erreur au chargement du script plutot qu'au lacher
+          self.Fsync = CheckFsync(args[i])
+      elif (args[i] == "-b") :
+        self.Binary = True
+      elif (args[i] == "-t") :
+        i = i + 1
+        if (i < len(args)) :
+          self.StatsInterval = float(args[i])
+        self.Stats = RunStats()
+        self.LastStatsLog = Clock()
+      elif (args[i] == "-p") :
+        i = i + 1
+        if (i < len(args)) :
+          self.Publisher = FramePublisher(args[i])
+          self.Publisher.Declare(KindXData, self.RecordFormat)
       i = i + 1
       
+    # File used for XData received before the sounding is ready for release
+    self.WriteFile = Path.Combine(self.WriteDir, "xdata_test.txt")
     dir = Path.GetDirectoryName(self.WriteDir)
     if not Directory.Exists(dir) :
       Directory.CreateDirectory(dir)
@@ -162,11 +222,42 @@ class WriteXData(IExecutableScript):
     
     # Get method to be called from data type.
     dataname = str(data.GetType().Name)
+    stats = self.Stats
+    if stats is not None :
+      start = Clock()
     if dataname == 'SystemEvent' :
       self.handle_SystemEvent(data)
     elif dataname == 'AdditionalSensorData' :
 #        elif dataname == 'AdditionalSensorData' and __Is_Oif411_Module__:
       self.handle_AdditionalSensorData(data)
+    self.FlushIfDue()
+    if stats is not None :
+      # nombre d'evenements recus et temps de traitement, par type
+      stats.Time(dataname, Clock() - start)
+      if start - self.LastStatsLog >= self.StatsInterval :
+        self.LogStats()
+
+  def FlushIfDue(self):
+    """Write the lines buffered for more than 1 s, even if no frame comes."""
+    if self.Writer is not None :
+      self.Writer.FlushIfDue()
+    if self.BinaryWriter is not None :
+      self.BinaryWriter.FlushIfDue()
+
+  def LogStats(self):
+    """Log the counters and timers of the script (option -t)."""
+
+    self.LastStatsLog = Clock()
+    if self.Writer is not None :
+      self.Stats.Set("bytes", self.Writer.BytesWritten)
+    if self.BinaryWriter is not None :
+      self.Stats.Set("binary_bytes", self.BinaryWriter.Writer.BytesWritten)
+    self.Stats.Set("undecoded", self.Undecoded)
+    if self.Publisher is not None :
+      self.Stats.Set("published", self.Publisher.Sent)
+      self.Stats.Set("publish_errors", self.Publisher.Errors)
+    for line in self.Stats.SummaryLines() :
+      SoundingInterface.Log(LogCategory.info, "WriteXData stats: " + line)
 
   def handle_SystemEvent(self, event):
     """ Handle sounding system events.
@@ -203,24 +294,57 @@ class WriteXData(IExecutableScript):
                                   self.StartTime.Day, self.StartTime.Hour,
                                   self.StartTime.Minute, self.StartTime.Second)
     self.ReleaseDatetime = self.StartDatetime + time_delta
-    self.WriteFile = self.WriteDir + "\\XData_" +  self.StartDatetime.strftime('%Y%m%d%H%M%S')  + "_" + self.RadiosondeId + ".txt" 
-    xdataFile = open(self.WriteFile, "w")
-    header = __ColumnSeparator__.join(__Columns__)
-    xdataFile.write(header + "\n")
-    header = __ColumnSeparator__.join(__Units__)
-    xdataFile.write(header + "\n")
-    xdataFile.close()
+    self.QC = XDataQC()
+    self.Undecoded = 0
+    self.WriteFile = Path.Combine(self.WriteDir, "XData_" +  self.StartDatetime.strftime('%Y%m%d%H%M%S')  + "_" + self.RadiosondeId + ".txt")
+    if self.Writer is not None :
+      self.Writer.Close()
+    # File is kept open until the end of the sounding, lines are written by batch.
+    self.Writer = BufferedWriter(self.WriteFile, os.linesep, truncate=True, fsync=self.Fsync,
+                                 stats=self.Stats)
+    self.Writer.WriteLine(__ColumnSeparator__.join(__Columns__))
+    self.Writer.WriteLine(__ColumnSeparator__.join(__Units__))
+    self.Writer.Flush()
     SoundingInterface.Log(LogCategory.info, "Writing XData to " + self.WriteFile)
+    if self.Binary :
+      if self.BinaryWriter is not None :
+        self.BinaryWriter.Close()
+      binFile = self.WriteFile[:-len(".txt")] + ".bin"
+      self.BinaryWriter = BinaryRecordWriter(BufferedWriter(binFile, truncate=True, fsync=self.Fsync,
+                                                            stats=self.Stats),
+                                             self.RecordFormat)
+    if self.Publisher is not None :
+      self.Publisher.Start(self.StartDatetime.strftime('%Y%m%d%H%M%S'), self.RadiosondeId)
 
   def SoundingEnd(self) :
     """Write sounding status to file."""
 
     soundingInfo = SoundingInterface.GetSoundingInformation()
-    xdataFile = open(self.WriteFile, "a")
+    xdataFile = self.GetWriter()
     comments = SoundingInterface.GetSoundingMetadata(CommentValue)
     if (comments) :
-        xdataFile.write("Comments: " + comments + "\n")
-    xdataFile.close()
+        xdataFile.WriteLine("Comments: " + comments)
+    xdataFile.Close()
+    self.Writer = None
+    if self.Stats is not None :
+      self.Stats.Set("bytes", xdataFile.BytesWritten)
+    # bilan du contrôle qualité des trames, par instrument
+    for line in self.QC.SummaryLines() :
+      SoundingInterface.Log(LogCategory.info, "XData QC " + line)
+    if self.Undecoded > 0 :
+      SoundingInterface.Log(LogCategory.warning, "XData QC: %d frames not decoded" % self.Undecoded)
+    if self.BinaryWriter is not None :
+      self.BinaryWriter.Close()
+      if self.Stats is not None :
+        self.Stats.Set("binary_bytes", self.BinaryWriter.Writer.BytesWritten)
+      self.BinaryWriter = None
+    if self.Stats is not None :
+      self.LogStats()
+    if self.Publisher is not None :
+      SoundingInterface.Log(LogCategory.info, "XData frames published: %d datagrams, %d not sent"
+                            % (self.Publisher.Sent, self.Publisher.Errors))
+      self.Publisher.Close()
+      self.Publisher = None
     self.SendToDestinations()
 
   def SendToDestinations(self) :
@@ -242,15 +366,68 @@ class WriteXData(IExecutableScript):
     Arguments:
     xdata -- additional sensor data
     """
-    toFile = open(self.WriteFile, "a")
+    toFile = self.GetWriter()
     
     #line = self.FormatLine(xdata.RadioRxTime,xdata.XData)
     line = self.FormatLine(xdata.RadioRxTime,xdata.MeasurementOffset,
                            xdata.InstrumentType,xdata.InstrumentNumber,
                            xdata.DataSrvTime,xdata.GpsTimeOffset,xdata.XData)
     
-    toFile.write(line + "\n")
-    toFile.close()
+    toFile.WriteLine(line)
+    if self.Stats is not None :
+      self.Stats.Count("lines")
+    frame = "%s" % xdata.XData
+    packets = Registry.DecodeFrame(frame)
+    flags = self.CheckFrame(xdata.RadioRxTime, packets)
+    if self.BinaryWriter is not None or self.Publisher is not None :
+      self.WriteRecord(xdata, frame, packets, flags)
+
+  def CheckFrame(self, rxTime, packets):
+    """Quality control of the decoded packets of one frame, returns its flags."""
+
+    if len(packets) == 0 :
+      # trame illisible ou tronquée
+      self.Undecoded += 1
+      return QcMissing
+    flags = 0
+    for (spec, number, values) in packets :
+      name = spec.Name
+      if number is not None :
+        name = "%s#%d" % (name, number)
+      flags |= self.QC.Check(rxTime, name, values)
+    return flags
+
+  def WriteRecord(self, xdata, frame, packets, flags):
+    """Write one frame, its decoded values and its QC flags to the binary
+    record file and publish it."""
+
+    record = {
+      "srv_time" : EpochSeconds("%s" % xdata.DataSrvTime),
+      "rx_time" : Value(xdata.RadioRxTime),
+      "offset" : Value(xdata.MeasurementOffset),
+      "gps_offset" : Value(xdata.GpsTimeOffset),
+      "xdata" : frame[:40].encode("ascii", "replace"),
+      "qc_flags" : flags,
+    }
+    for (key, value) in (("instrument_type", xdata.InstrumentType), ("instrument_number", xdata.InstrumentNumber)) :
+      number = ParseNumber("%s" % value)
+      if number is not None and 0 <= number <= 0x7FFF :
+        record[key] = number
+    for (spec, number, values) in packets :
+      for fname in spec.FieldNames :
+        record.setdefault(spec.Name + "_" + fname, Value(values[fname]))
+    data = self.RecordFormat.Pack(record)
+    if self.BinaryWriter is not None :
+      self.BinaryWriter.WritePacked(data)
+    if self.Publisher is not None :
+      self.Publisher.Publish(KindXData, data)
+
+  def GetWriter(self):
+    """Returns the writer of the XData file, opened in append mode if needed."""
+
+    if self.Writer is None :
+      self.Writer = BufferedWriter(self.WriteFile, os.linesep, fsync=self.Fsync, stats=self.Stats)
+    return self.Writer
 
   def FormatLine(self, rxTime, measurementoffset, instrumenttype, instrumentnumber, datasrvtime, gpstimeoffset, xdata) :
 
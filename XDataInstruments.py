@@ -0,0 +1,161 @@
+#####################################################################################################################
+#
+#       Module name      : XDataInstruments.py
+#       Context          : Used by WriteXData.py, WriteProfile.py, XDataQC.py and ProfileBins.py
+#                          (MW41 / IronPython) and by the viewer (Python 3)
+#
+#       Original release : 2021
+#
+#       Registry of the XData instruments and their frame layout.
+#       A frame sent by an additional sensor is : InstrumentType (2 hex) + InstrumentNumber (2 hex) + data.
+#       Daisy-chained sensors send one such packet each, possibly concatenated in one XData string.
+#
+#####################################################################################################################
+
+__MissingData__ = -32768.0
+
+
+def IsMissing(value):
+  """True for None, NaN and the missing data value of the scripts."""
+  return value is None or value != value or value == __MissingData__
+
+
+def ParseNumber(text):
+  """Returns the integer value of a hexadecimal instrument number, None if invalid."""
+  try :
+    return int(text, 16)
+  except ValueError :
+    return None
+
+
+class InstrumentSpec(object):
+  """Frame layout of one XData instrument.
+
+  Arguments:
+  name -- short instrument name, e.g. "OIF411"
+  instrumentType -- instrument type identifier as sent in the frame, e.g. "05"
+  length -- number of hexadecimal characters of a packet, header included
+  fields -- list of (name, offset, width, scale, signed) where offset and
+      width are in characters from the start of the packet
+  hasNumber -- True when characters 2-4 hold the instrument number
+  """
+
+  def __init__(self, name, instrumentType, length, fields, hasNumber=True):
+    self.Name = name
+    self.InstrumentType = instrumentType
+    self.Length = length
+    self.HasNumber = hasNumber
+    self.FieldNames = tuple([f[0] for f in fields])
+    # Precomputed slices and two's complement ranges, used for every frame.
+    compiled = []
+    for (fname, offset, width, scale, signed) in fields :
+      if offset + width > length :
+        raise ValueError("Field %s does not fit in a %s packet" % (fname, name))
+      modulus = 1 << (4 * width)
+      if signed :
+        half = modulus >> 1
+      else :
+        half = modulus
+      compiled.append((fname, offset, offset + width, scale, modulus, half))
+    self.Fields = tuple(compiled)
+
+  def Decode(self, packet):
+    """Returns the field values of one packet as a dict.
+
+    A field which is not valid hexadecimal is set to __MissingData__.
+    """
+    values = {}
+    for (fname, start, end, scale, modulus, half) in self.Fields :
+      try :
+        raw = int(packet[start:end], 16)
+      except ValueError :
+        values[fname] = __MissingData__
+        continue
+      if raw >= half :
+        raw -= modulus
+      values[fname] = raw * scale
+    return values
+
+
+class XDataRegistry(object):
+  """Maps InstrumentType (and optionally InstrumentNumber) to an InstrumentSpec.
+
+  The default spec, when set, is used for packets whose instrument type is
+  not registered.
+  """
+
+  def __init__(self):
+    self.Types = {}
+    self.Numbers = {}
+    self.Default = None
+
+  def Register(self, spec, instrumentNumber=None):
+    """Register spec for its instrument type, or for one instrument number only."""
+    key = spec.InstrumentType.upper()
+    if instrumentNumber is None :
+      self.Types[key] = spec
+    else :
+      self.Numbers[(key, "%02X" % int(instrumentNumber))] = spec
+
+  def Lookup(self, instrumentType, instrumentNumber=None):
+    """Returns the spec of an instrument, or the default one."""
+    key = instrumentType.upper()
+    if instrumentNumber is not None and self.Numbers :
+      spec = self.Numbers.get((key, "%02X" % int(instrumentNumber)))
+      if spec is not None :
+        return spec
+    return self.Types.get(key, self.Default)
+
+  def Split(self, frame):
+    """Split a frame into daisy-chained packets.
+
+    Returns a list of (spec, instrumentNumber, packet). Splitting stops at
+    the first packet of unknown type or which is truncated.
+    """
+    packets = []
+    pos = 0
+    size = len(frame)
+    while size - pos >= 2 :
+      code = frame[pos:pos + 2]
+      if ParseNumber(code) is None :
+        break
+      number = ParseNumber(frame[pos + 2:pos + 4])
+      spec = self.Lookup(code, number)
+      if spec is None or size - pos < spec.Length :
+        break
+      if not spec.HasNumber :
+        number = None
+      packets.append((spec, number, frame[pos:pos + spec.Length]))
+      pos += spec.Length
+    return packets
+
+  def DecodeFrame(self, frame):
+    """Returns a list of (spec, instrumentNumber, values) for each packet of a frame."""
+    return [(spec, number, spec.Decode(packet))
+            for (spec, number, packet) in self.Split(frame)]
+
+
+#####################################################################################################################
+# Known instruments.
+#####################################################################################################################
+
+# Ozone interface board OIF411 (RSA411), measurement packet.
+OIF411 = InstrumentSpec("OIF411", "05", 20, [
+  ("PumpTemperature", 4, 4, 0.01, True),    # degC
+  ("OzoneCurrent", 8, 5, 0.0001, False),    # uA
+  ("BatteryVoltage", 13, 2, 0.1, False),    # V
+  ("PumpCurrent", 15, 3, 1.0, False),       # mA
+  ("ExternalVoltage", 18, 2, 0.1, False),   # V
+])
+
+# CNRM supercooled liquid water probe : instrument type then TWC and SLWC
+# oscillation frequencies in mHz, without instrument number.
+SLW_PROBE = InstrumentSpec("SLW", "00", 10, [
+  ("twc_frequency", 2, 4, 0.001, False),    # Hz
+  ("slwc_frequency", 6, 4, 0.001, False),   # Hz
+], hasNumber=False)
+
+Registry = XDataRegistry()
+Registry.Register(OIF411)
+# The probe type identifier is not fixed: it decodes every unregistered type.
+Registry.Default = SLW_PROBE
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+#####################################################################################################################
+#
+#       Module name      : XDataQC.py
+#       Context          : Used by WriteXData.py (MW41 / IronPython) and by the viewer (Python 3)
+#
+#       Original release : 2021
+#
+#       Quality control of the XData frames as they arrive. Each frame is checked against the state
+#       kept for its instrument (last RadioRxTime, mean frame period, running mean and deviation of
+#       each field, length of the run of identical values) : the cost of a frame does not depend on
+#       the length of the flight. Every frame gets a set of flags, every instrument health counters.
+#
+#####################################################################################################################
+
+from XDataInstruments import SLW_PROBE, IsMissing
+
+# Flags of a frame (bits)
+QcMissing = 1     # missing or invalid value
+QcGap = 2         # frames lost before this one (RadioRxTime gap)
+QcRepeat = 4      # RadioRxTime not after the previous frame : repeated frame
+QcSpike = 8       # value far from the running mean
+QcStuck = 16      # value unchanged for StuckFrames frames
+QcFlags = ((QcMissing, "missing"), (QcGap, "gap"), (QcRepeat, "repeat"),
+           (QcSpike, "spike"), (QcStuck, "stuck"))
+
+
+def FlagNames(flags):
+  """Names of the flags set in a flags value."""
+  return [name for (flag, name) in QcFlags if flags & flag]
+
+
+class FieldState(object):
+  """Running mean, mean absolute deviation and run of identical values of one field."""
+
+  def __init__(self):
+    self.Count = 0
+    self.Mean = 0.0
+    self.Deviation = 0.0
+    self.Last = None
+    self.Run = 0
+
+
+class InstrumentHealth(object):
+  """State and health counters of one instrument."""
+
+  def __init__(self, name):
+    self.Name = name
+    self.Frames = 0
+    self.Flagged = dict([(flag, 0) for (flag, fname) in QcFlags])
+    self.Gaps = 0
+    self.GapSeconds = 0.0
+    self.LastRxTime = None
+    # période moyenne des trames (lente) et récente (rapide), en s
+    self.Period = None
+    self.RecentPeriod = None
+    self.Fields = {}
+
+  def Rate(self):
+    """Usual frame rate (frames/s), None until known."""
+    if not self.Period :
+      return None
+    return 1.0 / self.Period
+
+  def RecentRate(self):
+    """Frame rate of the last frames (frames/s), None until known."""
+    if not self.RecentPeriod :
+      return None
+    return 1.0 / self.RecentPeriod
+
+
+class XDataQC(object):
+  """Streaming quality control of the XData frames, per instrument.
+
+  Arguments:
+  gapFactor -- a RadioRxTime step longer than gapFactor frame periods is a gap
+  spikeFactor -- a value further than spikeFactor mean deviations from the
+      running mean is a spike
+  spikeFloor -- smallest deviation used for the spike test
+  stuckFrames -- identical values in a row from which a field is stuck
+  stuckFields -- fields which should never stay constant (the oscillation
+      frequencies of the probe), None for all
+  warmup -- frames of an instrument before the gap and spike tests start
+  slow, fast -- weights of the usual and recent estimates (period, mean)
+  """
+
+  def __init__(self, gapFactor=3.0, spikeFactor=8.0, spikeFloor=0.01,
+               stuckFrames=20, stuckFields=SLW_PROBE.FieldNames, warmup=20,
+               slow=0.02, fast=0.2):
+    self.GapFactor = gapFactor
+    self.SpikeFactor = spikeFactor
+    self.SpikeFloor = spikeFloor
+    self.StuckFrames = stuckFrames
+    self.StuckFields = stuckFields
+    self.Warmup = warmup
+    self.Slow = slow
+    self.Fast = fast
+    self.Instruments = {}
+    self.LastRxTime = None
+
+  def Check(self, rxTime, name, values):
+    """Check one frame and update the state of its instrument.
+
+    Arguments:
+    rxTime -- RadioRxTime of the frame (s)
+    name -- instrument, e.g. "SLW" or "OIF411#2"
+    values -- dict of the decoded values of the frame
+
+    Returns the flags of the frame.
+    """
+    health = self.Instruments.get(name)
+    if health is None :
+      health = self.Instruments[name] = InstrumentHealth(name)
+    health.Frames += 1
+    flags = 0
+    if IsMissing(rxTime) :
+      flags |= QcMissing
+    elif health.LastRxTime is not None :
+      step = rxTime - health.LastRxTime
+      if step <= 0 :
+        flags |= QcRepeat
+      else :
+        if health.Period is None :
+          health.Period = health.RecentPeriod = step
+        elif health.Frames > self.Warmup and step > self.GapFactor * health.Period :
+          flags |= QcGap
+          health.Gaps += 1
+          health.GapSeconds += step - health.Period
+        else :
+          health.Period += self.Slow * (step - health.Period)
+        # la période récente suit aussi les trous, pour voir le débit baisser
+        health.RecentPeriod += self.Fast * (step - health.RecentPeriod)
+    if not flags & (QcMissing | QcRepeat) :
+      health.LastRxTime = rxTime
+      if self.LastRxTime is None or rxTime > self.LastRxTime :
+        self.LastRxTime = rxTime
+    for (fname, value) in values.items() :
+      if IsMissing(value) :
+        flags |= QcMissing
+        continue
+      field = health.Fields.get(fname)
+      if field is None :
+        field = health.Fields[fname] = FieldState()
+      if field.Count >= self.Warmup and \
+         abs(value - field.Mean) > self.SpikeFactor * max(field.Deviation, self.SpikeFloor) :
+        flags |= QcSpike
+      if field.Count == 0 :
+        field.Mean = value
+      else :
+        field.Deviation += self.Fast * (abs(value - field.Mean) - field.Deviation)
+        field.Mean += self.Fast * (value - field.Mean)
+      field.Count += 1
+      if field.Last is not None and value == field.Last :
+        field.Run += 1
+      else :
+        field.Run = 0
+      field.Last = value
+      if field.Run >= self.StuckFrames and self.Watched(fname) :
+        flags |= QcStuck
+    if flags :
+      for (flag, fname) in QcFlags :
+        if flags & flag :
+          health.Flagged[flag] += 1
+    return flags
+
+  def Watched(self, fname):
+    """True when a field is checked for stuck values."""
+    return self.StuckFields is None or fname in self.StuckFields
+
+  def Alerts(self, rxTime=None, rateDrop=0.5):
+    """Problems of the instruments, as text lines : recent frame rate below
+    rateDrop times the usual one, no frame for gapFactor periods before
+    rxTime (by default the last RadioRxTime of all the instruments), stuck
+    fields."""
+    if rxTime is None :
+      rxTime = self.LastRxTime
+    alerts = []
+    for name in sorted(self.Instruments.keys()) :
+      health = self.Instruments[name]
+      if health.Frames < self.Warmup or not health.Period :
+        continue
+      silent = rxTime is not None and health.LastRxTime is not None and \
+               rxTime - health.LastRxTime > self.GapFactor * health.Period
+      if silent :
+        alerts.append("%s: no frame for %.0f s" % (name, rxTime - health.LastRxTime))
+      elif health.RecentPeriod > health.Period / rateDrop :
+        alerts.append("%s: %.1f frames/s (usually %.1f)" % (name, health.RecentRate(), health.Rate()))
+      for fname in sorted(health.Fields.keys()) :
+        field = health.Fields[fname]
+        if field.Run >= self.StuckFrames and self.Watched(fname) :
+          alerts.append("%s: %s flat for %d frames" % (name, fname, field.Run + 1))
+    return alerts
+
+  def SummaryLines(self):
+    """Health counters of the instruments, one line each."""
+    lines = []
+    for name in sorted(self.Instruments.keys()) :
+      health = self.Instruments[name]
+      rate = health.Rate() or 0.0
+      counts = ", ".join(["%d %s" % (health.Flagged[flag], fname) for (flag, fname) in QcFlags])
+      lines.append("%s: %d frames, %.2f frames/s, %d gaps (%.0f s lost); flagged: %s"
+                   % (name, health.Frames, rate, health.Gaps, health.GapSeconds, counts))
+    return lines
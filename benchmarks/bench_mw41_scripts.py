@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark of the MW41 scripts WriteXData.py and NewRawData.py.
+
+Replays a sounding through mw41_replay at full speed and reports events/s,
+per-event HandleData latency percentiles and bytes written, for the text
+output alone and with the binary record files (-b).
+
+The sounding comes from synth_sounding: an SLW probe at xdata_per_s frames
+per second, optionally followed by an OIF411 in the daisy chain.
+
+Usage: python benchmarks/bench_mw41_scripts.py [duration_s] [xdata_per_s] [oif411_per_s]
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import mw41_replay  # noqa: E402
+from synth_sounding import generate_events  # noqa: E402
+
+
+def main(duration=3600, xdata_rate=1, oif411_rate=0):
+    instruments = [('SLW', xdata_rate)] + ([('OIF411', oif411_rate)] if oif411_rate else [])
+    # événements générés avant la mesure
+    records = list(generate_events(duration, instruments, missing=0.001))
+    info, events = records[0], records[1:]
+    for label, args in (('text', []), ('text + binary', ['-b'])):
+        with tempfile.TemporaryDirectory() as outdir:
+            stats = mw41_replay.replay(info, events, outdir, script_args=args)
+        summary = stats.summary()
+        print("== %s: %d events in %.2f s, %.0f events/s, %d bytes written"
+              % (label, summary['events'], summary['elapsed_s'],
+                 summary['events_per_s'], summary['bytes_written']))
+        for event_type, lat in summary['latency_us'].items():
+            print("   %-22s n=%-7d p50=%7.1f us  p90=%7.1f us  p99=%7.1f us  max=%8.1f us"
+                  % (event_type, lat['count'], lat['p50'], lat['p90'],
+                     lat['p99'], lat['max']))
+    return summary
+
+
+if __name__ == '__main__':
+    main(*[float(a) for a in sys.argv[1:4]])
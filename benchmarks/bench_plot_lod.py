@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Redraw cost of a growing series in the viewer: plain PlotDataItem.setData
+of every sample versus LodCurve (plot_lod), after 1 min, 1 h and 4 h of
+frames at xdata_per_s frames per second.
+
+Usage: python benchmarks/bench_plot_lod.py [xdata_per_s]
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np  # noqa: E402
+import pyqtgraph as pg  # noqa: E402
+
+from plot_lod import LodCurve  # noqa: E402
+
+
+def redraw_ms(win, curve, x, y, repeat=5):
+    """Mean time (ms) of setData + repaint of the window."""
+    start = time.perf_counter()
+    for k in range(repeat):
+        curve.setData(x, y)
+        win.grab()
+    return (time.perf_counter() - start) / repeat * 1e3
+
+
+def main(rate=8):
+    app = pg.mkQApp()  # noqa: F841
+    windows = []
+    for title in ('setData', 'LodCurve'):
+        win = pg.GraphicsLayoutWidget()
+        win.resize(500, 300)
+        windows.append((win, win.addPlot(title=title)))
+    item = windows[0][1].plot(pen=(0, 0, 0))
+    lod = LodCurve(windows[1][1], pen=(0, 0, 0))
+    rng = np.random.default_rng(0)
+    n = int(4 * 3600 * rate)
+    x = 1.6e9 + np.arange(n) / rate
+    y = 40 + np.cumsum(rng.normal(0, 0.01, n))
+    for label, seconds in (('1 min', 60), ('1 h', 3600), ('4 h', 4 * 3600)):
+        m = int(seconds * rate)
+        # la pyramide est construite au fil de l'eau comme dans le viewer
+        for stop in range(0, m, 60 * int(rate)):
+            lod.pyramid.update(x[:stop], y[:stop])
+        print("%-6s %8d samples: setData %8.2f ms, LodCurve %6.2f ms"
+              % (label, m, redraw_ms(windows[0][0], item, x[:m], y[:m]),
+                 redraw_ms(windows[1][0], lod, x[:m], y[:m])))
+
+
+if __name__ == '__main__':
+    main(*[float(a) for a in sys.argv[1:2]])
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the parsing of the date and time of the XData_* rows.
+
+Compares the historical ``pd.to_datetime(date + ' ' + time)`` of read_xdata
+(string concatenation and format inference), ``pd.to_datetime`` with
+format='ISO8601' on the decoded tokens, and the fixed-format
+sounding_reader.epoch_seconds on the lines.
+
+Usage: python benchmarks/bench_timestamps.py [nb_frames]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sounding_reader import epoch_seconds  # noqa: E402
+from bench_xdata_decode import write_xdata_file, best_of  # noqa: E402
+
+
+def main(n=100000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'XData_20211123100000_BENCH.txt')
+        write_xdata_file(path, n)
+        with open(path, 'rb') as f:
+            lines = f.read().splitlines()[2:]
+        data = pd.read_csv(path, sep=' ', skiprows=2, header=None)
+    tokens = [line.split() for line in lines]
+    dates = [row[0] for row in tokens]
+    times = [row[1] for row in tokens]
+
+    def inferred():
+        stamps = pd.to_datetime(data[0] + ' ' + data[1])
+        return stamps.values.astype('datetime64[ns]').astype(np.int64) / 10 ** 9
+
+    def iso8601():
+        stamps = pd.to_datetime([d.decode() + ' ' + t.decode() for d, t in zip(dates, times)],
+                                format='ISO8601')
+        return stamps.values.astype('datetime64[ns]').astype(np.int64) / 10 ** 9
+
+    def fixed():
+        return epoch_seconds(lines)
+
+    reference = inferred()
+    assert np.array_equal(iso8601(), reference)
+    assert np.array_equal(fixed(), reference)
+    assert np.array_equal(epoch_seconds(dates, times), reference)
+
+    t_inferred = best_of(inferred)
+    t_iso = best_of(iso8601)
+    t_fixed = best_of(fixed)
+    print("rows                  : %d" % n)
+    print("to_datetime (inferred): %8.2f ms" % (t_inferred * 1e3))
+    print("to_datetime (ISO8601) : %8.2f ms" % (t_iso * 1e3))
+    print("epoch_seconds         : %8.2f ms" % (t_fixed * 1e3))
+    print("speed-up              : %8.1f x / %.1f x" % (t_inferred / t_fixed, t_iso / t_fixed))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
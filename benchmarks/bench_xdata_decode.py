@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the XData hexadecimal decoding on a 100k-frame file.
+
+Compares the historical per-row ``apply(xdata_ftwc)`` / ``apply(xdata_fslwc)``
+of read_xdata with the vectorized xdata_decode.decode_twc_slwc.
+
+Usage: python benchmarks/bench_xdata_decode.py [nb_frames]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from xdata_decode import decode_twc_slwc, xdata_ftwc, xdata_fslwc  # noqa: E402
+
+
+def write_xdata_file(path, n, seed=0):
+    """Write an XData_* like file with n frames."""
+    rng = np.random.default_rng(seed)
+    twc = rng.integers(0, 0x10000, n)
+    slwc = rng.integers(0, 0x10000, n)
+    with open(path, 'w') as f:
+        f.write("time offset InstrumentType InstrumentNumber SrvTime GpsOffset XData\n")
+        f.write("s s / / s s Hz\n")
+        for i in range(n):
+            f.write("2021-11-23 10:%02d:%02d.000 %.2f 0.5 1 1 3 1E%04X%04X\n"
+                    % ((i // 60) % 60, i % 60, 100 + i, twc[i], slwc[i]))
+
+
+def best_of(func, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main(n=100000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'XData_20211123100000_BENCH.txt')
+        write_xdata_file(path, n)
+        data = pd.read_csv(path, sep=' ', skiprows=2, header=None)
+    frames = data[7]
+
+    def per_row():
+        return frames.apply(xdata_ftwc), frames.apply(xdata_fslwc)
+
+    def vectorized():
+        return decode_twc_slwc(frames.values)
+
+    twc_ref, slwc_ref = per_row()
+    twc, slwc, valid = vectorized()
+    assert valid.all()
+    assert np.array_equal(twc, twc_ref.values)
+    assert np.array_equal(slwc, slwc_ref.values)
+
+    t_row = best_of(per_row)
+    t_vec = best_of(vectorized)
+    print("frames            : %d" % n)
+    print("per-row apply     : %8.2f ms" % (t_row * 1e3))
+    print("decode_twc_slwc   : %8.2f ms" % (t_vec * 1e3))
+    print("speed-up          : %8.1f x" % (t_row / t_vec))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
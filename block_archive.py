@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Block-compressed archive of a sounding, with random access.
+
+A flight is stored in one <start>_<RadiosondeId>.rsb file holding two
+tables: 'ptu' (the RawData columns) and 'xdata' (the decoded XData frames).
+The rows of each table are cut into blocks of BLOCK_SECONDS of flight, and
+each block is compressed on its own with zlib. A column whose values were
+read from text with a few decimals is stored as the differences of the
+integers value * 10**decimals, other columns as their bytes shuffled so
+that the bytes of same weight are together; both are lossless. An index at
+the end of the file gives the position, the number of rows and the time
+and altitude ranges of every block: a query decompresses only the blocks
+it overlaps.
+
+The XData frames come out joined on the PTU/GPS rows as with
+convert_archive (time_align.align): the joined columns are computed again
+when the frames are read, from the PTU blocks around their blocks, rather
+than stored, as they would make most of the archive. The altitude ranges
+of the XData blocks are those of the joined altitude.
+
+Layout::
+
+    MAGIC | block | block | ... | index (zlib JSON) | offset, size, MAGIC
+
+convert_flight() converts the text files of a flight in a streaming
+fashion: the files are read in chunks, joined with time_align.align_stream
+and written a block at a time, so the memory used does not depend on the
+length of the flight.
+
+Example::
+
+    convert_flight({'xdata': 'XData_20211123100000_S1234567.txt',
+                    'ptu': 'RawData_20211123100000_S1234567.txt'},
+                   '20211123100000_S1234567.rsb')
+    with BlockArchive('20211123100000_S1234567.rsb') as archive:
+        cloud = archive.between_altitudes(2000, 3500)
+        ptu = archive.between_times('2021-11-23 10:20', '2021-11-23 10:40', 'ptu')
+
+@author: roya
+"""
+import json
+import mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from sounding_archive import to_epoch, to_frame
+from sounding_reader import parse_xdata_lines, parse_ptu_lines
+from time_align import JOINED_FIELDS, align, align_stream
+
+
+MAGIC = b'RS41BLK1'
+ARCHIVE_VERSION = 1
+EXTENSION = '.rsb'
+# durée de vol couverte par un bloc (s)
+BLOCK_SECONDS = 60
+# octets de texte lus à la fois pendant la conversion
+CHUNK_SIZE = 1 << 20
+TRAILER = struct.Struct('<QQ8s')
+INDEX_FIELDS = ('offset', 'size', 'rows', 't_min', 't_max', 'alt_min', 'alt_max')
+# en-tête de chaque colonne d'un bloc : codec, taille des données
+COLUMN = struct.Struct('<BI')
+# codecs : nombre de décimales (entiers en différences), ou flottants bruts
+RAW = 0xFF
+HAS_NAN = 0x80
+MAX_DECIMALS = 8
+
+
+def _range(values):
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return None, None
+    return float(finite.min()), float(finite.max())
+
+
+def _shuffle(values):
+    # octets de même poids regroupés : ils se compressent bien mieux
+    return values.view(np.uint8).reshape(-1, values.itemsize).T.tobytes()
+
+
+def _unshuffle(data, dtype, rows):
+    shuffled = np.frombuffer(data, dtype=np.uint8, count=rows * dtype.itemsize)
+    return shuffled.reshape(dtype.itemsize, rows).T.copy().view(dtype).ravel()
+
+
+def _decimals(values, guess=None):
+    """Number of decimals d such that values are exactly
+    round(values * 10**d) / 10**d (values parsed from text), or None.
+    guess, the decimals of the previous block, is tried first."""
+    nan = np.isnan(values)
+    finite = values[~nan]
+    if len(finite) == 0 or not np.isfinite(finite).all() \
+            or (np.signbit(finite) & (finite == 0)).any():
+        return None
+    candidates = range(MAX_DECIMALS + 1)
+    if guess is not None:
+        candidates = [guess] + [d for d in candidates if d != guess]
+    for digits in candidates:
+        scale = 10.0 ** digits
+        # essai sur quelques valeurs avant de vérifier toute la colonne
+        sample = finite[:16]
+        if not np.array_equal(np.round(sample * scale) / scale, sample):
+            continue
+        scaled = np.round(finite * scale)
+        if np.abs(scaled).max() < 2 ** 52 and np.array_equal(scaled / scale, finite):
+            return digits
+    return None
+
+
+def _encode_column(values, guess=None):
+    """(codec, payload) of a column: the integer deltas of the decimal
+    values and the mask of the NaN, or the shuffled bytes of the values."""
+    digits = _decimals(values, guess) if values.dtype.kind == 'f' else None
+    if digits is None:
+        return RAW, _shuffle(values)
+    nan = np.isnan(values)
+    ints = np.round(np.where(nan, 0, values) * 10.0 ** digits).astype(np.int64)
+    payload = _shuffle(np.diff(ints, prepend=np.int64(0)))
+    if nan.any():
+        return digits | HAS_NAN, payload + np.packbits(nan).tobytes()
+    return digits, payload
+
+
+def _decode_column(codec, payload, dtype, rows):
+    if codec == RAW:
+        return _unshuffle(payload, dtype, rows)
+    digits = codec & ~HAS_NAN
+    values = np.cumsum(_unshuffle(payload, np.dtype(np.int64), rows)) / 10.0 ** digits
+    if codec & HAS_NAN:
+        nan = np.unpackbits(np.frombuffer(payload, dtype=np.uint8, offset=rows * 8),
+                            count=rows).astype(bool)
+        values[nan] = np.nan
+    return values.astype(dtype, copy=False)
+
+
+def _encode(block, columns, level, decimals):
+    """Compressed bytes of a block: for each column its codec, the size of
+    its payload and the payload. decimals ({column: decimals}) holds the
+    decimals of the previous block and is updated."""
+    parts = []
+    for name, dtype in columns:
+        codec, payload = _encode_column(np.ascontiguousarray(block[name], dtype=dtype),
+                                        decimals.get(name))
+        if codec != RAW:
+            decimals[name] = codec & ~HAS_NAN
+        parts.append(COLUMN.pack(codec, len(payload)))
+        parts.append(payload)
+    return zlib.compress(b''.join(parts), level)
+
+
+def _decode(data, columns, rows):
+    raw = memoryview(zlib.decompress(data))
+    block = {}
+    offset = 0
+    for name, dtype in columns:
+        codec, size = COLUMN.unpack_from(raw, offset)
+        offset += COLUMN.size
+        block[name] = _decode_column(codec, raw[offset:offset + size], np.dtype(dtype), rows)
+        offset += size
+    return block
+
+
+class BlockWriter:
+    """Write the tables of a flight to a block archive, block by block.
+
+    Rows are given in time order with write(); a block is compressed and
+    written as soon as a row of a later block arrives, so at most one block
+    per table is held in memory. close() writes the last blocks and the
+    index; the archive is written to a temporary file and only appears at
+    its path when complete.
+
+    Arguments:
+    path -- archive file to write
+    block_seconds -- flight time covered by a block
+    tolerance -- tolerance of the join of the 'xdata' table on the 'ptu'
+        table when the archive is read
+    level -- zlib compression level
+    meta -- dict stored with the index (sources, options...)
+    """
+
+    def __init__(self, path, block_seconds=BLOCK_SECONDS, tolerance=2.0, level=6,
+                 meta=None):
+        self.path = path
+        self.block_seconds = float(block_seconds)
+        self.tolerance = float(tolerance)
+        self.level = level
+        self.meta = meta or {}
+        self.tables = {}
+        self._pending = {}
+        self._decimals = {}
+        self._tmp = path + '.tmp'
+        self._file = open(self._tmp, 'wb')
+        self._file.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, table, block, columns=None):
+        """Add rows (dict of column arrays) to a table. Only the columns
+        named in columns (all by default) are stored, the altitude column
+        gives the altitude range of the blocks in any case."""
+        if len(block['timestamp']) == 0:
+            return
+        if table not in self.tables:
+            columns = list(block) if columns is None else columns
+            self.tables[table] = {
+                'columns': [(name, np.asarray(block[name]).dtype.str) for name in columns],
+                'rows': 0,
+                'blocks': {field: [] for field in INDEX_FIELDS}}
+            self._pending[table] = None
+            self._decimals[table] = {}
+        pending = self._pending[table]
+        if pending is not None:
+            block = {name: np.concatenate((pending[name], block[name])) for name in pending}
+        key = np.floor(np.asarray(block['timestamp'], dtype=float) / self.block_seconds)
+        cuts = np.flatnonzero(np.diff(key)) + 1
+        starts = np.concatenate(([0], cuts))
+        for a, b in zip(starts[:-1], cuts):
+            self._write_block(table, {name: values[a:b] for name, values in block.items()})
+        # le dernier bloc peut encore recevoir des lignes
+        last = starts[-1]
+        self._pending[table] = {name: np.asarray(values[last:]) for name, values in block.items()}
+
+    def _write_block(self, table, block):
+        info = self.tables[table]
+        data = _encode(block, info['columns'], self.level, self._decimals[table])
+        rows = len(block['timestamp'])
+        t_min, t_max = _range(np.asarray(block['timestamp'], dtype=float))
+        alt_min, alt_max = _range(np.asarray(block.get('altitude', np.zeros(0)), dtype=float))
+        entry = {'offset': self._file.tell(), 'size': len(data), 'rows': rows,
+                 't_min': t_min, 't_max': t_max, 'alt_min': alt_min, 'alt_max': alt_max}
+        self._file.write(data)
+        for field in INDEX_FIELDS:
+            info['blocks'][field].append(entry[field])
+        info['rows'] += rows
+
+    def close(self):
+        """Write the remaining blocks and the index, and move the archive
+        to its path."""
+        if self._file.closed:
+            return
+        for table, pending in self._pending.items():
+            if pending is not None and len(pending['timestamp']):
+                self._write_block(table, pending)
+        self._pending = {}
+        index = json.dumps({'version': ARCHIVE_VERSION, 'block_seconds': self.block_seconds,
+                            'tolerance': self.tolerance, 'meta': self.meta,
+                            'tables': self.tables})
+        index = zlib.compress(index.encode('utf-8'))
+        offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(TRAILER.pack(offset, len(index), MAGIC))
+        self._file.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        """Give up the archive being written."""
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.remove(self._tmp)
+        except OSError:
+            pass
+
+
+def read_chunks(path, parse_lines, chunk_size=CHUNK_SIZE):
+    """Parsed blocks of a text file read chunk_size bytes at a time, cut
+    at line boundaries."""
+    with open(path, 'rb') as f:
+        rest = b''
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            data = rest + data
+            end = data.rfind(b'\n') + 1
+            rest = data[end:]
+            block = parse_lines(data[:end].splitlines())
+            if len(block['timestamp']):
+                yield block
+        if rest.strip():
+            # dernière ligne sans fin de ligne
+            block = parse_lines([rest])
+            if len(block['timestamp']):
+                yield block
+
+
+def convert_flight(files, path, block_seconds=BLOCK_SECONDS, tolerance=2.0,
+                   chunk_size=CHUNK_SIZE, meta=None):
+    """Convert the text files of a flight to a block archive.
+
+    Arguments:
+    files -- {'xdata': XData_* path, 'ptu': RawData_* path}, either may be
+        missing
+    path -- archive file to write
+    block_seconds -- flight time covered by a block
+    tolerance -- largest time distance (s) of a PTU row joined on a frame
+    chunk_size -- bytes of text parsed at a time
+    meta -- dict stored with the index
+
+    Returns the rows written per table.
+    """
+    with BlockWriter(path, block_seconds, tolerance, meta=meta) as writer:
+
+        def ptu_blocks():
+            if 'ptu' not in files:
+                return
+            for block in read_chunks(files['ptu'], parse_ptu_lines, chunk_size):
+                writer.write('ptu', block)
+                yield block
+
+        ptu = ptu_blocks()
+        if 'xdata' in files:
+            xdata = read_chunks(files['xdata'], parse_xdata_lines, chunk_size)
+            # les lignes PTU sont écrites au fil de la jointure
+            for block in align_stream(xdata, ptu, tolerance):
+                # les colonnes jointes sont recalculées à la lecture
+                writer.write('xdata', block,
+                             [name for name in block if name not in JOINED_FIELDS])
+        # lignes PTU après la dernière trame XData
+        for _ in ptu:
+            pass
+    return {table: info['rows'] for table, info in writer.tables.items()}
+
+
+class BlockArchive:
+    """Memory-mapped block archive of a flight.
+
+    The index is read when the archive is opened; the blocks are only
+    decompressed by the queries which overlap them (blocks_read counts
+    them). The XData frames are joined again on the PTU rows when they are
+    read, with the PTU blocks within the join tolerance of their blocks.
+
+    Arguments:
+    path -- archive written by BlockWriter or convert_flight()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.path.getsize(path)
+        if size < len(MAGIC) + TRAILER.size:
+            self._file.close()
+            raise ValueError("%s is not a block archive" % path)
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        offset, length, magic = TRAILER.unpack(self._map[size - TRAILER.size:])
+        if self._map[:len(MAGIC)] != MAGIC or magic != MAGIC:
+            self.close()
+            raise ValueError("%s is not a block archive" % path)
+        index = json.loads(zlib.decompress(self._map[offset:offset + length]))
+        if index['version'] != ARCHIVE_VERSION:
+            self.close()
+            raise ValueError("%s: unsupported archive version %s" % (path, index['version']))
+        self.block_seconds = index['block_seconds']
+        self.tolerance = index['tolerance']
+        self.meta = index['meta']
+        self.columns = {table: [(name, np.dtype(dtype)) for name, dtype in info['columns']]
+                        for table, info in index['tables'].items()}
+        self.rows = {table: info['rows'] for table, info in index['tables'].items()}
+        self.blocks = {}
+        for table, info in index['tables'].items():
+            # None (bloc sans valeur) -> NaN
+            self.blocks[table] = {field: np.array(info['blocks'][field], dtype=float)
+                                  for field in INDEX_FIELDS}
+        self.blocks_read = 0
+
+    @property
+    def tables(self):
+        return list(self.columns)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _table(self, table):
+        if table not in self.columns:
+            raise KeyError("no table %r in %s" % (table, self.path))
+        return self.blocks[table]
+
+    def _decode_blocks(self, table, selected):
+        """Decompress the selected blocks of a table."""
+        blocks = self.blocks[table]
+        columns = self.columns[table]
+        parts = []
+        for b in np.flatnonzero(selected):
+            offset, size = int(blocks['offset'][b]), int(blocks['size'][b])
+            parts.append(_decode(self._map[offset:offset + size], columns,
+                                 int(blocks['rows'][b])))
+        self.blocks_read += len(parts)
+        if not parts:
+            return {name: np.zeros(0, dtype=dtype) for name, dtype in columns}
+        return {name: np.concatenate([p[name] for p in parts]) for name, _ in columns}
+
+    def _read_blocks(self, table, selected):
+        """Rows of the selected blocks of a table, the XData frames joined
+        on the PTU rows."""
+        self._table(table)
+        block = self._decode_blocks(table, selected)
+        if table != 'xdata':
+            return block
+        if len(block['timestamp']) == 0 or 'ptu' not in self.columns:
+            block.update({name: np.full(len(block['timestamp']), np.nan)
+                          for name in JOINED_FIELDS})
+            return block
+        # blocs PTU à moins de la tolérance des blocs XData lus
+        xdata, ptu = self.blocks['xdata'], self.blocks['ptu']
+        near = np.zeros(len(ptu['rows']), dtype=bool)
+        for b in np.flatnonzero(selected):
+            near |= ((ptu['t_max'] >= xdata['t_min'][b] - self.tolerance)
+                     & (ptu['t_min'] <= xdata['t_max'][b] + self.tolerance))
+        return align(block, self._decode_blocks('ptu', near), self.tolerance)
+
+    def read(self, table='xdata'):
+        """DataFrame of a whole table."""
+        blocks = self._table(table)
+        return to_frame(self._read_blocks(table, np.ones(len(blocks['rows']), dtype=bool)))
+
+    def between_times(self, start, end, table='xdata'):
+        """DataFrame of the rows of a table with start <= timestamp <= end."""
+        start, end = to_epoch(start), to_epoch(end)
+        blocks = self._table(table)
+        block = self._read_blocks(table, (blocks['t_max'] >= start) & (blocks['t_min'] <= end))
+        keep = (block['timestamp'] >= start) & (block['timestamp'] <= end)
+        return to_frame({name: values[keep] for name, values in block.items()})
+
+    def between_altitudes(self, low, high, table='xdata'):
+        """DataFrame of the rows of a table with low <= altitude <= high
+        (the altitude of the XData frames is the one joined at their time)."""
+        blocks = self._table(table)
+        block = self._read_blocks(table, (blocks['alt_max'] >= low) & (blocks['alt_min'] <= high))
+        keep = (block['altitude'] >= low) & (block['altitude'] <= high)
+        return to_frame({name: values[keep] for name, values in block.items()})
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of the parsed columns of the XData_* and RawData_* files.
+
+A ColumnCache keeps in one directory a .npz entry per sounding file with
+the columns parsed by sounding_reader (TWC/SLWC frequencies decoded) of
+its complete lines, and the identity of the file: absolute path, size and
+mtime when the entry was written, bytes covered and CRC-32 of these bytes.
+The files are only appended to, so an entry stays valid while the file
+begins with the bytes it covers: a finished flight is loaded without
+parsing, a file still being written only has its lines after the cached
+prefix parsed. The CRC is only computed when the size or the mtime of the
+file changed.
+
+When the entries exceed the size budget of the directory, those used least
+recently are removed (an entry is touched when it is loaded).
+
+Example, with sounding_reader.read_columns::
+
+    cache = ColumnCache(os.path.expanduser('~/.cache/RS41_XData'))
+    ptu = read_columns('RawData_20211123100000_S1234567.txt', cache)
+
+@author: roya
+"""
+import hashlib
+import os
+import zipfile
+import zlib
+
+import numpy as np
+
+
+# 2 : InstrumentNumber lu en hexadécimal
+CACHE_VERSION = 2
+# taille maximale du répertoire du cache (octets)
+DEFAULT_BUDGET = 512 << 20
+
+
+def _prefix_crc(path, size):
+    """CRC-32 of the first size bytes of a file."""
+    crc = 0
+    with open(path, 'rb') as f:
+        while size > 0:
+            chunk = f.read(min(size, 1 << 20))
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            size -= len(chunk)
+    return crc
+
+
+class ColumnCache:
+    """Directory of the cached columns of sounding files.
+
+    Arguments:
+    directory -- where the entries are written, created when needed
+    budget -- bytes of the entries beyond which the least recently used
+        ones are removed
+    """
+
+    def __init__(self, directory, budget=DEFAULT_BUDGET):
+        self.directory = directory
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, path):
+        """Entry of a file: its name and a digest of its absolute path."""
+        path = os.path.abspath(path)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, '%s_%s.npz' % (stem, digest))
+
+    def load(self, path):
+        """(columns, covered) of the cached prefix of a file: {column: array}
+        of the lines of its first covered bytes. None without a valid entry."""
+        entry = self.entry_path(path)
+        try:
+            stat = os.stat(path)
+            with np.load(entry) as data:
+                covered = int(data['covered'])
+                valid = (int(data['version']) == CACHE_VERSION
+                         and str(data['path']) == os.path.abspath(path)
+                         and covered <= stat.st_size)
+                if valid and (int(data['size']), int(data['mtime_ns'])) \
+                        != (stat.st_size, stat.st_mtime_ns):
+                    # fichier modifié depuis : le début doit être le même
+                    valid = _prefix_crc(path, covered) == int(data['crc'])
+                columns = {name[4:]: data[name] for name in data.files
+                           if name.startswith('col_')} if valid else None
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            columns = None
+        if columns is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            # dernière utilisation, pour l'éviction
+            os.utime(entry)
+        except OSError:
+            pass
+        return columns, covered
+
+    def save(self, path, columns, covered):
+        """Store the columns of the lines of the first covered bytes of a
+        file, then evict beyond the budget. Errors (read-only or full disk)
+        are ignored: the cache is only an optimization."""
+        entry = self.entry_path(path)
+        tmp = entry + '.tmp'
+        try:
+            stat = os.stat(path)
+            crc = _prefix_crc(path, covered)
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                np.savez(f, version=CACHE_VERSION, path=os.path.abspath(path),
+                         covered=covered, size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                         crc=crc, **{'col_' + name: np.asarray(values)
+                                     for name, values in columns.items()})
+            os.replace(tmp, entry)
+        except OSError:
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries beyond the budget."""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.budget:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
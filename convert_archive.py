@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch conversion of an archive of soundings to columnar files.
+
+The XData_<start>_<RadiosondeId>.txt and RawData_<start>_<RadiosondeId>.txt
+pairs found under the archive directories are parsed with the parsers of
+the viewer (sounding_reader), the XData frames are decoded and joined on
+the PTU/GPS rows (time_align), and each flight is written to
+<start>_<RadiosondeId>_xdata.npz and <start>_<RadiosondeId>_ptu.npz (or
+.parquet) in the same sub-directory of the output directory. With the
+format 'blocks', each flight is written to one block-compressed archive
+<start>_<RadiosondeId>.rsb instead (block_archive), converted in a
+streaming fashion. Flights are converted in parallel by a pool of
+processes, the largest first.
+
+A manifest <start>_<RadiosondeId>.json records the size, mtime and SHA-1
+of the sources of each converted flight: a flight whose files have the
+same size and mtime, or the same content, is skipped, so a campaign can be
+converted again after new flights were added. The manifest is written
+last, so an interrupted conversion is done again.
+
+Usage::
+
+    python convert_archive.py ARCHIVE [ARCHIVE ...] -o OUTDIR [-j JOBS]
+        [--format npz|parquet|blocks] [--block-seconds N] [--force]
+
+@author: roya
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import block_archive
+from sounding_reader import parse_xdata_lines, parse_ptu_lines, sounding_files
+from time_align import align
+
+
+FORMATS = ('npz', 'parquet', 'blocks')
+# 2 : InstrumentNumber lu en hexadécimal, les vols sont convertis à nouveau
+MANIFEST_VERSION = 2
+
+
+def find_flights(archives):
+    """Flights of the archive directories and their sub-directories.
+
+    Returns a list of (archive, relative directory, key, files) with key
+    and files as in sounding_reader.sounding_files().
+    """
+    flights = []
+    for archive in archives:
+        for directory, subdirs, names in os.walk(archive):
+            subdirs.sort()
+            relative = os.path.relpath(directory, archive)
+            for key, files in sorted(sounding_files(directory).items()):
+                flights.append((archive, relative, key, files))
+    return flights
+
+
+def _stat(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        # fichier illisible : l'erreur est signalée avec son vol
+        return 0
+
+
+def _sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_manifest(path):
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def unchanged(files, manifest, fmt):
+    """True when the sources recorded in a manifest did not change: same
+    size and mtime, or same size and SHA-1 (file copied or touched)."""
+    if manifest is None or manifest.get('format') != fmt:
+        return False
+    sources = manifest['sources']
+    if set(sources) != set(files):
+        return False
+    for kind, path in files.items():
+        recorded = sources[kind]
+        stat = _stat(path)
+        if stat['size'] != recorded['size']:
+            return False
+        if stat['mtime_ns'] != recorded['mtime_ns'] and _sha1(path) != recorded['sha1']:
+            return False
+    return True
+
+
+def _write(columns, path, fmt):
+    """Write a dict of columns, through a temporary file."""
+    tmp = path + '.tmp'
+    if fmt == 'npz':
+        with open(tmp, 'wb') as f:
+            np.savez(f, **columns)
+    else:
+        pd.DataFrame(columns).to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def convert_flight(files, outdir, stem, fmt='npz', force=False, tolerance=2.0,
+                   block_seconds=block_archive.BLOCK_SECONDS):
+    """Convert one flight; run in the worker processes.
+
+    Returns a dict with the status ('converted' or 'skipped'), the bytes
+    read, the rows written and the elapsed time.
+    """
+    start = time.perf_counter()
+    manifest_path = os.path.join(outdir, stem + '.json')
+    if not force and unchanged(files, _read_manifest(manifest_path), fmt):
+        return {'stem': stem, 'status': 'skipped', 'bytes': 0, 'rows': 0,
+                'elapsed': time.perf_counter() - start}
+    if fmt == 'blocks':
+        return _convert_blocks(files, outdir, stem, manifest_path, tolerance,
+                               block_seconds, start)
+    sources = {}
+    blocks = {}
+    for kind, parse_lines in (('xdata', parse_xdata_lines), ('ptu', parse_ptu_lines)):
+        if kind not in files:
+            continue
+        stat = _stat(files[kind])
+        with open(files[kind], 'rb') as f:
+            data = f.read()
+        stat['sha1'] = hashlib.sha1(data).hexdigest()
+        stat['path'] = os.path.abspath(files[kind])
+        sources[kind] = stat
+        blocks[kind] = parse_lines(data.splitlines())
+    if 'xdata' in blocks:
+        ptu = blocks.get('ptu') or parse_ptu_lines([])
+        # trames XData avec P, T, U, position et vent à leur instant
+        blocks['xdata'] = align(blocks['xdata'], ptu, tolerance) or blocks['xdata']
+    os.makedirs(outdir, exist_ok=True)
+    outputs = {}
+    for kind, columns in blocks.items():
+        outputs[kind] = '%s_%s.%s' % (stem, kind, fmt)
+        _write(columns, os.path.join(outdir, outputs[kind]), fmt)
+    rows = {kind: len(columns['timestamp']) for kind, columns in blocks.items()}
+    return _finish(stem, manifest_path, fmt, sources, outputs, rows, start)
+
+
+def _convert_blocks(files, outdir, stem, manifest_path, tolerance, block_seconds, start):
+    """Convert one flight to a block archive, without loading its files."""
+    sources = {}
+    for kind, path in files.items():
+        stat = _stat(path)
+        stat['sha1'] = _sha1(path)
+        stat['path'] = os.path.abspath(path)
+        sources[kind] = stat
+    os.makedirs(outdir, exist_ok=True)
+    output = stem + block_archive.EXTENSION
+    rows = block_archive.convert_flight(files, os.path.join(outdir, output), block_seconds,
+                                        tolerance, meta={'stem': stem})
+    outputs = {kind: output for kind in rows}
+    return _finish(stem, manifest_path, 'blocks', sources, outputs, rows, start)
+
+
+def _finish(stem, manifest_path, fmt, sources, outputs, rows, start):
+    """Write the manifest of a converted flight, last."""
+    manifest = {'version': MANIFEST_VERSION, 'format': fmt, 'sources': sources,
+                'outputs': outputs, 'rows': rows}
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return {'stem': stem, 'status': 'converted',
+            'bytes': sum(s['size'] for s in sources.values()),
+            'rows': sum(rows.values()),
+            'elapsed': time.perf_counter() - start}
+
+
+def convert_archive(archives, outdir, fmt='npz', jobs=None, force=False,
+                    tolerance=2.0, report=print, block_seconds=block_archive.BLOCK_SECONDS):
+    """Convert every flight of the archives with a pool of jobs processes
+    (all the cores by default). report receives one line per flight.
+    Returns the list of the convert_flight() results; a flight whose
+    conversion raised has the status 'failed' and the error, and the
+    others are converted all the same."""
+    flights = find_flights(archives)
+    # les plus gros vols d'abord, pour équilibrer les processus
+    flights.sort(key=lambda f: -sum(_size(p) for p in f[3].values()))
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = {pool.submit(convert_flight, files,
+                               os.path.normpath(os.path.join(outdir, relative)),
+                               '%s_%s' % key, fmt, force, tolerance, block_seconds):
+                   '%s_%s' % key for archive, relative, key, files in flights}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as error:
+                # fichier illisible ou corrompu : on passe aux vols suivants
+                result = {'stem': futures[future], 'status': 'failed',
+                          'error': '%s: %s' % (type(error).__name__, error)}
+            results.append(result)
+            if result['status'] == 'failed':
+                report("%-32s failed (%s)" % (result['stem'], result['error']))
+            elif result['status'] == 'skipped':
+                report("%-32s skipped (unchanged)" % result['stem'])
+            else:
+                report("%-32s %9d rows %8.1f MB %6.2f s %7.1f MB/s"
+                       % (result['stem'], result['rows'], result['bytes'] / 1e6,
+                          result['elapsed'], result['bytes'] / 1e6 / max(result['elapsed'], 1e-9)))
+    elapsed = time.perf_counter() - start
+    converted = [r for r in results if r['status'] == 'converted']
+    failed = [r for r in results if r['status'] == 'failed']
+    total = sum(r['bytes'] for r in converted)
+    report("%d flights converted, %d skipped, %d failed: %.1f MB in %.2f s (%.1f MB/s)"
+           % (len(converted), len(results) - len(converted) - len(failed), len(failed),
+              total / 1e6, elapsed, total / 1e6 / max(elapsed, 1e-9)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('archives', nargs='+', help='directories of XData_/RawData_ files')
+    parser.add_argument('-o', '--outdir', required=True, help='output directory')
+    parser.add_argument('-j', '--jobs', type=int, help='processes (default: all the cores)')
+    parser.add_argument('--format', choices=FORMATS, default='npz')
+    parser.add_argument('--force', action='store_true',
+                        help='convert the flights already converted too')
+    parser.add_argument('--tolerance', type=float, default=2.0,
+                        help='largest time distance (s) of a PTU row joined on a frame')
+    parser.add_argument('--block-seconds', type=float, default=block_archive.BLOCK_SECONDS,
+                        help='flight time (s) of a block of the blocks format')
+    opts = parser.parse_args(argv)
+    if opts.format == 'parquet' and not (importlib.util.find_spec('pyarrow')
+                                         or importlib.util.find_spec('fastparquet')):
+        parser.error('--format parquet needs pyarrow or fastparquet')
+    results = convert_archive(opts.archives, opts.outdir, opts.format, opts.jobs,
+                              opts.force, opts.tolerance, block_seconds=opts.block_seconds)
+    return 1 if any(r['status'] == 'failed' for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,710 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Background ingestion of the sounding files for the live viewer.
+
+A SoundingSession follows one sounding, i.e. the
+XData_<start>_<RadiosondeId>.txt and RawData_<start>_<RadiosondeId>.txt
+pair written by the MW41 scripts, with its own incremental readers. An
+IngestPool watches one or more directories and keeps a session for each
+sounding being written there, and for the latest sounding of each
+directory: two receivers, or a replay next to the live flight, are
+followed at the same time.
+
+The directories and the files of the sessions are watched with a
+QFileSystemWatcher (inotify on Linux) in the thread of the pool: a session
+is parsed only when bytes were appended to its files, and a new sounding
+opens a new session. A stat of the files at a slow pace covers the systems
+on which no notification is sent while the scripts keep the files open;
+without a watcher the stat runs at every interval. Nothing is read while
+the files do not change.
+
+Reading, splitting, time parsing and hexadecimal decoding run in a thread
+pool shared by all the sessions and never block the GUI thread; a session
+is parsed by one thread at a time, so adding a sonde only costs the
+parsing of its own new lines. After a parse the session publishes a
+snapshot of its columns (views on the ColumnBuffers, no copy). Only the
+latest snapshot is kept: the GUI takes it when it renders, and a slow GUI
+skips intermediate updates instead of queueing them.
+
+With stats=True each session counts its parses, the rows and bytes read
+and the snapshots skipped by the GUI, and times its parses (RunStats);
+without it nothing is counted nor timed.
+
+With a window (s) the columns of a session are kept in RollingBuffers:
+the last window seconds at full resolution and a min/max archive of the
+whole flight, so the memory of a session no longer grows with the flight.
+
+A sounding which is already long when its session opens (viewer started
+during the flight, or on a finished flight) is read in chunks cut at line
+boundaries, parsed in a separate thread pool: the last chunk of each file
+is parsed first and published as a preview, so the end of the flight is
+shown at once, then the whole history is published once the older chunks
+are parsed.
+
+With a ColumnCache (column_cache.py) the columns parsed from the files
+are kept on disk: a session opened again on a sounding reads them back and
+only parses the lines written since.
+
+A FrameSubscriber follows the soundings published by the MW41 scripts
+(option -p, FramePublisher) instead of their files: the records are
+received as they are written, without polling nor parsing text, and
+several viewers can follow one flight.
+
+@author: roya
+"""
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from pyqtgraph.Qt import QtCore
+
+from sounding_reader import (XDATA_COLUMNS, PTU_COLUMNS, ColumnBuffer, RollingBuffer,
+                             TailReader, StreamReader, sounding_files, xdata_reader,
+                             ptu_reader, parse_range, xdata_record_columns,
+                             ptu_record_columns)
+from time_align import AsOfJoin
+from ProfileBins import AltitudeProfile
+from XDataInstruments import Registry, SLW_PROBE
+from XDataQC import XDataQC
+from RunStats import RunStats
+from FramePublisher import (ParseMessage, ParseDestination, IsMulticast, KindXData,
+                            KindPtu, DefaultGroup, DefaultPort)
+
+
+log = logging.getLogger(__name__)
+
+# champs des trames XData moyennés par couche d'altitude
+PROFILE_FIELDS = ('pressure', 'temperature', 'twc_frequency', 'slwc_frequency')
+# lignes de l'archive des RollingBuffers (paquets min/max)
+ARCHIVE_ROWS = 4096
+# taille (octets) des morceaux d'un fichier lu au démarrage
+CHUNK_SIZE = 1 << 20
+# stat de secours (ms) malgré le watcher : sous Windows les écritures dans un
+# fichier resté ouvert (scripts MW41) ne sont notifiées qu'au vidage du cache
+SAFETY_INTERVAL = 1000 if os.name == 'nt' else 5000
+
+
+def latest_sounding(directory):
+    """(key, files) of the sounding started last in a directory, None if
+    there is none. See sounding_files()."""
+    soundings = sounding_files(directory)
+    if not soundings:
+        return None
+    # l'heure de début du nom de fichier, et non la date de modification,
+    # pour ne pas basculer entre deux sondages écrits en même temps
+    key = max(soundings)
+    return key, soundings[key]
+
+
+def _empty(columns):
+    return {name: np.zeros(0) for name in columns}
+
+
+class SoundingSession:
+    """Incremental readers and latest snapshot of one sounding.
+
+    The new frames are checked (XDataQC) and joined on the PTU rows
+    (time_align.AsOfJoin) and added to an altitude profile
+    (ProfileBins.AltitudeProfile) as they are parsed, so neither reads the
+    history again. The QC flags of the frames are published as the
+    qc_flags column of the XData snapshot.
+
+    Arguments:
+    key -- (start, radiosonde_id) of the file names
+    files -- {'xdata': path, 'ptu': path}, see sounding_files()
+    layer -- thickness (m) of the layers of the profile
+    stats -- True to count and time the parses in self.stats
+    window -- None to keep every row; else the seconds kept at full
+        resolution, older rows going to a min/max archive
+    xdata_rate -- XData frames per second expected, which sizes the window
+        of the XData frames (PTU rows: one per second)
+    chunk_size -- bytes of the chunks of a file longer than that at the
+        first poll
+    cache -- column_cache.ColumnCache where the parsed columns of the
+        files are kept between two runs, or None
+
+    A snapshot has 'append' False when its columns do not extend those of
+    the snapshot taken before (rolling window, or after the preview of a
+    cold start), and 'preview' True when it only holds the last chunk of
+    the files.
+    """
+
+    def __init__(self, key, files, layer=100.0, stats=False, window=None,
+                 xdata_rate=5.0, chunk_size=CHUNK_SIZE, cache=None):
+        self.key = key
+        self.start, self.radiosonde_id = key
+        self.xdata_tail = None
+        self.ptu_tail = None
+        self.sequence = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._latest = None
+        # parsing en cours dans le pool / à relancer à la fin
+        self._busy = False
+        self._again = False
+        # aperçu publié : l'instantané suivant ne le prolonge pas
+        self._previewed = False
+        self.join = AsOfJoin()
+        self.profile = AltitudeProfile(layer)
+        self.qc = XDataQC()
+        self.window = window
+        self.xdata_rate = xdata_rate
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.qc_flags = self._buffer(('qc_flags',), xdata_rate)
+        self._instruments = {}
+        # mis à jour par le thread qui parse la session
+        self.stats = RunStats() if stats else None
+        self.add_files(files)
+
+    def __repr__(self):
+        return 'SoundingSession(%r)' % (self.key,)
+
+    @property
+    def label(self):
+        s = self.start
+        return '%s  %s-%s-%s %s:%s:%s' % (self.radiosonde_id, s[:4], s[4:6], s[6:8],
+                                           s[8:10], s[10:12], s[12:14])
+
+    @property
+    def tails(self):
+        return [tail for tail in (self.xdata_tail, self.ptu_tail) if tail is not None]
+
+    @property
+    def paths(self):
+        return [tail.path for tail in self.tails]
+
+    def _buffer(self, columns, rate):
+        """Storage of the rows of a file, rate rows per second."""
+        if self.window is None:
+            return ColumnBuffer(columns)
+        # même taille pour les trames et leurs qc_flags : mêmes paquets
+        return RollingBuffer(columns, int(self.window * rate), ARCHIVE_ROWS)
+
+    def add_files(self, files):
+        """Follow the files of the sounding created since; True if any."""
+        added = False
+        if self.xdata_tail is None and 'xdata' in files:
+            self.xdata_tail = xdata_reader(files['xdata'],
+                                           buffer=self._buffer(XDATA_COLUMNS, self.xdata_rate),
+                                           cache=self.cache)
+            added = True
+        if self.ptu_tail is None and 'ptu' in files:
+            self.ptu_tail = ptu_reader(files['ptu'], buffer=self._buffer(PTU_COLUMNS, 1.0),
+                                       cache=self.cache)
+            added = True
+        return added
+
+    def add_streams(self, source):
+        """Read the records published to source (see FrameSubscriber)
+        instead of the files."""
+        self.xdata_tail = StreamReader('%s XData' % source, xdata_record_columns, XDATA_COLUMNS,
+                                       buffer=self._buffer(XDATA_COLUMNS, self.xdata_rate))
+        self.ptu_tail = StreamReader('%s RawData' % source, ptu_record_columns, PTU_COLUMNS,
+                                     buffer=self._buffer(PTU_COLUMNS, 1.0))
+
+    def save_cache(self):
+        """Store the columns read so far in the cache (full resolution
+        only); not while the session is being parsed."""
+        for tail in self.tails:
+            if isinstance(tail, TailReader):
+                tail.save_cache()
+
+    def changed(self):
+        """True when a file size differs from what was read (a trailing
+        partial line keeps the size ahead of the offset until it is complete)."""
+        return any(_size(tail.path) != tail.offset for tail in self.tails)
+
+    def _update_profile(self, ptu_added, xdata_added):
+        if ptu_added:
+            self.join.push_ptu(self.ptu_tail.block)
+        if xdata_added:
+            self.join.push_xdata(self.xdata_tail.block)
+        frames = self.join.pop()
+        if frames is not None and len(frames['timestamp']):
+            self.profile.AddColumns(frames['altitude'].tolist(),
+                                    dict((name, frames[name].tolist())
+                                         for name in PROFILE_FIELDS))
+
+    def _instrument(self, instrument_type, number):
+        """Name of the instrument of a frame for XDataQC, e.g. 'OIF411#2'."""
+        key = (instrument_type, number)
+        name = self._instruments.get(key)
+        if name is None:
+            spec = None
+            number = int(number) if np.isfinite(number) else None
+            if np.isfinite(instrument_type):
+                spec = Registry.Lookup('%02X' % int(instrument_type), number)
+            name = spec.Name if spec is not None else 'unknown'
+            if spec is not None and spec.HasNumber and number is not None:
+                name = '%s#%d' % (name, number)
+            self._instruments[key] = name
+        return name
+
+    def _check_frames(self, xdata_added):
+        """QC flags of the new frames. Only the TWC/SLWC frequencies are
+        decoded by the readers: the frames of the other instruments are
+        checked for gaps and repeats only."""
+        rows = self.xdata_tail.block
+        flags = np.zeros(xdata_added)
+        columns = [rows[name].tolist() for name in
+                   ('rx_time', 'instrument_type', 'instrument_number')
+                   + SLW_PROBE.FieldNames]
+        for i, (rx_time, itype, number, twc, slwc) in enumerate(zip(*columns)):
+            name = self._instrument(itype, number)
+            values = {'twc_frequency': twc, 'slwc_frequency': slwc} \
+                if name == SLW_PROBE.Name else {}
+            flags[i] = self.qc.Check(rx_time, name, values)
+        self.qc_flags.append({'qc_flags': flags})
+
+    def alerts(self):
+        """QC alerts of the instruments. The XData frames are also
+        compared with the RawData rows, so an XData stream which stopped
+        while the PTU rows keep arriving is reported."""
+        now = self.qc.LastRxTime
+        if now is not None and self.ptu_tail is not None and len(self.ptu_tail.data) \
+                and len(self.xdata_tail.data):
+            late = self.ptu_tail.data['timestamp'][-1] - self.xdata_tail.data['timestamp'][-1]
+            now += max(late, 0.0)
+        return self.qc.Alerts(now)
+
+    def profile_columns(self):
+        """Ascent and descent profiles, {phase: {column: array}} (see
+        ProfileBins.AltitudeProfile.Columns, missing values as NaN)."""
+        profiles = {}
+        for phase in self.profile.Phases:
+            columns = self.profile.Columns(phase)
+            profiles[phase] = {name: np.array(values, dtype=float)
+                               for name, values in columns.items()}
+            # champs pas encore reçus (aucune trame jointe) : NaN
+            layers = len(columns['bottom'])
+            for name in PROFILE_FIELDS:
+                for suffix in ('_mean', '_min', '_max'):
+                    profiles[phase].setdefault(name + suffix, np.full(layers, np.nan))
+        return profiles
+
+    def _cold_start(self, map_chunks):
+        """First poll of long files: the last chunk of each file is parsed
+        and published first, then the older chunks are parsed by
+        map_chunks. Returns (ptu_added, xdata_added), None when the files
+        hold less than two chunks."""
+        ranges = {tail: tail.chunks(self.chunk_size) for tail in self.tails
+                  if isinstance(tail, TailReader)}
+        if not any(len(r) > 1 for r in ranges.values()):
+            return None
+        # la fin du vol d'abord : l'opérateur voit tout de suite les dernières données
+        newest = {tail: parse_range(tail.path, tail.parse_lines, *r[-1])
+                  for tail, r in ranges.items() if r}
+        xdata = _empty(XDATA_COLUMNS + ('qc_flags',))
+        if self.xdata_tail in newest:
+            xdata = dict(newest[self.xdata_tail])
+            xdata['qc_flags'] = np.zeros(len(xdata['timestamp']))
+        self._publish({'append': False, 'preview': True,
+                       'xdata': xdata,
+                       'ptu': newest.get(self.ptu_tail, _empty(PTU_COLUMNS)),
+                       'profile': self.profile_columns(),
+                       'alerts': []})
+        self._previewed = True
+        jobs = [(tail, start, end) for tail, r in ranges.items() for start, end in r[:-1]]
+        blocks = map_chunks(parse_range, [tail.path for tail, _, _ in jobs],
+                            [tail.parse_lines for tail, _, _ in jobs],
+                            [start for _, start, _ in jobs], [end for _, _, end in jobs])
+        older = {tail: [] for tail in newest}
+        for (tail, _, _), block in zip(jobs, blocks):
+            older[tail].append(block)
+        added = {tail: tail.extend(older[tail] + [newest[tail]], ranges[tail][-1][1])
+                 for tail in newest}
+        for tail in ranges:
+            if tail not in newest:
+                # rien de nouveau après le début lu dans le cache
+                added[tail] = tail.poll()
+        return added.get(self.ptu_tail, 0), added.get(self.xdata_tail, 0)
+
+    def _publish(self, snapshot):
+        with self._lock:
+            self.sequence += 1
+            snapshot['sequence'] = self.sequence
+            if self._latest is not None:
+                self.dropped += 1
+                # l'instantané remplacé n'était pas la suite du précédent
+                snapshot['append'] = snapshot['append'] and self._latest['append']
+            self._latest = snapshot
+
+    def poll(self, map_chunks=None):
+        """Parse what was appended to the files and publish a snapshot.
+
+        map_chunks -- map function (e.g. of a thread pool) parsing the
+            chunks of long files at the first poll; None to parse them
+            in one block
+        """
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+        added = None
+        if map_chunks is not None and self.sequence == 0:
+            added = self._cold_start(map_chunks)
+        if added is None:
+            added = (self.ptu_tail.poll() if self.ptu_tail else 0,
+                     self.xdata_tail.poll() if self.xdata_tail else 0)
+        ptu_added, xdata_added = added
+        # la première publication a lieu même sans données
+        if ptu_added + xdata_added == 0 and self.sequence:
+            return
+        if xdata_added:
+            self._check_frames(xdata_added)
+        self._update_profile(ptu_added, xdata_added)
+        for tail in self.tails:
+            # au démarrage le bloc est tout le fichier
+            tail.block = None
+        xdata = _empty(XDATA_COLUMNS + ('qc_flags',))
+        if self.xdata_tail:
+            xdata = self.xdata_tail.data.snapshot()
+            xdata['qc_flags'] = self.qc_flags.snapshot()['qc_flags']
+        snapshot = {'append': self.window is None and not self._previewed,
+                    'preview': False,
+                    'xdata': xdata,
+                    'ptu': (self.ptu_tail.data.snapshot() if self.ptu_tail
+                            else _empty(PTU_COLUMNS)),
+                    'profile': self.profile_columns(),
+                    'alerts': self.alerts()}
+        self._previewed = False
+        self._publish(snapshot)
+        if stats is not None:
+            stats.Time('parse', time.perf_counter() - start)
+            stats.Count('xdata_rows', xdata_added)
+            stats.Count('ptu_rows', ptu_added)
+            stats.Set('bytes_read', sum(tail.offset for tail in self.tails))
+            stats.Set('snapshots_dropped', self.dropped)
+
+    def take(self):
+        """Latest snapshot, or None when it was already taken."""
+        with self._lock:
+            snapshot = self._latest
+            self._latest = None
+        return snapshot
+
+
+class IngestPool(QtCore.QObject):
+    """Follows the soundings written in directories, in background threads.
+
+    Arguments:
+    directories -- directories where the MW41 scripts write their files
+    workers -- threads parsing the files, shared by all the sessions
+    max_sessions -- soundings followed at once; beyond, the session which
+        started first is closed
+    active_age -- a sounding whose files were written in the last
+        active_age seconds is followed, besides the latest one of each
+        directory
+    interval -- period (ms) of the stat of the files when no file system
+        watcher is available
+    safety_interval -- period (ms) of the stat of the files with a watcher,
+        1 s on Windows where the writes to files kept open are notified late
+    debounce -- delay (ms) gathering the notifications of one write
+    watch -- False to only stat the files every interval
+    layer -- thickness (m) of the layers of the altitude profiles
+    stats -- True to count and time the parses of the sessions
+    window, xdata_rate, chunk_size, cache -- see SoundingSession
+    chunk_workers -- threads parsing the chunks of the files already long
+        when their session opens, all the cores by default
+    """
+
+    sessionAdded = QtCore.Signal(object)
+    sessionRemoved = QtCore.Signal(object)
+
+    def __init__(self, directories, workers=2, max_sessions=4, active_age=600,
+                 interval=1000, safety_interval=SAFETY_INTERVAL, debounce=20, watch=True,
+                 layer=100.0, stats=False, window=None, xdata_rate=5.0,
+                 chunk_size=CHUNK_SIZE, chunk_workers=None, cache=None):
+        super().__init__()
+        if isinstance(directories, str):
+            directories = [directories]
+        self.directories = list(directories)
+        self.max_sessions = max_sessions
+        self.active_age = active_age
+        self.interval = interval
+        self.safety_interval = safety_interval
+        self.debounce = debounce
+        self.watch = watch
+        self.layer = layer
+        self.stats = stats
+        self.window = window
+        self.xdata_rate = xdata_rate
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.sessions = {}
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='ingest')
+        # pool à part : un parse attend ses morceaux sans bloquer les autres sessions
+        self._chunks = ThreadPoolExecutor(chunk_workers or os.cpu_count(),
+                                          thread_name_prefix='chunks')
+        self._dirty = set()
+        self._watcher = None
+        self._timer = None
+        self._pending = None
+        self._thread = QtCore.QThread()
+        self.moveToThread(self._thread)
+        self._thread.started.connect(self._start)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching and wait for the threads to end (from the GUI thread)."""
+        QtCore.QMetaObject.invokeMethod(self, '_stop',
+                                        QtCore.Qt.BlockingQueuedConnection)
+        self._thread.quit()
+        self._thread.wait()
+        self._executor.shutdown()
+        self._chunks.shutdown()
+        # plus de parsing en cours : les colonnes lues depuis le démarrage
+        for session in self.sessions.values():
+            session.save_cache()
+
+    @QtCore.Slot()
+    def _start(self):
+        # timers et watcher sont créés dans le thread du pool
+        self._pending = QtCore.QTimer()
+        self._pending.setSingleShot(True)
+        self._pending.timeout.connect(self._parse_dirty)
+        if self.watch:
+            self._watcher = QtCore.QFileSystemWatcher()
+            self._watcher.directoryChanged.connect(self.scan)
+            self._watcher.fileChanged.connect(self._file_changed)
+        self._timer = QtCore.QTimer()
+        self._timer.timeout.connect(self._check)
+        self._timer.start(self.interval if self._watcher is None else self.safety_interval)
+        self.scan()
+
+    @QtCore.Slot()
+    def _stop(self):
+        # détruits dans leur thread
+        for timer in (self._timer, self._pending):
+            if timer is not None:
+                timer.stop()
+        self._timer = self._pending = self._watcher = None
+
+    def _watch_paths(self):
+        if self._watcher is None:
+            return
+        directories = self._watcher.directories()
+        for directory in self.directories:
+            # répertoire créé après le lancement ou recréé
+            if directory not in directories and os.path.isdir(directory):
+                self._watcher.addPath(directory)
+        watched = set(self._watcher.files())
+        wanted = set(path for session in self.sessions.values() for path in session.paths)
+        if watched - wanted:
+            self._watcher.removePaths(list(watched - wanted))
+        for path in wanted - watched:
+            self._watcher.addPath(path)
+
+    def _active(self):
+        """{key: files} of the soundings to follow."""
+        now = time.time()
+        active = {}
+        for directory in self.directories:
+            soundings = sounding_files(directory)
+            if not soundings:
+                continue
+            latest = max(soundings)
+            for key, files in soundings.items():
+                if key == latest or key in self.sessions or \
+                        now - max(_mtime(path) for path in files.values()) < self.active_age:
+                    active.setdefault(key, {}).update(files)
+        return active
+
+    @QtCore.Slot()
+    @QtCore.Slot(str)
+    def scan(self, *args):
+        """Open a session for each new sounding and follow the files
+        created for the current ones."""
+        for key, files in sorted(self._active().items()):
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.sessions[key] = SoundingSession(
+                    key, files, self.layer, self.stats, self.window, self.xdata_rate,
+                    self.chunk_size, self.cache)
+                self.sessionAdded.emit(session)
+            elif not session.add_files(files):
+                continue
+            self.submit(session)
+        # trop de sessions : on ferme celles qui ont commencé le plus tôt
+        for key in sorted(self.sessions)[:max(len(self.sessions) - self.max_sessions, 0)]:
+            self.sessionRemoved.emit(self.sessions.pop(key))
+        self._watch_paths()
+
+    @QtCore.Slot(str)
+    def _file_changed(self, path):
+        if self._watcher is not None and path not in self._watcher.files() \
+                and os.path.exists(path):
+            # fichier remplacé : inotify suit l'ancien inode
+            self._watcher.addPath(path)
+        for session in self.sessions.values():
+            if path in session.paths:
+                self._dirty.add(session.key)
+        # les notifications d'une même écriture sont regroupées
+        if not self._pending.isActive():
+            self._pending.start(self.debounce)
+
+    @QtCore.Slot()
+    def _parse_dirty(self):
+        dirty, self._dirty = self._dirty, set()
+        for key in dirty:
+            if key in self.sessions:
+                self.submit(self.sessions[key])
+
+    @QtCore.Slot()
+    def _check(self):
+        """Stat fallback: parse the sessions whose file sizes changed."""
+        if self._watcher is None or \
+                len(self._watcher.directories()) < len(self.directories):
+            # sans watcher, ou répertoire pas encore créé (ou supprimé)
+            self.scan()
+        for session in self.sessions.values():
+            if session.changed():
+                self.submit(session)
+
+    def submit(self, session):
+        """Parse a session in the pool; if it is being parsed, once more
+        when that parse ends."""
+        with session._lock:
+            if session._busy:
+                session._again = True
+                return
+            session._busy = True
+        self._executor.submit(_parse, session, self._chunks.map)
+
+
+class FrameSubscriber(IngestPool):
+    """Follows the soundings published by the MW41 scripts (FramePublisher).
+
+    The datagrams are received by a thread of the subscriber and their
+    records queued in the StreamReaders of their sounding; every debounce
+    ms the sessions which received records are parsed in the thread pool,
+    as those of an IngestPool. Nothing is read from the files.
+
+    Arguments:
+    destination -- 'group:port' where the scripts publish, or
+        'address:port' of this computer for datagrams sent to it
+    interface -- address of the interface joining the multicast group
+    options -- IngestPool options (workers, max_sessions, debounce, layer,
+        stats, window, xdata_rate)
+    """
+
+    def __init__(self, destination='%s:%d' % (DefaultGroup, DefaultPort),
+                 interface='0.0.0.0', **options):
+        super().__init__([], **options)
+        self.address = ParseDestination(destination)
+        self.interface = interface
+        self._socket = None
+        self._listener = None
+        self._closing = threading.Event()
+
+    @QtCore.Slot()
+    def _start(self):
+        host, port = self.address
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # plusieurs visualisations sur le même poste
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if IsMulticast(host):
+            sock.bind(('', port))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            struct.pack('4s4s', socket.inet_aton(host),
+                                        socket.inet_aton(self.interface)))
+        else:
+            sock.bind((host, port))
+        sock.settimeout(self.debounce / 1000)
+        self._socket = sock
+        self._listener = threading.Thread(target=self._listen, name='subscriber', daemon=True)
+        self._listener.start()
+
+    @QtCore.Slot()
+    def _stop(self):
+        self._closing.set()
+        if self._listener is not None:
+            self._listener.join()
+            self._socket.close()
+        self._listener = self._socket = None
+
+    def _listen(self):
+        flushed = time.monotonic()
+        while not self._closing.is_set():
+            try:
+                data = self._socket.recv(65536)
+            except socket.timeout:
+                data = None
+            self._receive(data)
+            now = time.monotonic()
+            if self._dirty and (data is None or now - flushed >= self.debounce / 1000):
+                dirty, self._dirty = self._dirty, set()
+                for key in dirty:
+                    if key in self.sessions:
+                        self.submit(self.sessions[key])
+                flushed = now
+
+    def _receive(self, data):
+        message = ParseMessage(data) if data else None
+        if message is None:
+            return
+        kind, layout, sequence, start, radiosonde_id, payload = message
+        if kind not in (KindXData, KindPtu):
+            return
+        key = (start, radiosonde_id)
+        session = self.sessions.get(key)
+        if session is None:
+            session = self._open(key)
+        stream = session.xdata_tail if kind == KindXData else session.ptu_tail
+        if layout:
+            try:
+                stream.set_layout(payload)
+            except (ValueError, struct.error):
+                return
+        elif stream.push(sequence, payload):
+            self._dirty.add(key)
+
+    def _open(self, key):
+        """New session for a sounding heard for the first time."""
+        session = self.sessions[key] = SoundingSession(
+            key, {}, self.layer, self.stats, self.window, self.xdata_rate)
+        session.add_streams('udp://%s:%d' % self.address)
+        self.sessionAdded.emit(session)
+        for old in sorted(self.sessions)[:max(len(self.sessions) - self.max_sessions, 0)]:
+            self.sessionRemoved.emit(self.sessions.pop(old))
+        return session
+
+
+def _parse(session, map_chunks=None):
+    try:
+        while True:
+            session.poll(map_chunks)
+            with session._lock:
+                # même verrou que submit() : pas de demande perdue entre les deux
+                if not session._again:
+                    session._busy = False
+                    return
+                session._again = False
+    except Exception:
+        # sinon l'erreur reste dans le future et la session n'est plus lue
+        log.exception("parse of %s failed", session.key)
+        with session._lock:
+            session._busy = False
+            session._again = False
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return -1
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline replay of recorded sounding events through the MW41 scripts.
+
+WriteXData.py and NewRawData.py normally run inside the MW41 IronPython
+host, which provides ``clr``, the ``System`` / ``Vaisala`` assemblies and
+the ``SoundingInterface`` object. This module installs a minimal stand-in
+for that surface so the scripts run unchanged under CPython, then feeds
+them a recorded event stream, at real-time pace or as fast as possible,
+and measures the cost of every HandleData call.
+
+Event streams are JSON lines. The first line describes the sounding::
+
+    {"type": "Sounding", "RadiosondeId": "S1234567",
+     "SoundingStartTime": "2021-11-23 10:00:00",
+     "RadioResetTime": "2021-11-23 09:59:40", "LaunchTime": 30.0}
+
+then one line per event, with ``time`` in seconds since the start of the
+replay and the attributes of the MW41 object::
+
+    {"type": "SystemEvent", "time": 0.0, "EventName": "ReadyForRelease"}
+    {"type": "RawPtu", "time": 1.0, "RadioRxTime": 21.0, "Pressure": 1013.2, ...}
+    {"type": "GPSResult", "time": 1.0, "RadioRxTime": 21.0, "Status": "Autonomous",
+     "PositionWgs84": {"Longitude": 1.4, "Latitude": 43.6}, ...}
+    {"type": "AdditionalSensorData", "time": 1.2, "RadioRxTime": 21.2, "XData": "1EA9F10C35", ...}
+
+Usage: python mw41_replay.py events.jsonl -o OUTDIR [--realtime] [--speed X]
+
+@author: roya
+"""
+import argparse
+import datetime as _dt
+import importlib.util
+import json
+import os
+import sys
+import time
+import types
+
+import numpy as np
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = ('WriteXData', 'NewRawData', 'WriteProfile')
+
+
+#################################################################################
+# Stand-in for the .NET and Vaisala types used by the scripts.
+#################################################################################
+
+class _ClrType:
+    def __init__(self, name):
+        self.Name = name
+
+
+class _Placeholder:
+    """Any Vaisala type the scripts import but do not use."""
+
+
+class Array:
+    """System.Array: Array[Type]([...]) is a list."""
+
+    def __class_getitem__(cls, item):
+        return list
+
+
+class DateTime:
+    """Subset of System.DateTime used by the scripts."""
+
+    # jetons .NET -> strftime, du plus long au plus court
+    _FORMAT = [('yyyy', '%Y'), ('MM', '%m'), ('dd', '%d'), ('HH', '%H'),
+               ('mm', '%M'), ('ss', '%S')]
+
+    def __init__(self, value):
+        self.value = value
+
+    @classmethod
+    def parse(cls, text):
+        return cls(_dt.datetime.fromisoformat(text))
+
+    def __getattr__(self, name):
+        if name in ('Year', 'Month', 'Day', 'Hour', 'Minute', 'Second'):
+            return getattr(self.value, name.lower())
+        raise AttributeError(name)
+
+    def AddSeconds(self, seconds):
+        return DateTime(self.value + _dt.timedelta(seconds=seconds))
+
+    def ToString(self, fmt, culture=None):
+        millis = '%03d' % (self.value.microsecond // 1000)
+        fmt = fmt.replace('.fff', '.\0')
+        for token, directive in self._FORMAT:
+            fmt = fmt.replace(token, directive)
+        return self.value.strftime(fmt).replace('\0', millis)
+
+    def __str__(self):
+        return self.ToString('yyyy-MM-dd HH:mm:ss.fff')
+
+
+class _Path:
+    Combine = staticmethod(os.path.join)
+    GetDirectoryName = staticmethod(os.path.dirname)
+
+
+class _Directory:
+    Exists = staticmethod(os.path.isdir)
+    CreateDirectory = staticmethod(lambda path: os.makedirs(path, exist_ok=True))
+
+
+class _File:
+    Exists = staticmethod(os.path.isfile)
+
+
+class _CultureInfo:
+    InvariantCulture = None
+
+
+class LogCategory:
+    info = 'info'
+    warning = 'warning'
+    error = 'error'
+
+
+class WindSolutionStatus:
+    NoSolution = 'NoSolution'
+    Autonomous = 'Autonomous'
+    Differential = 'Differential'
+
+
+class IExecutableScript:
+    pass
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    # les autres noms importés par les scripts sont des types inutilisés ici
+    module.__getattr__ = lambda attr: type(attr, (_Placeholder,), {})
+    return module
+
+
+def install():
+    """Register the stand-in modules in sys.modules."""
+    if 'clr' in sys.modules and getattr(sys.modules['clr'], 'STANDIN', False):
+        return
+    clr = _module('clr', STANDIN=True, AddReference=lambda name: None,
+                  GetClrType=lambda t: _ClrType(t.__name__))
+    modules = {
+        'clr': clr,
+        'System': _module('System', Array=Array, Type=_ClrType, DateTime=DateTime),
+        'System.IO': _module('System.IO', File=_File, Path=_Path,
+                             Directory=_Directory),
+        'System.Globalization': _module('System.Globalization',
+                                        CultureInfo=_CultureInfo),
+        'Vaisala': _module('Vaisala'),
+        'Vaisala.Framework': _module('Vaisala.Framework'),
+        'Vaisala.Framework.Log': _module('Vaisala.Framework.Log',
+                                         LogCategory=LogCategory),
+        'Vaisala.Soundings': _module('Vaisala.Soundings'),
+        'Vaisala.Soundings.Framework': _module(
+            'Vaisala.Soundings.Framework', IExecutableScript=IExecutableScript),
+        'Vaisala.Soundings.Framework.DataTypes': _module(
+            'Vaisala.Soundings.Framework.DataTypes'),
+        'Vaisala.Soundings.Framework.DataTypes.PTU': _module(
+            'Vaisala.Soundings.Framework.DataTypes.PTU'),
+        'Vaisala.Soundings.Framework.DataTypes.GPS': _module(
+            'Vaisala.Soundings.Framework.DataTypes.GPS',
+            WindSolutionStatus=WindSolutionStatus),
+    }
+    try:
+        import imp  # noqa: F401  (WriteXData imports it, removed in Python 3.12)
+    except ImportError:
+        modules['imp'] = _module('imp')
+    sys.modules.update(modules)
+
+
+#################################################################################
+# Sounding events and SoundingInterface.
+#################################################################################
+
+class Event:
+    """MW41 data object built from one recorded JSON event."""
+
+    def __init__(self, record):
+        self._type = _ClrType(record['type'])
+        for key, value in record.items():
+            if key in ('type', 'time'):
+                continue
+            if isinstance(value, dict):
+                value = types.SimpleNamespace(**value)
+            setattr(self, key, value)
+
+    def GetType(self):
+        return self._type
+
+
+class SoundingInterface:
+    """Stand-in for the ISounding object given to a script."""
+
+    def __init__(self, info, additional_data=()):
+        self.info = types.SimpleNamespace(
+            SoundingStartTime=DateTime.parse(info['SoundingStartTime']),
+            RadioResetTime=DateTime.parse(info.get('RadioResetTime',
+                                                   info['SoundingStartTime'])),
+            LaunchTime=info.get('LaunchTime', 0.0))
+        self.radiosonde = types.SimpleNamespace(ID=info.get('RadiosondeId', 'REPLAY'))
+        self.metadata = {'FREE_TEXT': info.get('Comments', '')}
+        self.additional_data = list(additional_data)
+        self.ordered = set()
+        self.log = []
+        self.reports = []
+        self.stopped = False
+
+    def OrderNotifications(self, types_):
+        self.ordered.update(t.Name for t in types_)
+
+    def GetRadiosonde(self):
+        return self.radiosonde
+
+    def GetSoundingInformation(self):
+        return self.info
+
+    def GetSoundingMetadata(self, key):
+        return self.metadata.get(key)
+
+    def GetAdditionalSensorData(self):
+        return self.additional_data
+
+    def Log(self, category, message):
+        self.log.append((category, message))
+
+    def SendReport(self, name, report, destinations):
+        self.reports.append((name, len(report), list(destinations)))
+
+    def StopScript(self):
+        self.stopped = True
+
+
+def load_script(name, sounding, args=()):
+    """Import a MW41 script with its own SoundingInterface and instantiate it."""
+    install()
+    if HERE not in sys.path:
+        sys.path.insert(0, HERE)
+    spec = importlib.util.spec_from_file_location(
+        'mw41_' + name, os.path.join(HERE, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    module.SoundingInterface = sounding
+    spec.loader.exec_module(module)
+    return getattr(module, name)(list(args))
+
+
+def read_events(path):
+    """Returns (sounding description, list of event records) of a JSON lines file."""
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records or records[0].get('type') != 'Sounding':
+        raise ValueError("%s: first line must describe the sounding" % path)
+    return records[0], records[1:]
+
+
+#################################################################################
+# Replay.
+#################################################################################
+
+class ReplayStats:
+    """Per-event timing of a replay."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.elapsed = 0.0
+        self.bytes_written = 0
+
+    def add(self, event_type, seconds):
+        self.latencies.setdefault(event_type, []).append(seconds)
+
+    @property
+    def events(self):
+        return sum(len(v) for v in self.latencies.values())
+
+    def summary(self):
+        """Dict of the replay figures, latencies in microseconds."""
+        out = {'events': self.events, 'elapsed_s': self.elapsed,
+               'events_per_s': self.events / self.elapsed if self.elapsed else 0.0,
+               'bytes_written': self.bytes_written, 'latency_us': {}}
+        for event_type, values in sorted(self.latencies.items()):
+            values = np.asarray(values) * 1e6
+            out['latency_us'][event_type] = {
+                'count': len(values),
+                'p50': float(np.percentile(values, 50)),
+                'p90': float(np.percentile(values, 90)),
+                'p99': float(np.percentile(values, 99)),
+                'max': float(values.max())}
+        return out
+
+
+class Replayer:
+    """Feeds events one at a time to the scripts and times every HandleData call.
+
+    Arguments:
+    info -- sounding description (first line of a recording)
+    outdir -- directory given to the scripts with -f
+    realtime -- wait for the ``time`` of each event (divided by speed)
+    """
+
+    def __init__(self, info, outdir, scripts=SCRIPTS, script_args=(),
+                 realtime=False, speed=1.0):
+        os.makedirs(outdir, exist_ok=True)
+        self.outdir = outdir
+        self.realtime = realtime
+        self.speed = speed
+        self.instances = []
+        for name in scripts:
+            sounding = SoundingInterface(info)
+            self.instances.append((load_script(name, sounding,
+                                               ['-f', outdir] + list(script_args)),
+                                   sounding))
+        self.stats = ReplayStats()
+        self.clock = time.perf_counter
+        self.start = self.clock()
+
+    def feed(self, record):
+        """Give one event record to the scripts which ordered its type."""
+        event = Event(record)
+        clock = self.clock
+        if self.realtime:
+            delay = record.get('time', 0.0) / self.speed - (clock() - self.start)
+            if delay > 0:
+                time.sleep(delay)
+        name = event.GetType().Name
+        for script, sounding in self.instances:
+            if sounding.stopped or name not in sounding.ordered:
+                continue
+            t0 = clock()
+            try:
+                script.HandleData(event)
+            except SystemExit:
+                # SoundingCompleted : le script s'arrête
+                pass
+            self.stats.add(name, clock() - t0)
+
+    def bytes_written(self):
+        return sum(os.path.getsize(os.path.join(self.outdir, f))
+                   for f in os.listdir(self.outdir)
+                   if os.path.isfile(os.path.join(self.outdir, f)))
+
+    def finish(self):
+        """Replay statistics, once the last event was fed."""
+        self.stats.elapsed = self.clock() - self.start
+        self.stats.bytes_written = self.bytes_written()
+        return self.stats
+
+
+def replay(info, records, outdir, scripts=SCRIPTS, script_args=(),
+           realtime=False, speed=1.0):
+    """Feed events to the scripts and time every HandleData call.
+
+    Arguments:
+    info -- sounding description (first line of a recording)
+    records -- iterable of event records
+    outdir -- directory given to the scripts with -f
+    realtime -- wait for the ``time`` of each event (divided by speed)
+    """
+    replayer = Replayer(info, outdir, scripts, script_args, realtime, speed)
+    for record in records:
+        replayer.feed(record)
+    return replayer.finish()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('events', help='JSON lines event recording')
+    parser.add_argument('-o', '--outdir', required=True,
+                        help='directory where the scripts write their files')
+    parser.add_argument('--realtime', action='store_true',
+                        help='replay at the recorded pace')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='speed factor of the real-time replay')
+    parser.add_argument('--script', action='append', choices=SCRIPTS,
+                        help='script to run (default: all)')
+    parser.add_argument('--args', default='',
+                        help='extra command line options given to the scripts, e.g. --args="-b"')
+    opts = parser.parse_args(argv)
+    info, records = read_events(opts.events)
+    stats = replay(info, records, opts.outdir, opts.script or SCRIPTS,
+                   opts.args.split(), opts.realtime, opts.speed)
+    print(json.dumps(stats.summary(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
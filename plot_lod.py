@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Level-of-detail plotting of long time series.
+
+A MinMaxPyramid keeps, for a series growing at its end, the minimum and
+maximum of every bucket of factor**k samples for k = 1, 2, ... Only the
+samples appended since the previous update are aggregated. A view of a
+time range at a given pixel width is drawn from the coarsest level which
+still has about one bucket per pixel, as the (time ordered) minimum and
+maximum of each bucket: peaks and gaps stay visible, and the number of
+points drawn no longer depends on the length of the flight. Zoomed in, the
+raw samples are drawn.
+
+LodCurve and TrackCurve replace the PlotDataItem of a pyqtgraph plot and
+have the same setData(x, y) call.
+
+@author: roya
+"""
+import numpy as np
+
+from sounding_reader import ColumnBuffer
+
+
+LEVEL_COLUMNS = ('x0', 'x_lo', 'y_lo', 'x_hi', 'y_hi')
+
+
+def _aggregate(x0, x_lo, y_lo, x_hi, y_hi, factor):
+    """Buckets of factor consecutive items: first x, minimum and maximum
+    with their x. A bucket of NaN only has NaN extrema."""
+    m = len(x0) // factor
+    n = m * factor
+    lo = np.where(np.isnan(y_lo[:n]), np.inf, y_lo[:n]).reshape(m, factor)
+    hi = np.where(np.isnan(y_hi[:n]), -np.inf, y_hi[:n]).reshape(m, factor)
+    i_lo = np.arange(m) * factor + lo.argmin(axis=1)
+    i_hi = np.arange(m) * factor + hi.argmax(axis=1)
+    return {'x0': x0[:n:factor], 'x_lo': x_lo[i_lo], 'y_lo': y_lo[i_lo],
+            'x_hi': x_hi[i_hi], 'y_hi': y_hi[i_hi]}
+
+
+def _interleave(block):
+    """(x, y) of the minimum and maximum of each bucket, in time order."""
+    lo_first = ~(block['x_hi'] < block['x_lo'])
+    x = np.empty(2 * len(lo_first))
+    y = np.empty(2 * len(lo_first))
+    x[0::2] = np.where(lo_first, block['x_lo'], block['x_hi'])
+    y[0::2] = np.where(lo_first, block['y_lo'], block['y_hi'])
+    x[1::2] = np.where(lo_first, block['x_hi'], block['x_lo'])
+    y[1::2] = np.where(lo_first, block['y_hi'], block['y_lo'])
+    return x, y
+
+
+class MinMaxPyramid:
+    """Incremental min/max pyramid of a series sorted by x.
+
+    Arguments:
+    factor -- samples per bucket of level 1, and buckets of level k per
+        bucket of level k + 1
+    """
+
+    def __init__(self, factor=4):
+        self.factor = factor
+        self.reset()
+
+    def reset(self):
+        self.x = self.y = np.zeros(0)
+        # levels[k - 1] : buckets of factor**k samples
+        self.levels = []
+
+    def __len__(self):
+        return len(self.x)
+
+    def _source(self, k):
+        """Columns of level k, the raw samples for k = 0."""
+        if k == 0:
+            return {'x0': self.x, 'x_lo': self.x, 'y_lo': self.y,
+                    'x_hi': self.x, 'y_hi': self.y}
+        level = self.levels[k - 1]
+        return {name: level[name] for name in LEVEL_COLUMNS}
+
+    def update(self, x, y):
+        """Take the whole series, e.g. ColumnBuffer views: only the samples
+        after the previous update are aggregated."""
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if len(x) < len(self.x):
+            # série tronquée (nouveau fichier) : on repart de zéro
+            self.reset()
+        self.x, self.y = x, y
+        f = self.factor
+        k = 0
+        while True:
+            source = self._source(k)
+            if k == len(self.levels):
+                if len(source['x0']) < f:
+                    break
+                self.levels.append(ColumnBuffer(LEVEL_COLUMNS, 256))
+            level = self.levels[k]
+            start = len(level) * f
+            if len(source['x0']) - start >= f:
+                level.append(_aggregate(*[source[name][start:] for name in LEVEL_COLUMNS],
+                                        factor=f))
+            k += 1
+
+    def level_for(self, count, pixels):
+        """Coarsest level with at least one bucket per pixel for count samples."""
+        k = 0
+        while k < len(self.levels) and count / self.factor ** (k + 1) >= pixels:
+            k += 1
+        return k
+
+    def view(self, x_min=-np.inf, x_max=np.inf, pixels=1000):
+        """(x, y) to draw the range [x_min, x_max] on about pixels pixels."""
+        n = len(self.x)
+        if n == 0:
+            return self.x, self.y
+        first = max(np.searchsorted(self.x, x_min, side='left') - 1, 0)
+        stop = min(np.searchsorted(self.x, x_max, side='right') + 1, n)
+        k = self.level_for(stop - first, pixels)
+        if k == 0:
+            return self.x[first:stop], self.y[first:stop]
+        size = self.factor ** k
+        level = self.levels[k - 1]
+        b0 = first // size
+        b1 = min(-(-stop // size), len(level))
+        parts = [_interleave({name: level[name][b0:b1] for name in LEVEL_COLUMNS})]
+        if stop > len(level) * size:
+            # fin de série pas encore agrégée à ce niveau : niveaux plus fins
+            start = len(level) * self.factor
+            for j in range(k - 1, 0, -1):
+                finer = self.levels[j - 1]
+                parts.append(_interleave({name: finer[name][start:]
+                                          for name in LEVEL_COLUMNS}))
+                start = len(finer) * self.factor
+            parts.append((self.x[start:], self.y[start:]))
+        return (np.concatenate([p[0] for p in parts]),
+                np.concatenate([p[1] for p in parts]))
+
+
+class LodCurve:
+    """Curve of a time series redrawn from a MinMaxPyramid when data are
+    appended and when the visible range or the plot width changes.
+
+    Arguments:
+    plot -- pyqtgraph PlotItem
+    x, y -- initial data
+    kwargs -- PlotDataItem options (pen, ...)
+    """
+
+    def __init__(self, plot, x=(), y=(), factor=4, **kwargs):
+        self.plot = plot
+        self.item = plot.plot(**kwargs)
+        self.pyramid = MinMaxPyramid(factor)
+        self._drawing = False
+        view = plot.getViewBox()
+        view.sigXRangeChanged.connect(self.redraw)
+        view.sigResized.connect(self.redraw)
+        self.setData(x, y)
+
+    def setData(self, x, y, append=True):
+        """append=False when x, y do not extend the previous series (e.g.
+        RollingBuffer snapshots): the pyramid is built again."""
+        if not append:
+            self.pyramid.reset()
+        self.pyramid.update(x, y)
+        self.redraw()
+
+    def clear(self):
+        """Forget the series, e.g. before the data of another sounding."""
+        self.pyramid.reset()
+        self.redraw()
+
+    def redraw(self, *args):
+        if self._drawing:
+            return
+        view = self.plot.getViewBox()
+        if view.autoRangeEnabled()[0]:
+            # la plage suit les données : toute la série
+            x_min, x_max = -np.inf, np.inf
+        else:
+            x_min, x_max = view.viewRange()[0]
+        pixels = max(int(view.width()), 100)
+        x, y = self.pyramid.view(x_min, x_max, pixels)
+        self._drawing = True
+        try:
+            self.item.setData(x, y)
+        finally:
+            self._drawing = False
+
+
+class TrackCurve:
+    """Curve of a trajectory (x not sorted, e.g. longitude and latitude),
+    drawn with at most max_points evenly spaced samples and the last one."""
+
+    def __init__(self, plot, x=(), y=(), max_points=5000, **kwargs):
+        self.item = plot.plot(**kwargs)
+        self.max_points = max_points
+        self.setData(x, y)
+
+    def clear(self):
+        self.item.setData([], [])
+
+    def setData(self, x, y):
+        n = len(x)
+        step = max(-(-n // self.max_points), 1)
+        if step == 1:
+            self.item.setData(x, y)
+            return
+        index = np.append(np.arange(0, n - 1, step), n - 1)
+        self.item.setData(np.asarray(x)[index], np.asarray(y)[index])
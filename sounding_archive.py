@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Random access to archived XData_* and RawData_* files.
+
+A SoundingFile memory-maps a text file and keeps a sparse index: the byte
+offset of every block of LINES_PER_BLOCK lines with the time range (and,
+for RawData files, the altitude range) of the block. The index is built
+once with the same line parsers as the live viewer and cached next to the
+file (``<file>.idx.npz``). A slice then parses only the blocks it
+overlaps.
+
+Example::
+
+    ptu = SoundingFile('RawData_20211123100000_S1234567.txt')
+    layer = ptu.between_altitudes(2000, 3500)
+    xdata = SoundingFile('XData_20211123100000_S1234567.txt')
+    cloud = xdata.between_times('2021-11-23 10:20', '2021-11-23 10:40')
+
+@author: roya
+"""
+import mmap
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from sounding_reader import parse_xdata_lines, parse_ptu_lines
+
+
+LINES_PER_BLOCK = 512
+INDEX_VERSION = 1
+# octets du début du fichier utilisés pour reconnaître le fichier indexé
+SIGNATURE_SIZE = 4096
+
+
+def to_epoch(t):
+    """Epoch seconds of a number, a string or a datetime."""
+    if isinstance(t, (int, float, np.integer, np.floating)):
+        return float(t)
+    return pd.Timestamp(t).value / 10 ** 9
+
+
+def to_frame(block):
+    """DataFrame of a dict of column arrays, indexed by timestamp."""
+    data = pd.DataFrame(block)
+    data.index = pd.to_datetime(data['timestamp'], unit='s')
+    return data
+
+
+class SoundingFile:
+    """Indexed, memory-mapped XData_* or RawData_* file.
+
+    Arguments:
+    path -- XData_* or RawData_* text file
+    kind -- 'xdata' or 'ptu', guessed from the file name when None
+    cache -- False to neither read nor write the index cache
+    """
+
+    def __init__(self, path, kind=None, cache=True):
+        self.path = path
+        if kind is None:
+            kind = 'xdata' if os.path.basename(path).startswith('XData') else 'ptu'
+        if kind not in ('xdata', 'ptu'):
+            raise ValueError("kind must be 'xdata' or 'ptu'")
+        self.kind = kind
+        self.parse_lines = parse_xdata_lines if kind == 'xdata' else parse_ptu_lines
+        self.cache = cache
+        self.index_path = path + '.idx.npz'
+        self._file = open(path, 'rb')
+        self.size = os.path.getsize(path)
+        self._map = (mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                     if self.size else b'')
+        self._load_index()
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # index ---------------------------------------------------------------
+
+    def _signature(self):
+        return zlib.crc32(self._map[:SIGNATURE_SIZE])
+
+    def _load_index(self):
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self.t_min = self.t_max = self.alt_min = self.alt_max = np.zeros(0)
+        self.indexed = 0
+        if self.cache and os.path.exists(self.index_path):
+            try:
+                with np.load(self.index_path) as idx:
+                    if (int(idx['version']) == INDEX_VERSION
+                            and int(idx['indexed']) <= self.size
+                            and int(idx['signature']) == self._signature()):
+                        self.offsets = idx['offsets']
+                        self.t_min, self.t_max = idx['t_min'], idx['t_max']
+                        self.alt_min, self.alt_max = idx['alt_min'], idx['alt_max']
+                        self.indexed = int(idx['indexed'])
+            except (OSError, KeyError, ValueError):
+                pass
+        if self.indexed < self.size:
+            self._extend_index()
+
+    def _extend_index(self):
+        """Index the lines after the last indexed block (append-only files)."""
+        # le dernier bloc, peut-être incomplet, est réindexé
+        keep = max(len(self.offsets) - 1, 0)
+        start = int(self.offsets[-1]) if len(self.offsets) else 0
+        view = np.frombuffer(self._map, dtype=np.uint8, count=self.size - start,
+                             offset=start)
+        ends = np.flatnonzero(view == 10) + start + 1
+        if len(ends) == 0:
+            return
+        line_starts = np.concatenate(([start], ends[:-1]))
+        first = np.arange(0, len(line_starts), LINES_PER_BLOCK)
+        offsets = line_starts[first]
+        bounds = np.append(offsets, ends[-1])
+        t_min, t_max, alt_min, alt_max = [], [], [], []
+        for b in range(len(offsets)):
+            block = self.parse_lines(self._map[bounds[b]:bounds[b + 1]].splitlines())
+            t = block['timestamp']
+            alt = block.get('altitude', np.zeros(0))
+            t_min.append(np.nanmin(t) if np.isfinite(t).any() else np.nan)
+            t_max.append(np.nanmax(t) if np.isfinite(t).any() else np.nan)
+            alt_min.append(np.nanmin(alt) if np.isfinite(alt).any() else np.nan)
+            alt_max.append(np.nanmax(alt) if np.isfinite(alt).any() else np.nan)
+        self.offsets = np.concatenate((self.offsets[:keep], offsets))
+        self.t_min = np.concatenate((self.t_min[:keep], t_min))
+        self.t_max = np.concatenate((self.t_max[:keep], t_max))
+        self.alt_min = np.concatenate((self.alt_min[:keep], alt_min))
+        self.alt_max = np.concatenate((self.alt_max[:keep], alt_max))
+        self.indexed = int(ends[-1])
+        if self.cache:
+            self._save_index()
+
+    def _save_index(self):
+        try:
+            with open(self.index_path, 'wb') as f:
+                np.savez(f, version=INDEX_VERSION, indexed=self.indexed,
+                         signature=self._signature(), offsets=self.offsets,
+                         t_min=self.t_min, t_max=self.t_max,
+                         alt_min=self.alt_min, alt_max=self.alt_max)
+        except OSError:
+            # archive en lecture seule : l'index reste en mémoire
+            pass
+
+    # slices --------------------------------------------------------------
+
+    def _read_blocks(self, selected):
+        """Parse the selected blocks, contiguous blocks in one go."""
+        bounds = np.append(self.offsets, self.indexed)
+        blocks = np.flatnonzero(selected)
+        if len(blocks) == 0:
+            return self.parse_lines([])
+        runs = np.split(blocks, np.flatnonzero(np.diff(blocks) > 1) + 1)
+        parts = [self.parse_lines(
+                    self._map[bounds[run[0]]:bounds[run[-1] + 1]].splitlines())
+                 for run in runs]
+        return {name: np.concatenate([p[name] for p in parts])
+                for name in parts[0]}
+
+    def between_times(self, start, end):
+        """DataFrame of the rows with start <= timestamp <= end."""
+        start, end = to_epoch(start), to_epoch(end)
+        block = self._read_blocks((self.t_max >= start) & (self.t_min <= end))
+        keep = (block['timestamp'] >= start) & (block['timestamp'] <= end)
+        return to_frame({name: values[keep] for name, values in block.items()})
+
+    def between_altitudes(self, low, high):
+        """DataFrame of the rows with low <= altitude <= high (RawData files)."""
+        if self.kind != 'ptu':
+            raise ValueError("altitude slices need a RawData file, "
+                             "use Sounding.xdata_between_altitudes")
+        block = self._read_blocks((self.alt_max >= low) & (self.alt_min <= high))
+        keep = (block['altitude'] >= low) & (block['altitude'] <= high)
+        return to_frame({name: values[keep] for name, values in block.items()})
+
+
+class Sounding:
+    """XData_* and RawData_* files of one sounding.
+
+    The altitude of the XData frames is interpolated in time from the
+    RawData rows.
+    """
+
+    def __init__(self, xdata_path, ptu_path, cache=True):
+        self.xdata = SoundingFile(xdata_path, 'xdata', cache)
+        self.ptu = SoundingFile(ptu_path, 'ptu', cache)
+
+    def close(self):
+        self.xdata.close()
+        self.ptu.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def xdata_between_altitudes(self, low, high):
+        """DataFrame of the XData frames measured between two altitudes."""
+        ptu = self.ptu.between_altitudes(low, high)
+        if len(ptu) == 0:
+            return self.xdata.between_times(np.inf, np.inf)
+        t0, t1 = ptu['timestamp'].min(), ptu['timestamp'].max()
+        # lignes PTU autour de la fenêtre pour interpoler l'altitude
+        around = self.ptu.between_times(t0 - 60, t1 + 60)
+        around = around[np.isfinite(around['altitude'])]
+        xdata = self.xdata.between_times(t0, t1)
+        altitude = np.interp(xdata['timestamp'], around['timestamp'],
+                             around['altitude'])
+        xdata = xdata.assign(altitude=altitude)
+        return xdata[(altitude >= low) & (altitude <= high)]
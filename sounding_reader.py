@@ -0,0 +1,860 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental readers for the XData_* and RawData_* files written by the MW41
+scripts WriteXData.py and NewRawData.py.
+
+A TailReader remembers how far it has read a file and, on each poll, parses
+only the complete lines appended since the previous poll. The parsed values
+are appended to a ColumnBuffer, a set of preallocated NumPy arrays that grow
+by doubling, so the cost of a refresh depends on the number of new lines and
+not on the size of the file. A file which is already long when it is first
+read can be cut at line boundaries (TailReader.chunks) and its chunks
+parsed in parallel (parse_range), then appended in file order.
+
+The date and time which start the rows ('yyyy-MM-dd HH:mm:ss[.fff]') are
+converted by epoch_ns / epoch_seconds, shared by all the readers: the
+first bytes of the lines are read as one fixed-width byte array and
+converted in a vectorized pass.
+
+For the field laptops a RollingBuffer can be used instead: the last rows at
+full resolution in a ring, and the older ones in a min/max archive whose
+resolution decreases as the flight goes on, in a memory which does not
+depend on the length of the flight.
+
+A StreamReader is read like a TailReader but receives its rows from the
+frames published by the MW41 scripts (FramePublisher) instead of a file.
+
+@author: roya
+"""
+import io
+import os
+import re
+import threading
+from itertools import compress
+
+import numpy as np
+import pandas as pd
+
+from xdata_decode import decode_twc_slwc
+from BinaryRecord import ReadHeader
+
+
+MISSING_VALUES = (b'-32768.00', b'-32768', b'-32768.0', b'////////')
+
+XDATA_COLUMNS = ('timestamp', 'rx_time', 'offset', 'instrument_type',
+                 'instrument_number', 'gps_offset',
+                 'twc_frequency', 'slwc_frequency')
+
+PTU_COLUMNS = ('timestamp', 'pressure', 'temperature', 'humidity',
+               'windDirection', 'windSpeed', 'v', 'u', 'altitude',
+               'longitude', 'latitude', 'ascentRate')
+# colonnes d'une ligne écrite sans solution GPS : date time P T RH VV
+PTU_SHORT_COLUMNS = ('pressure', 'temperature', 'humidity', 'ascentRate')
+
+
+# nom des fichiers écrits par WriteXData.py et NewRawData.py
+SOUNDING_FILE = re.compile(r'^(XData|RawData)_(\d{14})_(.+)\.txt$')
+
+
+def sounding_files(directory):
+    """Sounding files of a directory.
+
+    Returns {(start, radiosonde_id): {'xdata': path, 'ptu': path}}; a
+    path is missing while its file does not exist yet.
+    """
+    soundings = {}
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return soundings
+    for name in names:
+        match = SOUNDING_FILE.match(name)
+        if match:
+            kind = 'xdata' if match.group(1) == 'XData' else 'ptu'
+            key = (match.group(2), match.group(3))
+            soundings.setdefault(key, {})[kind] = os.path.join(directory, name)
+    return soundings
+
+
+class ColumnBuffer:
+    """Named float64 columns stored in preallocated, growable NumPy arrays.
+
+    Columns are read back as views on the filled part of the storage, e.g.
+    ``buf['temperature']``, and stay valid until the next append.
+    """
+
+    def __init__(self, columns, capacity=4096):
+        self.columns = tuple(columns)
+        self._capacity = max(int(capacity), 1)
+        self._size = 0
+        self._data = {name: np.empty(self._capacity) for name in self.columns}
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, name):
+        return self._data[name][:self._size]
+
+    def _reserve(self, size):
+        if size <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < size:
+            capacity *= 2
+        for name in self.columns:
+            grown = np.empty(capacity)
+            grown[:self._size] = self._data[name][:self._size]
+            self._data[name] = grown
+        self._capacity = capacity
+
+    def append(self, block):
+        """Append a dict of equal-length arrays, one per column."""
+        n = len(block[self.columns[0]])
+        if n == 0:
+            return
+        self._reserve(self._size + n)
+        for name in self.columns:
+            self._data[name][self._size:self._size + n] = block[name]
+        self._size += n
+
+    def tail(self, n):
+        """Dict of the last n rows of every column."""
+        start = max(self._size - n, 0)
+        return {name: self._data[name][start:self._size] for name in self.columns}
+
+    def snapshot(self):
+        """Dict of views on the rows filled so far.
+
+        Rows are never rewritten once filled (appends go after them, growth
+        and clear() use new storage), so a snapshot can be handed to another
+        thread without copying.
+        """
+        return {name: self._data[name][:self._size] for name in self.columns}
+
+    def clear(self):
+        self._size = 0
+        self._data = {name: np.empty(self._capacity) for name in self.columns}
+
+
+def _min_max_rows(lo, hi):
+    """Interleave the minimum and maximum rows of the buckets."""
+    out = np.empty(2 * len(lo))
+    out[0::2] = lo
+    out[1::2] = hi
+    return out
+
+
+class RollingBuffer:
+    """Named float64 columns of an unbounded series in a fixed memory.
+
+    The last capacity rows (the window) are kept at full resolution. A row
+    leaving the window goes to a bucket of step rows, archived as two rows:
+    the minimum, then the maximum of each column (NaN ignored). The rows
+    being sorted by time, the timestamps of the two rows are the first and
+    the last of the bucket, and peaks stay visible. When the archive holds
+    archive_capacity rows, pairs of buckets are merged and step doubles:
+    the archive covers the whole history, coarser as it gets longer.
+
+    The window is read as ColumnBuffer (``buf['temperature']``, tail());
+    snapshot() returns the archive followed by the window. Two buffers
+    with the same sizes receiving the same number of rows bucket them in
+    the same way.
+    """
+
+    def __init__(self, columns, capacity=18000, archive_capacity=4096, step=8):
+        self.columns = tuple(columns)
+        self.capacity = max(int(capacity), 1)
+        # paires de paquets de deux lignes
+        self.archive_capacity = max(int(archive_capacity) // 4 * 4, 4)
+        self.first_step = max(int(step), 1)
+        self.clear()
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, name):
+        return self._data[name][self._start:self._stop]
+
+    def clear(self):
+        self.step = self.first_step
+        self.appended = 0
+        self._start = self._stop = 0
+        self._data = {name: np.empty(2 * self.capacity) for name in self.columns}
+        self.archive = ColumnBuffer(self.columns, self.archive_capacity)
+        # paquet en cours : lignes sorties de la fenêtre, minimum et maximum
+        self._pending = 0
+        self._lo = self._hi = None
+
+    def append(self, block):
+        """Append a dict of equal-length arrays, one per column."""
+        n = len(block[self.columns[0]])
+        if n == 0:
+            return
+        self.appended += n
+        block = {name: np.asarray(block[name], dtype=float) for name in self.columns}
+        leaving = len(self) + n - self.capacity
+        if leaving > 0:
+            from_window = min(leaving, len(self))
+            self._archive({name: self._data[name][self._start:self._start + from_window]
+                           for name in self.columns})
+            self._start += from_window
+            if leaving > from_window:
+                self._archive({name: block[name][:leaving - from_window]
+                               for name in self.columns})
+        keep = min(n, self.capacity)
+        size = len(self)
+        if self._stop + keep > 2 * self.capacity:
+            # nouveau stockage : les vues déjà données ne sont jamais réécrites
+            data = {name: np.empty(2 * self.capacity) for name in self.columns}
+            for name in self.columns:
+                data[name][:size] = self._data[name][self._start:self._stop]
+            self._data = data
+            self._start, self._stop = 0, size
+        for name in self.columns:
+            self._data[name][self._stop:self._stop + keep] = block[name][n - keep:]
+        self._stop += keep
+
+    def _archive(self, rows):
+        """Add rows leaving the window to the buckets of the archive."""
+        n = len(rows[self.columns[0]])
+        # démarrage en cours de vol : l'archive est d'abord réduite
+        while len(self.archive) + 2 * ((self._pending + n) // self.step) > self.archive_capacity:
+            self._coarsen()
+        k = min(self.step - self._pending, n)
+        if k:
+            self._fill({name: values[:k] for name, values in rows.items()})
+        if self._pending == self.step:
+            self.archive.append({name: _min_max_rows([self._lo[name]], [self._hi[name]])
+                                 for name in self.columns})
+            self._pending = 0
+        m = (n - k) // self.step
+        full = k + m * self.step
+        if m:
+            self.archive.append({name: _min_max_rows(
+                np.fmin.reduce(rows[name][k:full].reshape(m, self.step), axis=1),
+                np.fmax.reduce(rows[name][k:full].reshape(m, self.step), axis=1))
+                for name in self.columns})
+        if full < n:
+            self._fill({name: values[full:] for name, values in rows.items()})
+
+    def _fill(self, rows):
+        """Add rows to the bucket being filled."""
+        lo = {name: np.fmin.reduce(rows[name]) for name in self.columns}
+        hi = {name: np.fmax.reduce(rows[name]) for name in self.columns}
+        if self._pending:
+            lo = {name: np.fmin(lo[name], self._lo[name]) for name in self.columns}
+            hi = {name: np.fmax(hi[name], self._hi[name]) for name in self.columns}
+        self._lo, self._hi = lo, hi
+        self._pending += len(rows[self.columns[0]])
+
+    def _coarsen(self):
+        """Merge the buckets of the archive two by two and double step."""
+        rows = self.archive.snapshot()
+        pairs = len(self.archive) // 4
+        merged = {}
+        for name in self.columns:
+            values = rows[name]
+            lo = np.fmin(values[0:4 * pairs:4], values[2:4 * pairs:4])
+            hi = np.fmax(values[1:4 * pairs:4], values[3:4 * pairs:4])
+            # un paquet sans paire reste tel quel
+            merged[name] = np.concatenate((_min_max_rows(lo, hi), values[4 * pairs:]))
+        self.archive = ColumnBuffer(self.columns, self.archive_capacity)
+        self.archive.append(merged)
+        self.step *= 2
+
+    def tail(self, n):
+        """Dict of the last n rows of the window."""
+        start = max(self._stop - n, self._start)
+        return {name: self._data[name][start:self._stop] for name in self.columns}
+
+    def snapshot(self):
+        """Dict of new arrays: the archive, the bucket being filled, then
+        the window, in time order."""
+        archive = self.archive.snapshot()
+        pending = {name: np.zeros(0) for name in self.columns}
+        if self._pending:
+            pending = {name: [self._lo[name], self._hi[name]] for name in self.columns}
+        return {name: np.concatenate((archive[name], pending[name], self[name]))
+                for name in self.columns}
+
+
+def _to_float(tokens):
+    """Convert a sequence of byte tokens to float64, missing values as NaN."""
+    try:
+        # conversion numpy de toute la colonne, -32768 = donnée manquante
+        out = np.array(tokens, dtype=bytes).astype(float)
+    except ValueError:
+        return _to_float_each(tokens)
+    out[out == -32768] = np.nan
+    return out
+
+
+def _to_float_each(tokens):
+    """_to_float for columns holding tokens which are not numbers."""
+    out = np.empty(len(tokens))
+    for i, token in enumerate(tokens):
+        if token in MISSING_VALUES:
+            out[i] = np.nan
+            continue
+        try:
+            out[i] = float(token)
+        except ValueError:
+            out[i] = np.nan
+    return out
+
+
+def _hex_to_float(tokens):
+    """Convert hexadecimal byte tokens (InstrumentType, InstrumentNumber) to
+    float64, NaN if invalid, as XDataInstruments.ParseNumber."""
+    out = np.empty(len(tokens))
+    for i, token in enumerate(tokens):
+        try:
+            out[i] = int(token, 16)
+        except ValueError:
+            out[i] = np.nan
+    return out
+
+
+# 'yyyy-MM-dd HH:mm:ss' : position des chiffres, des séparateurs
+_STAMP_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+_STAMP_SEPARATORS = {4: b'-', 7: b'-', 10: b' ', 13: b':', 16: b':'}
+# année, mois, jour, secondes du jour (float64 : produit BLAS, exact ici)
+_STAMP_WEIGHTS = np.zeros((14, 4))
+_STAMP_WEIGHTS[:4, 0] = [1000, 100, 10, 1]
+_STAMP_WEIGHTS[4:6, 1] = [10, 1]
+_STAMP_WEIGHTS[6:8, 2] = [10, 1]
+_STAMP_WEIGHTS[8:, 3] = [36000, 3600, 600, 60, 10, 1]
+# '.' puis 9 chiffres au plus (ns), puis la fin du jeton
+_FRACTION = 20
+_FRACTION_WEIGHTS = 10.0 ** np.arange(8, -1, -1)
+_STAMP_WIDTH = _FRACTION + 10
+_NAT = np.iinfo(np.int64).min
+
+
+def _stamp_matrix(dates, times=None):
+    """(n, _STAMP_WIDTH) uint8 array of the first bytes of the lines, or of
+    'date time' built from the two columns of tokens."""
+    if times is None:
+        return np.asarray(dates, dtype='S%d' % _STAMP_WIDTH).view(np.uint8) \
+            .reshape(-1, _STAMP_WIDTH)
+    m = np.zeros((len(dates), _STAMP_WIDTH), dtype=np.uint8)
+    m[:, :11] = np.asarray(dates, dtype='S11').view(np.uint8).reshape(-1, 11)
+    m[:, 10] |= 32
+    m[:, 11:] = np.asarray(times, dtype='S%d' % (_STAMP_WIDTH - 11)).view(np.uint8) \
+        .reshape(-1, _STAMP_WIDTH - 11)
+    return m
+
+
+def _text(token):
+    return token.decode('ascii', 'replace') if isinstance(token, bytes) else str(token)
+
+
+def _epoch_ns_any(dates, times=None):
+    """epoch_ns of dates and times in any ISO 8601 layout (pandas)."""
+    if times is None:
+        text = [' '.join(_text(line).split()[:2]) for line in dates]
+    else:
+        text = [_text(d) + ' ' + _text(t) for d, t in zip(dates, times)]
+    stamps = pd.to_datetime(text, format='ISO8601', errors='coerce')
+    return stamps.values.astype('datetime64[ns]').view(np.int64)
+
+
+def epoch_ns(dates, times=None):
+    """Epoch nanoseconds (int64) of the rows of the XData_* and RawData_*
+    files, the int64 of NaT for a row which is not a date.
+
+    Arguments:
+    dates -- lines starting with 'yyyy-MM-dd HH:mm:ss[.fff]' (bytes or
+        str), or the 'yyyy-MM-dd' tokens of the rows
+    times -- None, or the 'HH:mm:ss[.fff]' tokens of the rows
+
+    The first bytes of the rows are read as one fixed-width byte array and
+    their digits converted in a vectorized pass, without building a string
+    per row; the rows in another layout are parsed by pandas.
+    """
+    n = len(dates)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    # une ligne par position d'octet : opérations contiguës sur les n lignes
+    m = np.ascontiguousarray(_stamp_matrix(dates, times).T)
+    # octets - '0' en uint8 : tout ce qui n'est pas un chiffre donne >= 10
+    digits = m[_STAMP_DIGITS] - 48
+    ok = (digits < 10).all(axis=0)
+    for i, separator in _STAMP_SEPARATORS.items():
+        ok &= m[i] == ord(separator)
+    fraction = m[_FRACTION:_FRACTION + 9] - 48
+    point = m[_FRACTION - 1] == ord('.')
+    # chiffres de la fraction jusqu'au premier autre octet
+    lead = np.logical_and.accumulate(fraction < 10, axis=0) & point
+    width = lead.sum(axis=0)
+    # fin du jeton de l'heure : espace ou fin de ligne
+    end = m[np.where(point, _FRACTION + width, _FRACTION - 1), np.arange(n)]
+    ok &= ((end == 32) | (end == 0)) & (~point | (width > 0))
+    year, month, day, seconds = (_STAMP_WEIGHTS.T @ digits).astype(np.int64)
+    ok &= ((month >= 1) & (month <= 12) & (digits[8] * 10 + digits[9] < 24)
+           & (digits[10] < 6) & (digits[12] < 6))
+    months = np.where(ok, (year - 1970) * 12 + month - 1, 0).astype('datetime64[M]')
+    first = months.astype('datetime64[D]')
+    ok &= (day >= 1) & (day <= ((months + 1).astype('datetime64[D]') - first).astype(np.int64))
+    ns = (((first.astype(np.int64) + day - 1) * 86400 + seconds) * 10 ** 9
+          + (_FRACTION_WEIGHTS @ np.where(lead, fraction, 0)).astype(np.int64))
+    bad = np.flatnonzero(~ok)
+    if len(bad):
+        ns[bad] = _epoch_ns_any([dates[i] for i in bad],
+                                None if times is None else [times[i] for i in bad])
+    return ns
+
+
+def epoch_seconds(dates, times=None):
+    """Epoch seconds (float64) of the rows, NaN for a row which is not a
+    date; see epoch_ns."""
+    ns = epoch_ns(dates, times)
+    epoch = ns / 10 ** 9
+    epoch[ns == _NAT] = np.nan
+    return epoch
+
+
+def _drop_undated(block):
+    ok = np.isfinite(block['timestamp'])
+    if ok.all():
+        return block
+    return {name: values[ok] for name, values in block.items()}
+
+
+def parse_xdata_lines(lines):
+    """Parse complete lines of an XData_* file.
+
+    A data line is written by WriteXData.FormatLine as
+    ``date time RadioRxTime offset InstrumentType InstrumentNumber
+    GpsOffset XData``. Header, unit and comment lines are skipped.
+    """
+    rows = [line.split() for line in lines]
+    keep = [len(row) == 8 and row[0][:1].isdigit() for row in rows]
+    rows = list(compress(rows, keep))
+    cols = list(zip(*rows)) if rows else [()] * 8
+    twc, slwc, _ = decode_twc_slwc(cols[7])
+    return _drop_undated({
+        'timestamp': epoch_seconds(list(compress(lines, keep))),
+        'rx_time': _to_float(cols[2]),
+        'offset': _to_float(cols[3]),
+        'instrument_type': _hex_to_float(cols[4]),
+        'instrument_number': _hex_to_float(cols[5]),
+        'gps_offset': _to_float(cols[6]),
+        'twc_frequency': twc,
+        'slwc_frequency': slwc,
+    })
+
+
+def parse_ptu_lines(lines):
+    """Parse complete lines of a RawData_* file, in one pass.
+
+    NewRawData.WriteDataLine leaves out the wind and position columns
+    until the radiosonde has a GPS solution, and for a second whose GPS
+    result did not arrive: these rows (date time P T RH VV) are kept with
+    NaN wind and position. Header, comment and unreadable lines are
+    skipped.
+    """
+    rows = [line.split() for line in lines]
+    keep = [len(row) in (13, 6) and row[0][:1].isdigit() for row in rows]
+    rows = list(compress(rows, keep))
+    n = len(rows)
+    block = {'timestamp': epoch_seconds(list(compress(lines, keep)))}
+    for name in PTU_COLUMNS[1:]:
+        block[name] = np.full(n, np.nan)
+    short = np.fromiter((len(row) == 6 for row in rows), dtype=bool, count=n)
+    for names, sel in ((PTU_COLUMNS[1:], np.flatnonzero(~short)),
+                       (PTU_SHORT_COLUMNS, np.flatnonzero(short))):
+        if len(sel) == 0:
+            continue
+        cols = list(zip(*[rows[i] for i in sel]))
+        for name, values in zip(names, cols[2:]):
+            block[name][sel] = _to_float(values)
+    return _drop_undated(block)
+
+
+def _data_lines(File, width):
+    """Lines of a file with width columns and starting with a digit."""
+    with open(File, 'rb') as f:
+        lines = f.read().splitlines()
+    return [line for line in lines
+            if line[:1].isdigit() and len(line.split()) == width]
+
+
+def read_xdata(File):
+    """Read a whole XData_* file into a DataFrame indexed by DataSrvTime.
+
+    Header lines and the comments written at the end of the sounding are
+    skipped.
+    """
+    lines = _data_lines(File, 8)
+    names = list(range(8))
+    if lines:
+        data = pd.read_csv(io.BytesIO(b'\n'.join(lines)), sep=' ', header=None,
+                           names=names, na_values='-32768.00')
+    else:
+        data = pd.DataFrame({name: pd.Series(dtype=object) for name in names})
+    # freq oscillation en Hz
+    
+    data[8], data[9], _ = decode_twc_slwc(data[7].values)
+    data.columns = ['date', 'time', 'offset', 'InstrumentType',\
+        'InstrumentNumber', 'SrvTime','GpsOffset', 'XDataHex','twc_frequency','slwc_frequency']
+    data.index = pd.DatetimeIndex(epoch_ns(data['date'].values, data['time'].values)
+                                  .view('datetime64[ns]'))
+    data['timestamp'] = data.index.values.astype('datetime64[s]').astype(np.int64)
+    data.fillna(np.nan,inplace=True)
+    return data
+
+
+def read_ptu(File, cache=None):
+    """Read a whole RawData_* file into a DataFrame indexed by date and time.
+
+    The file is parsed in one pass by parse_ptu_lines: the rows written
+    before the GPS solution are kept, with NaN wind and position. With a
+    ColumnCache the columns are read back from it (see read_columns).
+    """
+    reader = ptu_reader(File, cache=cache)
+    reader.poll()
+    block = reader.data.snapshot()
+    data = pd.DataFrame({name: block[name] for name in PTU_COLUMNS[1:]})
+    data['timestamp'] = block['timestamp'].astype(np.int64)
+    stamps = data['timestamp'].values.astype('datetime64[s]')
+    data.index = pd.DatetimeIndex(stamps)
+    # 'yyyy-MM-ddTHH:mm:ss'
+    text = np.datetime_as_string(stamps)
+    data.insert(0, 'SrvDate', text.astype('U10'))
+    data.insert(1, 'SrvTime', np.array([t[11:] for t in text.tolist()]))
+    return data
+
+
+class TailReader:
+    """Follow a growing text file and parse only what was appended.
+
+    Arguments:
+    path -- file to follow
+    parse_lines -- function turning a list of complete byte lines into a
+        dict of column arrays
+    columns -- names of the columns returned by parse_lines
+    buffer -- where the rows go, by default a ColumnBuffer of all the rows
+    cache -- column_cache.ColumnCache of the parsed columns, or None
+
+    The rows parsed by the last poll are also kept in ``block``: a
+    RollingBuffer may already have archived some of them.
+
+    With a cache, the first read of the file starts with the columns of
+    its cached prefix and only parses the lines after it; the columns of
+    the whole file are then stored in the cache.
+    """
+
+    def __init__(self, path, parse_lines, columns, capacity=4096, buffer=None,
+                 cache=None):
+        self.path = path
+        self.parse_lines = parse_lines
+        self.data = buffer if buffer is not None else ColumnBuffer(columns, capacity)
+        self.block = None
+        self.offset = 0
+        self.cache = cache
+        # colonnes du début du fichier lues dans le cache, pas encore ajoutées
+        self._cached = None
+        self._saved = 0
+
+    def reset(self):
+        self.offset = 0
+        self._cached = None
+        self._saved = 0
+        self.data.clear()
+
+    def _resume(self):
+        """At the first read, skip the prefix of the file found in the cache."""
+        if self.offset or self.cache is None:
+            return
+        entry = self.cache.load(self.path)
+        if entry is not None:
+            self._cached, self.offset = entry
+            self._saved = self.offset
+
+    def _append(self, blocks, end):
+        """Append the blocks parsed up to the byte end, after the cached
+        columns; store the whole file in the cache at its first read."""
+        first = self._cached is not None or self.offset == 0
+        if self._cached is not None:
+            blocks = [self._cached] + blocks
+            self._cached = None
+        self.block = blocks[0] if len(blocks) == 1 else \
+            {name: np.concatenate([block[name] for block in blocks]) for name in blocks[0]}
+        self.data.append(self.block)
+        self.offset = end
+        if first:
+            self.save_cache(self.block)
+        return len(self.block['timestamp'])
+
+    def save_cache(self, columns=None):
+        """Store the columns of the lines read so far in the cache.
+
+        columns -- every row from the start of the file, by default those
+            of data, which must then be a ColumnBuffer
+        """
+        if self.cache is None or self.offset == self._saved:
+            return
+        if columns is None:
+            if not isinstance(self.data, ColumnBuffer):
+                return
+            columns = self.data.snapshot()
+        self.cache.save(self.path, columns, self.offset)
+        self._saved = self.offset
+
+    def poll(self):
+        """Read the lines appended since the last poll.
+
+        Returns the number of rows added to ``data``. A trailing line without
+        its end of line is left for the next poll.
+        """
+        self._resume()
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return 0
+        if size < self.offset:
+            # fichier tronqué ou réécrit : on repart du début
+            self.reset()
+            self._resume()
+        blocks = []
+        end = self.offset
+        if size > self.offset:
+            try:
+                with open(self.path, 'rb') as f:
+                    f.seek(self.offset)
+                    chunk = f.read(size - self.offset)
+            except OSError:
+                # fichier supprimé ou verrouillé : au prochain poll
+                return 0
+            last = chunk.rfind(b'\n')
+            if last >= 0:
+                end = self.offset + last + 1
+                blocks.append(self.parse_lines(chunk[:last].splitlines()))
+        if not blocks and self._cached is None:
+            return 0
+        return self._append(blocks, end)
+
+    def chunks(self, chunk_size=1 << 20):
+        """Byte ranges [(start, end)] of about chunk_size bytes, cut at line
+        boundaries, of the complete lines appended since the last poll."""
+        self._resume()
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size < self.offset:
+            self.reset()
+            self._resume()
+        ranges = []
+        try:
+            with open(self.path, 'rb') as f:
+                # fin de la dernière ligne complète
+                f.seek(max(size - 65536, self.offset))
+                tail = f.read(size - f.tell())
+                last = tail.rfind(b'\n')
+                if last < 0:
+                    return []
+                stop = size - len(tail) + last + 1
+                start = self.offset
+                while stop - start > chunk_size:
+                    f.seek(start + chunk_size)
+                    f.readline()
+                    if f.tell() >= stop:
+                        break
+                    ranges.append((start, f.tell()))
+                    start = f.tell()
+        except OSError:
+            return []
+        ranges.append((start, stop))
+        return ranges
+
+    def extend(self, blocks, end):
+        """Append the blocks parsed from the ranges of chunks(), in file
+        order, the last range ending at end. Returns the number of rows."""
+        return self._append(list(blocks), end)
+
+
+def parse_range(path, parse_lines, start, end):
+    """Parse the lines of path between the byte offsets start and end (see
+    TailReader.chunks) with parse_lines."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return parse_lines(f.read(end - start).splitlines())
+
+
+def xdata_reader(path, capacity=4096, buffer=None, cache=None):
+    """TailReader for an XData_* file."""
+    return TailReader(path, parse_xdata_lines, XDATA_COLUMNS, capacity, buffer, cache)
+
+
+def ptu_reader(path, capacity=4096, buffer=None, cache=None):
+    """TailReader for a RawData_* file."""
+    return TailReader(path, parse_ptu_lines, PTU_COLUMNS, capacity, buffer, cache)
+
+
+def read_columns(path, cache=None):
+    """Columns of a whole XData_* or RawData_* file, {column: array}, as
+    parsed by the TailReaders. With a ColumnCache only the lines after the
+    cached prefix are parsed, and the cache is updated."""
+    if os.path.basename(path).startswith('XData'):
+        reader = xdata_reader(path, cache=cache)
+    else:
+        reader = ptu_reader(path, cache=cache)
+    reader.poll()
+    return reader.data.snapshot()
+
+
+# format struct -> type numpy (little-endian)
+_NUMPY_TYPES = {'d': '<f8', 'f': '<f4', 'h': '<i2', 'i': '<i4', 'I': '<u4',
+                'H': '<u2', 'B': 'u1', 'b': 'i1', 'q': '<i8'}
+
+
+def record_dtype(fields):
+    """NumPy dtype of the records described by a binary file header."""
+    dtype = []
+    for name, fmt in fields:
+        if fmt.endswith('s'):
+            dtype.append((name, 'S%s' % (fmt[:-1] or '1')))
+        else:
+            dtype.append((name, _NUMPY_TYPES[fmt]))
+    return np.dtype(dtype)
+
+
+def read_records(path):
+    """Memory-map the complete records of a binary XData_/RawData_ .bin file.
+
+    Returns a read-only structured array; a record still being written at
+    the end of the file is ignored.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(4096)
+        fields, record_size, header_size = ReadHeader(head)
+        if header_size > len(head):
+            f.seek(0)
+            fields, record_size, header_size = ReadHeader(f.read(header_size))
+    dtype = record_dtype(fields)
+    if dtype.itemsize != record_size:
+        raise ValueError("%s: record size %d does not match its fields"
+                         % (path, record_size))
+    count = (os.path.getsize(path) - header_size) // record_size
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=header_size,
+                     shape=(count,))
+
+
+def _int_column(values):
+    """float64 of an integer record field, NaN for -1 (not given)."""
+    out = values.astype(float)
+    out[values == -1] = np.nan
+    return out
+
+
+def xdata_record_columns(records):
+    """XDATA_COLUMNS of XData binary records (BinaryRecord.XDataFields),
+    the frequencies decoded from the raw frame as from the text file."""
+    twc, slwc, _ = decode_twc_slwc(records['xdata'].tolist())
+    return _drop_undated({
+        'timestamp': records['srv_time'].astype(float),
+        'rx_time': records['rx_time'].astype(float),
+        'offset': records['offset'].astype(float),
+        'instrument_type': _int_column(records['instrument_type']),
+        'instrument_number': _int_column(records['instrument_number']),
+        'gps_offset': records['gps_offset'].astype(float),
+        'twc_frequency': twc,
+        'slwc_frequency': slwc,
+    })
+
+
+def ptu_record_columns(records):
+    """PTU_COLUMNS of RawData binary records (BinaryRecord.PtuFields)."""
+    block = {'timestamp': records['time'].astype(float)}
+    for name in PTU_COLUMNS[1:]:
+        block[name] = records[name].astype(float)
+    return _drop_undated(block)
+
+
+class StreamReader:
+    """Records of one kind published by a MW41 script, read as a TailReader.
+
+    The receiving thread gives the layout and the records of the stream
+    (set_layout(), push()); poll() converts the records received since the
+    previous poll in one pass and appends them to ``data``. Records
+    received before the layout, or after a more recent one, are dropped;
+    the lost datagrams are counted from the sequence numbers.
+
+    Arguments:
+    path -- name of the stream
+    to_columns -- function turning a structured array of records into a
+        dict of column arrays
+    columns -- names of the columns returned by to_columns
+    buffer -- as TailReader
+    """
+
+    def __init__(self, path, to_columns, columns, capacity=4096, buffer=None):
+        self.path = path
+        self.to_columns = to_columns
+        self.data = buffer if buffer is not None else ColumnBuffer(columns, capacity)
+        self.block = None
+        # octets reçus
+        self.offset = 0
+        self.dtype = None
+        self.sequence = None
+        self.lost = 0
+        self.dropped = 0
+        self._records = []
+        self._lock = threading.Lock()
+
+    def set_layout(self, header):
+        """Layout of the records: a BinaryRecord header."""
+        fields, record_size, header_size = ReadHeader(header)
+        dtype = record_dtype(fields)
+        if dtype.itemsize != record_size:
+            raise ValueError("%s: record size %d does not match its fields"
+                             % (self.path, record_size))
+        with self._lock:
+            if dtype != self.dtype:
+                self.dropped += len(self._records)
+                self.dtype = dtype
+                self._records = []
+
+    def push(self, sequence, record):
+        """Queue one record; False when it is dropped."""
+        with self._lock:
+            if self.dtype is None or len(record) != self.dtype.itemsize:
+                self.dropped += 1
+                return False
+            if self.sequence is not None:
+                gap = (sequence - self.sequence - 1) & 0xFFFFFFFF
+                if gap < 0x80000000:
+                    self.lost += gap
+                elif (self.sequence - sequence) & 0xFFFFFFFF < 1000:
+                    # arrivé après un plus récent : les lignes restent dans l'ordre
+                    self.dropped += 1
+                    return False
+                # sinon le script a été relancé et la numérotation repart
+            self.sequence = sequence
+            self._records.append(record)
+            self.offset += len(record)
+        return True
+
+    def reset(self):
+        with self._lock:
+            self._records = []
+        self.data.clear()
+
+    def poll(self):
+        """Append the records received since the last poll to ``data``.
+
+        Returns the number of rows added.
+        """
+        with self._lock:
+            records, self._records = self._records, []
+            dtype = self.dtype
+        if not records:
+            return 0
+        self.block = self.to_columns(np.frombuffer(b''.join(records), dtype=dtype))
+        self.data.append(self.block)
+        return len(self.block['timestamp'])
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic soundings for load and scaling tests.
+
+generate_events() simulates a flight (standard atmosphere, wind drift,
+cloud layers, burst and descent) and yields the MW41 events of the
+sounding: one RawPtu and one GPSResult per second and the
+AdditionalSensorData frames of a chain of instruments, each at its own
+rate. Telemetry dropouts, invalid sensor values (written -32768 by the
+scripts), truncated frames and late GPS results can be injected.
+
+write_sounding() runs the events through WriteXData.py and NewRawData.py
+(see mw41_replay), so the XData_* and RawData_* files are written by the
+scripts themselves, in exactly their format. In real-time mode the files
+grow as during a flight and can drive the live viewer.
+
+Usage::
+
+    python synth_sounding.py -o OUTDIR [--duration 14400]
+        [--instrument SLW:4 --instrument OIF411:1] [--dropout 0.002]
+        [--missing 0.01] [--size-mb 50] [--realtime --speed 10]
+        [--events events.jsonl]
+
+@author: roya
+"""
+import argparse
+import datetime as _dt
+import heapq
+import json
+import math
+import sys
+
+import numpy as np
+
+import mw41_replay
+from XDataInstruments import OIF411, SLW_PROBE
+
+
+# Type code of the synthetic SLW probe frames: any type which is not
+# registered in XDataInstruments is decoded as the SLW probe.
+SLW_TYPE = '1E'
+MISSING = -32768.0
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+#################################################################################
+# Atmosphere and flight.
+#################################################################################
+
+# couches de l'atmosphère standard : (altitude de base m, T de base K, gradient K/m)
+_ISA = ((0.0, 288.15, -0.0065), (11000.0, 216.65, 0.0), (20000.0, 216.65, 0.001),
+        (32000.0, 228.65, 0.0028), (47000.0, 270.65, 0.0))
+_G_R = 9.80665 / 287.053
+
+
+def standard_atmosphere(height):
+    """(pressure hPa, temperature K) of the standard atmosphere at a height (m)."""
+    p = 1013.25
+    for k, (base, t_base, lapse) in enumerate(_ISA):
+        top = _ISA[k + 1][0] if k + 1 < len(_ISA) else np.inf
+        h = min(height, top) - base
+        if lapse == 0.0:
+            p_top = p * math.exp(-_G_R * h / t_base)
+        else:
+            p_top = p * ((t_base + lapse * h) / t_base) ** (-_G_R / lapse)
+        if height <= top:
+            return p_top, t_base + lapse * h
+        p = p_top
+    return p, _ISA[-1][1]
+
+
+class Flight:
+    """Height profile of a balloon flight.
+
+    Arguments:
+    launch_height -- height of the launch site (m)
+    prelaunch -- seconds on the ground before the launch
+    ascent_rate -- ascent rate (m/s)
+    burst_height -- height of the balloon burst (m)
+    descent_rate -- descent rate near the ground (m/s), faster aloft
+    """
+
+    def __init__(self, launch_height=150.0, prelaunch=60.0, ascent_rate=5.0,
+                 burst_height=30000.0, descent_rate=6.0):
+        self.launch_height = launch_height
+        self.prelaunch = prelaunch
+        self.ascent_rate = ascent_rate
+        self.burst_height = burst_height
+        self.descent_rate = descent_rate
+        self.burst_time = prelaunch + (burst_height - launch_height) / ascent_rate
+
+    def height(self, t):
+        """(height m, vertical speed m/s) at t seconds from the start."""
+        if t < self.prelaunch:
+            return self.launch_height, 0.0
+        if t < self.burst_time:
+            return self.launch_height + self.ascent_rate * (t - self.prelaunch), \
+                self.ascent_rate
+        # descente sous parachute, plus rapide dans l'air raréfié :
+        # dh/dt = -descent_rate * exp(h / H), intégrée analytiquement
+        scale = 14000.0
+        x = math.exp(-self.burst_height / scale) \
+            + self.descent_rate * (t - self.burst_time) / scale
+        h = -scale * math.log(x)
+        if h <= self.launch_height:
+            return self.launch_height, 0.0
+        return h, -self.descent_rate * math.exp(h / scale)
+
+
+#################################################################################
+# Instruments.
+#################################################################################
+
+def encode_packet(spec, values, instrument_type=None, number=None):
+    """Hexadecimal packet of an InstrumentSpec (inverse of spec.Decode)."""
+    chars = ['0'] * spec.Length
+    header = (instrument_type or spec.InstrumentType).upper()
+    if spec.HasNumber:
+        header += '%02X' % (number or 0)
+    chars[:len(header)] = header
+    for fname, start, end, scale, modulus, half in spec.Fields:
+        raw = int(round(values[fname] / scale)) % modulus
+        chars[start:end] = '%0*X' % (end - start, raw)
+    return ''.join(chars)
+
+
+class SlwProbe:
+    """Supercooled liquid water probe: the SLWC wire slows down while it
+    collects ice in supercooled clouds and sheds it out of the clouds."""
+
+    spec = SLW_PROBE
+    instrument_type = SLW_TYPE
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.load = 0.0
+
+    def values(self, state, dt):
+        if state['cloud'] > 0 and state['temperature'] < 273.15:
+            self.load += 0.5 * state['cloud'] * dt
+        else:
+            self.load *= math.exp(-dt / 60.0)
+        self.load = min(self.load, 8000.0)
+        twc = 41000.0 - 0.05 * self.load + self.rng.normal(0, 15)
+        slwc = 33000.0 - self.load + 20 * (state['temperature'] - 273.15) \
+            + self.rng.normal(0, 15)
+        return {'twc_frequency': twc / 1000.0, 'slwc_frequency': slwc / 1000.0}
+
+
+class Ozonesonde:
+    """OIF411 ozone interface, ozone maximum around 22 km."""
+
+    spec = OIF411
+    instrument_type = OIF411.InstrumentType
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.battery = 18.5
+
+    def values(self, state, dt):
+        self.battery = max(self.battery - 0.00005 * dt, 14.0)
+        h = state['height']
+        current = 0.5 + 4.0 * math.exp(-((h - 22000.0) / 6000.0) ** 2)
+        return {'PumpTemperature': 25.0 - 0.0005 * h + self.rng.normal(0, 0.05),
+                'OzoneCurrent': max(current + self.rng.normal(0, 0.02), 0.0),
+                'BatteryVoltage': self.battery,
+                'PumpCurrent': 95.0 + self.rng.normal(0, 1.0),
+                'ExternalVoltage': 0.0}
+
+
+INSTRUMENTS = {'SLW': SlwProbe, 'OIF411': Ozonesonde}
+
+
+def parse_instruments(specs):
+    """[(name, frames per second)] of 'NAME:RATE' strings."""
+    out = []
+    for text in specs:
+        name, _, rate = text.partition(':')
+        name = name.upper()
+        if name not in INSTRUMENTS:
+            raise ValueError("unknown instrument %s (known: %s)"
+                             % (name, ', '.join(INSTRUMENTS)))
+        out.append((name, float(rate or 1.0)))
+    return out
+
+
+#################################################################################
+# Events.
+#################################################################################
+
+def generate_events(duration=14400, instruments=(('SLW', 1.0),), seed=0,
+                    start='2021-11-23 10:00:00', radiosonde_id='S0000001',
+                    flight=None, clouds=((1500.0, 3500.0), (5000.0, 6500.0)),
+                    dropout=0.0, dropout_length=10.0, missing=0.0,
+                    late_gps=0.0, gps_lock=30, preflight=20.0, comments=None):
+    """Sounding description then events of a simulated flight, in time order.
+
+    Arguments:
+    duration -- seconds of data after the start, None for no end
+    instruments -- daisy chain as [(name, frames per second)], see INSTRUMENTS
+    flight -- Flight, default profile when None
+    clouds -- (base, top) heights (m) of the cloud layers
+    dropout -- probability per second of a telemetry gap, of exponential
+        length with mean dropout_length seconds; no event is sent in a gap
+    missing -- probability of an invalid value: PTU sensor flag, GPS wind,
+        frame measurement offset or truncated frame
+    late_gps -- probability of a GPSResult arriving 1 to 4 s late
+    gps_lock -- seconds before the first GPS solution
+    preflight -- seconds between the radio reset and the start
+    comments -- operator comment, written at the end of the files
+    """
+    rng = np.random.default_rng(seed)
+    flight = flight or Flight()
+    t0 = _dt.datetime.strptime(start, TIME_FORMAT)
+    reset = t0 - _dt.timedelta(seconds=preflight)
+    yield {'type': 'Sounding', 'RadiosondeId': radiosonde_id,
+           'SoundingStartTime': t0.strftime(TIME_FORMAT),
+           'RadioResetTime': reset.strftime(TIME_FORMAT),
+           'LaunchTime': preflight + flight.prelaunch,
+           'Comments': comments or ''}
+    chain = [(INSTRUMENTS[name](rng), rate, number + 1)
+             for number, (name, rate) in enumerate(instruments)]
+    queue = []
+    order = 0
+    lon, lat = 1.3747, 43.5755
+    humidity = 70.0
+    gap_end = -1.0
+    s = 0
+    yield {'type': 'SystemEvent', 'time': 0.0, 'EventName': 'ReadyForRelease'}
+    while duration is None or s < duration:
+        s += 1
+        height, w = flight.height(s)
+        p, t = standard_atmosphere(height)
+        cloud = max([min(height - base, top - height) / 200.0
+                     for base, top in clouds if base <= height <= top] + [0.0])
+        cloud = min(cloud, 1.0)
+        humidity = float(np.clip(humidity + rng.normal(0, 0.5)
+                                 + (100.0 - humidity) * 0.2 * cloud
+                                 - (humidity - 40.0) * 0.01 * (1 - cloud), 1.0, 100.0))
+        u = 5.0 + 15.0 * math.sin(height / 6000.0) + rng.normal(0, 0.3)
+        v = -2.0 + 5.0 * math.cos(height / 4000.0) + rng.normal(0, 0.3)
+        lon += u / (111320.0 * math.cos(math.radians(lat)))
+        lat += v / 110540.0
+        state = {'height': height, 'temperature': t, 'cloud': cloud}
+        if s > gap_end and rng.random() < dropout:
+            gap_end = s + rng.exponential(dropout_length)
+        sent = s > gap_end
+        rx = preflight + s + rng.uniform(0.0, 0.05)
+        events = []
+        if sent:
+            events.append({'type': 'RawPtu', 'time': s + 0.05, 'RadioRxTime': rx,
+                           'Pressure': p + rng.normal(0, 0.02),
+                           'Temperature': t + rng.normal(0, 0.05),
+                           'Humidity1': humidity, 'AscentRate': w + rng.normal(0, 0.2),
+                           'IsPressureOk': bool(rng.random() >= missing),
+                           'IsTemperatureOk': bool(rng.random() >= missing),
+                           'IsHumidityOk': bool(rng.random() >= missing)})
+            gps = {'type': 'GPSResult', 'time': s + 0.1, 'RadioRxTime': rx,
+                   'Status': 'Autonomous' if s > gps_lock else 'NoSolution',
+                   'WindEast': u, 'WindNorth': v,
+                   'GeometricHeightFromSeaLevel': height + rng.normal(0, 2.0),
+                   'PositionWgs84': {'Longitude': lon, 'Latitude': lat}}
+            if rng.random() < missing:
+                gps['WindEast'] = gps['WindNorth'] = MISSING
+            if rng.random() < late_gps:
+                gps['time'] += rng.integers(1, 5)
+            events.append(gps)
+        for instrument, rate, number in chain:
+            # trames de la seconde écoulée, avec une phase propre à l'instrument
+            n = int(math.floor(s * rate)) - int(math.floor((s - 1) * rate))
+            for k in range(n):
+                frac = (k + 0.5) / n
+                values = instrument.values(state, 1.0 / n)
+                if not sent:
+                    continue
+                frame = encode_packet(instrument.spec, values,
+                                      instrument.instrument_type, number)
+                offset = round(rng.uniform(0.1, 0.9), 2)
+                if rng.random() < missing:
+                    frame = frame[:rng.integers(2, len(frame))]
+                if rng.random() < missing:
+                    offset = MISSING
+                srv = t0 + _dt.timedelta(seconds=s - 1 + frac)
+                events.append({'type': 'AdditionalSensorData', 'time': s - 1 + frac + 0.2,
+                               'RadioRxTime': rx - 1 + frac,
+                               'MeasurementOffset': offset,
+                               'InstrumentType': instrument.instrument_type,
+                               'InstrumentNumber': number,
+                               'DataSrvTime': srv.strftime(TIME_FORMAT)
+                               + '.%03d' % (srv.microsecond // 1000),
+                               'GpsTimeOffset': 18,
+                               'XData': frame})
+        for event in events:
+            heapq.heappush(queue, (event['time'], order, event))
+            order += 1
+        while queue and queue[0][0] <= s:
+            yield heapq.heappop(queue)[2]
+    while queue:
+        yield heapq.heappop(queue)[2]
+    yield {'type': 'SystemEvent', 'time': float(s + 5), 'EventName': 'SoundingCompleted'}
+
+
+def write_events(path, records):
+    """Save a sounding description and its events as JSON lines (mw41_replay format)."""
+    count = 0
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+            count += 1
+    return count
+
+
+def write_sounding(outdir, records, script_args=(), max_bytes=None,
+                   realtime=False, speed=1.0):
+    """Write the XData_* and RawData_* files of an event stream with the MW41
+    scripts.
+
+    Arguments:
+    records -- iterable starting with the sounding description
+    max_bytes -- stop the sounding once the output files reach this size
+    realtime -- append to the files at the pace of the events (divided by speed)
+    Returns the mw41_replay.ReplayStats of the run.
+    """
+    records = iter(records)
+    info = next(records)
+    replayer = mw41_replay.Replayer(info, outdir, script_args=script_args,
+                                    realtime=realtime, speed=speed)
+    last_check = 0.0
+    for record in records:
+        replayer.feed(record)
+        if max_bytes is not None and record['time'] - last_check >= 60:
+            last_check = record['time']
+            if replayer.bytes_written() >= max_bytes:
+                replayer.feed({'type': 'SystemEvent', 'time': record['time'],
+                               'EventName': 'SoundingCompleted'})
+                break
+    return replayer.finish()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--outdir', help='directory of the XData_/RawData_ files')
+    parser.add_argument('--events', help='also save the events as JSON lines')
+    parser.add_argument('--duration', type=float, default=14400,
+                        help='seconds of flight (default 4 h)')
+    parser.add_argument('--size-mb', type=float,
+                        help='stop once the files reach this size instead')
+    parser.add_argument('--instrument', action='append',
+                        help='NAME:FRAMES_PER_S of the daisy chain, in order '
+                             '(%s; default SLW:1)' % ', '.join(INSTRUMENTS))
+    parser.add_argument('--dropout', type=float, default=0.0,
+                        help='probability per second of a telemetry gap')
+    parser.add_argument('--dropout-length', type=float, default=10.0,
+                        help='mean length of a gap (s)')
+    parser.add_argument('--missing', type=float, default=0.0,
+                        help='probability of an invalid value or frame')
+    parser.add_argument('--late-gps', type=float, default=0.0,
+                        help='probability of a late GPSResult')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', default='2021-11-23 10:00:00',
+                        help='sounding start time')
+    parser.add_argument('--id', default='S0000001', help='radiosonde serial number')
+    parser.add_argument('--comments', help='operator comment written at the end')
+    parser.add_argument('--realtime', action='store_true',
+                        help='append to the files at the flight pace')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='speed factor of the real-time mode')
+    parser.add_argument('--args', default='',
+                        help='extra options given to the scripts, e.g. --args="-b"')
+    opts = parser.parse_args(argv)
+    if not opts.outdir and not opts.events:
+        parser.error('give --outdir and/or --events')
+    if opts.size_mb and not opts.outdir:
+        parser.error('--size-mb needs --outdir')
+
+    duration = None if opts.size_mb else opts.duration
+    records = generate_events(duration, parse_instruments(opts.instrument or ['SLW:1']),
+                              opts.seed, opts.start, opts.id,
+                              dropout=opts.dropout, dropout_length=opts.dropout_length,
+                              missing=opts.missing, late_gps=opts.late_gps,
+                              comments=opts.comments)
+    if not opts.outdir:
+        count = write_events(opts.events, records)
+        print("%d events written to %s" % (count - 1, opts.events))
+        return
+    saved = open(opts.events, 'w') if opts.events else None
+    if saved:
+        records = _tee(records, saved)
+    try:
+        max_bytes = opts.size_mb * 2 ** 20 if opts.size_mb else None
+        stats = write_sounding(opts.outdir, records, opts.args.split(), max_bytes,
+                               opts.realtime, opts.speed)
+    finally:
+        if saved:
+            saved.close()
+    summary = stats.summary()
+    print("%d bytes written to %s in %.1f s (%d HandleData calls)"
+          % (summary['bytes_written'], opts.outdir, summary['elapsed_s'],
+             summary['events']))
+
+
+def _tee(records, f):
+    """Records of an event stream, saved as JSON lines as they are consumed."""
+    for record in records:
+        f.write(json.dumps(record) + '\n')
+        yield record
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time alignment of the XData frames with the PTU/GPS rows of a sounding.
+
+AsOfJoin is a streaming sorted merge: blocks of XData frames and blocks of
+RawData rows (dicts of column arrays, as returned by the sounding_reader
+parsers) are pushed in time order, and every XData frame comes out with
+the pressure, temperature, humidity, altitude, position and wind
+interpolated at its timestamp. Only the PTU rows still needed by pending
+frames are kept, so memory stays bounded during a whole flight.
+
+The same object serves the live viewer (push what each poll returns) and
+batch processing (align() / align_stream()).
+
+@author: roya
+"""
+import numpy as np
+
+
+PTU_FIELDS = ('pressure', 'temperature', 'humidity', 'altitude',
+              'longitude', 'latitude', 'u', 'v')
+# colonnes ajoutées à chaque trame XData
+JOINED_FIELDS = PTU_FIELDS + ('windSpeed', 'windDirection', 'ptu_dt')
+
+
+def _empty(names):
+    return {name: np.zeros(0) for name in names}
+
+
+def _concat(a, b):
+    return {name: np.concatenate((a[name], np.asarray(b[name], dtype=float)))
+            for name in a}
+
+
+def _take(block, sel):
+    return {name: values[sel] for name, values in block.items()}
+
+
+class AsOfJoin:
+    """Streaming as-of join of XData frames on PTU/GPS rows.
+
+    Arguments:
+    tolerance -- largest time distance (s) between a frame and the PTU rows
+        used for it; beyond it the joined values are NaN
+    max_pending -- frames waiting for PTU data beyond which the oldest
+        ones are emitted with the rows available, so a stalled PTU stream
+        cannot grow memory without limit
+    """
+
+    def __init__(self, tolerance=2.0, max_pending=100000):
+        self.tolerance = float(tolerance)
+        self.max_pending = max_pending
+        self.ptu = _empty(('timestamp',) + PTU_FIELDS)
+        self.pending = None
+        self.ptu_time = -np.inf
+        self.xdata_time = -np.inf
+
+    def push_ptu(self, block):
+        """Add PTU rows, in time order."""
+        t = np.asarray(block['timestamp'], dtype=float)
+        ok = np.isfinite(t)
+        if not ok.any():
+            return
+        self.ptu = _concat(self.ptu, {name: np.asarray(block[name])[ok]
+                                      for name in self.ptu})
+        self.ptu_time = max(self.ptu_time, np.nanmax(t))
+
+    def push_xdata(self, block):
+        """Add XData frames, in time order."""
+        t = np.asarray(block['timestamp'], dtype=float)
+        ok = np.isfinite(t)
+        if not ok.any():
+            return
+        block = {name: np.asarray(values)[ok] for name, values in block.items()}
+        if self.pending is None:
+            self.pending = {name: values[:0] for name, values in block.items()}
+        self.pending = {name: np.concatenate((self.pending[name], block[name]))
+                        for name in self.pending}
+        self.xdata_time = max(self.xdata_time, np.nanmax(t))
+
+    def pop(self):
+        """Enriched frames which no later PTU row can change any more."""
+        if self.pending is None:
+            return None
+        t = self.pending['timestamp']
+        ready = t + self.tolerance <= self.ptu_time
+        excess = len(t) - self.max_pending
+        if excess > 0:
+            ready[:excess] = True
+        return self._emit(ready)
+
+    def flush(self):
+        """Enriched remaining frames, at the end of the streams."""
+        if self.pending is None:
+            return None
+        return self._emit(np.ones(len(self.pending['timestamp']), dtype=bool))
+
+    def _emit(self, ready):
+        frames = _take(self.pending, ready)
+        self.pending = _take(self.pending, ~ready)
+        frames.update(self._interpolate(frames['timestamp']))
+        # on garde les lignes PTU encore utiles aux trames en attente et aux
+        # trames à venir, postérieures à la dernière reçue
+        horizon = self.xdata_time
+        if len(self.pending['timestamp']):
+            horizon = min(horizon, self.pending['timestamp'][0])
+        horizon -= self.tolerance
+        t_ptu = self.ptu['timestamp']
+        keep = max(np.searchsorted(t_ptu, horizon) - 1, 0)
+        self.ptu = {name: values[keep:] for name, values in self.ptu.items()}
+        return frames
+
+    def _interpolate(self, t):
+        """PTU values at times t: linear between the rows around each time
+        when both are within tolerance, else the nearest row within
+        tolerance, else NaN."""
+        t_ptu = self.ptu['timestamp']
+        n = len(t)
+        out = {name: np.full(n, np.nan) for name in JOINED_FIELDS}
+        if n == 0 or len(t_ptu) == 0:
+            return out
+        nxt = np.searchsorted(t_ptu, t, side='left')
+        prev = np.clip(nxt - 1, 0, len(t_ptu) - 1)
+        nxt = np.clip(nxt, 0, len(t_ptu) - 1)
+        d_prev = np.abs(t - t_ptu[prev])
+        d_next = np.abs(t_ptu[nxt] - t)
+        ok_prev = d_prev <= self.tolerance
+        ok_next = d_next <= self.tolerance
+        span = t_ptu[nxt] - t_ptu[prev]
+        w = np.where(span > 0, (t - t_ptu[prev]) / np.where(span > 0, span, 1), 0.0)
+        w = np.clip(w, 0.0, 1.0)
+        w = np.where(ok_prev & ~ok_next, 0.0, w)
+        w = np.where(ok_next & ~ok_prev, 1.0, w)
+        valid = ok_prev | ok_next
+        for name in PTU_FIELDS:
+            values = self.ptu[name]
+            joined = values[prev] * (1 - w) + values[nxt] * w
+            out[name] = np.where(valid, joined, np.nan)
+        out['ptu_dt'] = np.where(valid, np.minimum(np.where(ok_prev, d_prev, np.inf),
+                                                   np.where(ok_next, d_next, np.inf)),
+                                 np.nan)
+        # vent recalculé à partir des composantes interpolées (cf. NewRawData)
+        u, v = out['u'], out['v']
+        out['windSpeed'] = np.sqrt(u * u + v * v)
+        dd = np.degrees(np.arctan2(-u, -v))
+        out['windDirection'] = np.where(dd <= 0, dd + 360, dd)
+        return out
+
+
+def align(xdata, ptu, tolerance=2.0):
+    """Join whole XData and PTU column dicts (batch use)."""
+    join = AsOfJoin(tolerance)
+    join.push_ptu(ptu)
+    join.push_xdata(xdata)
+    return join.flush()
+
+
+def align_stream(xdata_blocks, ptu_blocks, tolerance=2.0):
+    """Merge two iterables of blocks, each in time order, into a stream of
+    enriched XData blocks. The stream which is behind in time is read
+    first, so only a window of both streams is held in memory."""
+    join = AsOfJoin(tolerance)
+    xdata_blocks, ptu_blocks = iter(xdata_blocks), iter(ptu_blocks)
+    xdata_done = ptu_done = False
+    while not xdata_done:
+        if not ptu_done and join.ptu_time <= join.xdata_time + tolerance:
+            block = next(ptu_blocks, None)
+            if block is None:
+                ptu_done = True
+            else:
+                join.push_ptu(block)
+        else:
+            block = next(xdata_blocks, None)
+            if block is None:
+                xdata_done = True
+            else:
+                join.push_xdata(block)
+        out = join.pop()
+        if out is not None and len(out['timestamp']):
+            yield out
+    out = join.flush()
+    if out is not None and len(out['timestamp']):
+        yield out
@@ -5,7 +5,7 @@ Created on Tue May 18 15:22:24 2021
 
 @author: roya
 """
-from pyqtgraph.Qt import QtGui, QtCore
+from pyqtgraph.Qt import QtGui, QtCore, QtWidgets
 import pyqtgraph as pg
 
 ## Switch to using white background and black foreground
@@ -13,227 +13,287 @@ pg.setConfigOption('background', 'w')
 pg.setConfigOption('foreground', 'k')
 
 import numpy as np
-import pandas as pd
-import glob
 import os
+import json
+import time
+
+from sounding_reader import XDATA_COLUMNS, PTU_COLUMNS
+from ingest import IngestPool, FrameSubscriber
+from plot_lod import LodCurve, TrackCurve
+from RunStats import RunStats
+from column_cache import ColumnCache
 
 
 #global variable
 global dirOut
 dirOut = "C:\data\*"
+# dossiers suivis : un par récepteur MW41 (ou rejeu d'un ancien vol)
+dirsOut = [dirOut]
+# statistiques d'ingestion et d'affichage : panneau et/ou fichier JSON lines
+# (None : pas de fichier) ; sans l'un ni l'autre rien n'est mesuré
+showStats = False
+statsOut = None
+# mode fenêtre glissante (portables de terrain) : minutes du vol gardées à
+# pleine résolution, le reste dans une archive min/max ; None : tout le vol
+windowMinutes = None
+# trames publiées par les scripts MW41 (option -p), p. ex. '239.41.41.41:4141',
+# au lieu des fichiers de dirsOut ; None : lecture des fichiers
+subscribeTo = None
+# cache des colonnes déjà lues (fichiers .npz), relu au redémarrage ; taille
+# maximale en Mo ; None : pas de cache
+cacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'RS41_XData')
+cacheMB = 500
 
 ## pour test --> indiquer le dossier contenant les données 
 #(fichier XData et fichier RawData): 
 #dirOut = "/home/roya/ktrm/BALLON_LIBRE/sonde_surfusion/2021_11_23/"
 
 
-### conversion hexadecimale twc:
-def xdata_ftwc(char):
-    return int(char[2:6], base=16)/1000
-
-### conversion hexadecimale slwc:
-def xdata_fslwc(char):
-    return int(char[6:10], base=16)/1000
-
-
-# Recherche du fichier en cours d'écriture (le plus récent dans le répertoire) :
-def latest_file(listFile):
-    return max(listFile, key=os.path.getctime)
-
-def read_xdata(File):
-    print(File)
-    data = pd.read_csv(File,sep=' ',skiprows=3,header=None,na_values='-32768.00')
-    # freq oscillation en Hz
-    
-    data[8] = data[7].apply(xdata_ftwc)
-    data[9] = data[7].apply(xdata_fslwc)
-    data.columns = ['date', 'time', 'offset', 'InstrumentType',\
-        'InstrumentNumber', 'SrvTime','GpsOffset', 'XDataHex','twc_frequency','slwc_frequency']
-    data.index = pd.to_datetime(data['date'] + ' ' + data['time'])
-    data['timestamp'] = data.index.values.astype(np.int64) // 10 ** 9
-    data.fillna(np.nan,inplace=True)
-    return data
-
-def read_ptu(File):
-    print(File)
-    data = pd.read_csv(File,sep=' ',skiprows=2,na_values='-32768.00')        
-    data.columns = ['SrvDate', 'SrvTime','pressure', 'temperature',\
-                    'humidity', 'windDirection', 'windSpeed', 'v', 'u', \
-                    'altitude', 'longitude', 'latitude', 'ascentRate']
-    for col in ['pressure', 'temperature','humidity', 'windDirection', \
-                'windSpeed', 'v', 'u','altitude', 'longitude', 'latitude',\
-                'ascentRate'] :
-        data[col] = pd.to_numeric(data[col], errors = 'coerce')
-    data.index = pd.to_datetime(data['SrvDate'] + ' ' + data['SrvTime'])
-    data['timestamp'] = data.index.values.astype(np.int64) // 10 ** 9
-    data.fillna(np.nan,inplace=True)
-    return data
-
-
-
-def read_ptu(File):
-    print(File)
-    # astuce pour lire le fichier meme si la trame n'est pas complète.
-    # la trame n'est pas complète tant que la sonde n'a pas reçu une trame GPS
-    # pour la première fois.
-    # --- 
-    # i = nb de ligne a passer avant de trouver une trame complète, défaut a 2 
-    # pour sauter l'entete.
-    i = 2
-    result = None
-    while result is None:
-        try :
-            data = pd.read_csv(File,sep=' ',skiprows=i,na_values='-32768.00',header=None)      
-            result = 'ok'
-        except pd.errors.ParserError: 
-            i = i + 1
-    # fin lecture
-    
-    data.columns = ['SrvDate', 'SrvTime','pressure', 'temperature',\
-                    'humidity', 'windDirection', 'windSpeed', 'v', 'u', \
-                    'altitude', 'longitude', 'latitude', 'ascentRate']
-    for col in ['pressure', 'temperature','humidity', 'windDirection', \
-                'windSpeed', 'v', 'u','altitude', 'longitude', 'latitude',\
-                'ascentRate'] :
-        data[col] = pd.to_numeric(data[col], errors = 'coerce')
-    data.index = pd.to_datetime(data['SrvDate'] + ' ' + data['SrvTime'])
-    data['timestamp'] = data.index.values.astype(np.int64) // 10 ** 9
-    data.fillna(np.nan,inplace=True)
-    return data
-
-def updatePlots():
-    global xdatafile, ptufile, ptr, p1,c1, p2, c2, p3, c3, p4, c4, p5, c5, p6, c6, p7, c7, p8, c8
-    df_xdata = read_xdata(xdatafile)
-    df_ptu = read_ptu(ptufile)
-    c1.setData(df_ptu.timestamp,df_ptu.temperature)
-    c2.setData(df_ptu.timestamp,df_ptu.humidity)
-    c3.setData(df_ptu.timestamp,df_ptu.pressure)
-    c4.setData(df_ptu.timestamp,df_ptu.windSpeed)
-    c8.setData(df_ptu.timestamp,df_ptu.windDirection)
-    c5.setData(df_ptu.longitude,df_ptu.latitude)
-    c6.setData(df_xdata.timestamp,df_xdata.twc_frequency)
-    c7.setData(df_xdata.timestamp,df_xdata.slwc_frequency)    
-    if ptr == 0:
-        p1.enableAutoRange('y', False)  
-        p2.enableAutoRange('y', False)
-        p3.enableAutoRange('y', False)
-        p4.enableAutoRange('y', False)
-        p5.enableAutoRange('xy', False)
-        p6.enableAutoRange('y', False)
-        p7.enableAutoRange('y', False) 
-        p8.enableAutoRange('y', False) 
-    ptr += 1
-
-
-
-# initilisation: 
-ListFilePtu = glob.glob(dirOut+"Raw*")
-ListFileXdata = glob.glob(dirOut+"XData*")
-ptufile = latest_file(ListFilePtu)
-xdatafile = latest_file(ListFileXdata)
-print(ptufile)
-print(xdatafile)
-ptr = 0        
-df_xdata = read_xdata(xdatafile)
-df_ptu = read_ptu(ptufile)
+class SoundingView(pg.GraphicsLayoutWidget):
+    """Plots of one sounding session (PTU, wind, XData frequencies, position,
+    frequency profile).
+
+    Les courbes sont tracées depuis une pyramide min/max (plot_lod) : seul
+    le niveau de détail adapté à la plage visible et à la largeur du
+    graphe est envoyé à pyqtgraph.
+    """
+
+    def __init__(self, session, parent=None):
+        super().__init__(parent)
+        self.session = session
+        self.ptr = 0
+        # les courbes sont créées vides et remplies par le pool d'acquisition
+        df_xdata = {name: np.zeros(0) for name in XDATA_COLUMNS}
+        df_ptu = {name: np.zeros(0) for name in PTU_COLUMNS}
+        self.addLabel(session.label, colspan=2, bold=True)
+        # alertes du contrôle qualité des trames XData (XDataQC)
+        self.alert = self.addLabel('', colspan=3, color=(200,0,0), bold=True)
+        self.nextRow()
+        # Pressure
+        p3 = self.addPlot(title="Pressure",axisItems = {'bottom': pg.DateAxisItem()})
+        self.c3 = LodCurve(p3,df_ptu['timestamp'],df_ptu['pressure'],pen=(0,0,0))
+        p3.setLabel('left', 'Pressure', units='hPa')
+        p3.setLabel('bottom', 'Time')
+        p3.showGrid(x=True, y=True)
+        # temperature
+        p1 = self.addPlot(title="Temperature",axisItems = {'bottom': pg.DateAxisItem()})
+        self.c1 = LodCurve(p1,df_ptu['timestamp'],df_ptu['temperature'],pen=(0,0,0))
+        p1.setLabel('left', 'Temperature', units='K')
+        p1.setLabel('bottom', 'Time')
+        p1.showGrid(x=True, y=True)
+        # windspeed
+        p4 = self.addPlot(title="Wind Speed",axisItems = {'bottom': pg.DateAxisItem()})
+        self.c4 = LodCurve(p4,df_ptu['timestamp'],df_ptu['windSpeed'],pen=(0,0,0))
+        p4.setLabel('left', 'Wind Speed', units='m/s')
+        p4.setLabel('bottom', 'Time')
+        p4.showGrid(x=True, y=True)
+        # windDirection
+        p8 = self.addPlot(title="Wind Direction",axisItems = {'bottom': pg.DateAxisItem()})
+        self.c8 = LodCurve(p8,df_ptu['timestamp'],df_ptu['windDirection'],pen=(0,0,0))
+        p8.setLabel('left', 'Wind Speed', units='°')
+        p8.setLabel('bottom', 'Time')
+        p8.showGrid(x=True, y=True)
+        # profil vertical des fréquences, moyenne par couche (montée) : garde
+        # l'ajustement automatique des axes pendant l'ascension
+        p9 = self.addPlot(title="Frequency profile", rowspan=2)
+        p9.addLegend(offset=(-10, 10))
+        self.c9 = p9.plot(pen=(0,0,0), name='TWC')
+        self.c10 = p9.plot(pen=(200,0,0), name='SLWC')
+        p9.setLabel('left', 'Altitude', units='m')
+        p9.setLabel('bottom', 'Frequency', units='Hz')
+        p9.showGrid(x=True, y=True)
+        self.nextRow()
+
+        #humidity 
+        p2 = self.addPlot(title="Humidity",axisItems = {'bottom': pg.DateAxisItem()})
+        self.c2 = LodCurve(p2,df_ptu['timestamp'],df_ptu['humidity'],pen=(0,0,0))
+        p2.setLabel('left', 'Humidity', units='%')
+        p2.setLabel('bottom', 'Time')
+        p2.showGrid(x=True, y=True)
+        ## frequency of the TWC
+        p6 = self.addPlot(title="Frequency TWC",axisItems = {'bottom': pg.DateAxisItem()})
+        self.c6 = LodCurve(p6,df_xdata['timestamp'],df_xdata['twc_frequency'],pen=(0,0,0))
+        p6.setLabel('left', 'Frequency', units='Hz')
+        p6.setLabel('bottom', 'Time')
+        p6.showGrid(x=True, y=True)
+        ## frequency of the SLWC
+        p7 = self.addPlot(title="Frequency SLWC",axisItems = {'bottom': pg.DateAxisItem()})
+        self.c7 = LodCurve(p7,df_xdata['timestamp'],df_xdata['slwc_frequency'],pen=(0,0,0))
+        p7.setLabel('left', 'Frequency', units='Hz')
+        p7.setLabel('bottom', 'Time')
+        p7.showGrid(x=True, y=True)
+        # position of the radiosonde
+        p5 = self.addPlot(title="Position")
+        self.c5 = TrackCurve(p5,df_ptu['longitude'],df_ptu['latitude'],pen=(0,0,0))
+        p5.setLabel('left', 'Latitude', units='°')
+        p5.setLabel('bottom', 'Longitude', units='°')
+        p5.showGrid(x=True, y=True)
+        self.p5 = p5
+        self.plots = (p1, p2, p3, p4, p5, p6, p7, p8)
+
+    def updatePlots(self, snapshot):
+        # données déjà lues et décodées par le pool d'acquisition : le thread
+        # graphique ne fait que les tracer
+        df_xdata = snapshot['xdata']
+        df_ptu = snapshot['ptu']
+        # fenêtre glissante (archive + fenêtre) ou fin d'un aperçu : la série
+        # ne fait pas que s'allonger
+        append = snapshot['append']
+        self.c1.setData(df_ptu['timestamp'],df_ptu['temperature'],append)
+        self.c2.setData(df_ptu['timestamp'],df_ptu['humidity'],append)
+        self.c3.setData(df_ptu['timestamp'],df_ptu['pressure'],append)
+        self.c4.setData(df_ptu['timestamp'],df_ptu['windSpeed'],append)
+        self.c8.setData(df_ptu['timestamp'],df_ptu['windDirection'],append)
+        self.c5.setData(df_ptu['longitude'],df_ptu['latitude'])
+        self.c6.setData(df_xdata['timestamp'],df_xdata['twc_frequency'],append)
+        self.c7.setData(df_xdata['timestamp'],df_xdata['slwc_frequency'],append)
+        profile = snapshot['profile']['ascent']
+        middle = (profile['bottom'] + profile['top']) / 2
+        self.c9.setData(profile['twc_frequency_mean'], middle, connect='finite')
+        self.c10.setData(profile['slwc_frequency_mean'], middle, connect='finite')
+        self.alert.setText(' | '.join(snapshot['alerts']))
+        if snapshot['preview']:
+            # fin du fichier seule : les axes attendent tout l'historique
+            return
+        # les axes s'ajustent aux premières données reçues puis restent fixes
+        if self.ptr == 1:
+            for p in self.plots:
+                p.enableAutoRange('xy' if p is self.p5 else 'y', False)
+        self.ptr += 1
+
+
+class Dashboard(QtWidgets.QSplitter):
+    """Window hosting one SoundingView per sounding followed by an IngestPool.
+
+    All the sessions share the threads of the pool and one render timer:
+    at each tick only the sessions with a new snapshot are redrawn.
+
+    Arguments:
+    directories -- directories where the MW41 scripts write their files
+    interval -- period (ms) of the render timer
+    stats -- True to show the statistics panel
+    stats_path -- JSON lines file where the statistics are appended
+    stats_interval -- period (ms) of the panel update and of the dump
+    subscribe -- None to read the files of the directories, else the
+        'group:port' where the MW41 scripts publish (FrameSubscriber)
+    pool_options -- IngestPool options (workers, max_sessions, ...)
+
+    With stats or stats_path the parses (see ingest) and the renders of
+    each session are counted and timed; every stats_interval one JSON
+    object per session is appended to stats_path: time, session, then the
+    RunStats.Snapshot() of its ingestion and of its rendering.
+    """
+
+    def __init__(self, directories, interval=250, stats=False, stats_path=None,
+                 stats_interval=5000, subscribe=None, **pool_options):
+        super().__init__(QtCore.Qt.Vertical)
+        self.setWindowTitle('Radiosonde Example')
+        self.resize(1000,600)
+        self.views = {}
+        self.render_stats = {}
+        self.measure = bool(stats) or stats_path is not None
+        self.stats_path = stats_path
+        self.panel = None
+        self.stats_timer = None
+        if stats:
+            self.panel = QtWidgets.QPlainTextEdit()
+            self.panel.setReadOnly(True)
+            self.panel.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+            self.addWidget(self.panel)
+        if self.measure:
+            self.stats_timer = QtCore.QTimer()
+            self.stats_timer.timeout.connect(self.dumpStats)
+            self.stats_timer.start(stats_interval)
+        if subscribe is None:
+            self.pool = IngestPool(directories, stats=self.measure, **pool_options)
+        else:
+            self.pool = FrameSubscriber(subscribe, stats=self.measure, **pool_options)
+        # signaux émis par le thread du pool, traités dans le thread graphique
+        self.pool.sessionAdded.connect(self.addSession)
+        self.pool.sessionRemoved.connect(self.removeSession)
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.updateViews)
+        self.timer.start(interval)
+        self.pool.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.pool.stop()
+        if self.stats_timer is not None:
+            self.stats_timer.stop()
+            self.dumpStats()
+
+    def addSession(self, session):
+        # Nouveau sondage dans un des répertoires :
+        for path in session.paths:
+            print(path)
+        view = self.views[session.key] = SoundingView(session)
+        if self.measure:
+            self.render_stats[session.key] = RunStats()
+        self.addWidget(view)
+
+    def removeSession(self, session):
+        view = self.views.pop(session.key, None)
+        self.render_stats.pop(session.key, None)
+        if view is not None:
+            view.setParent(None)
+            view.deleteLater()
+
+    def updateViews(self):
+        for key, view in self.views.items():
+            snapshot = view.session.take()
+            if snapshot is None:
+                continue
+            stats = self.render_stats.get(key)
+            if stats is None:
+                view.updatePlots(snapshot)
+                continue
+            start = time.perf_counter()
+            view.updatePlots(snapshot)
+            stats.Time('render', time.perf_counter() - start)
+            stats.Set('xdata_points', len(snapshot['xdata']['timestamp']))
+            stats.Set('ptu_points', len(snapshot['ptu']['timestamp']))
+
+    def dumpStats(self):
+        """Show the statistics of the sessions in the panel and append them
+        to stats_path."""
+        now = time.time()
+        records = []
+        lines = []
+        for key, view in self.views.items():
+            session = view.session
+            # compteurs du thread de parsing lus sans verrou : au pire en
+            # retard d'un parse
+            record = {'time': now, 'session': '%s_%s' % key,
+                      'ingest': session.stats.Snapshot(),
+                      'render': self.render_stats[key].Snapshot()}
+            records.append(record)
+            lines.append(session.label)
+            for stage in ('ingest', 'render'):
+                source = session.stats if stage == 'ingest' else self.render_stats[key]
+                lines.extend('  %-7s %s' % (stage, line) for line in source.SummaryLines())
+        if self.panel is not None:
+            self.panel.setPlainText('\n'.join(lines))
+        if self.stats_path is not None and records:
+            with open(self.stats_path, 'a') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+
+
 # -----------------------------------------------------
 app = pg.mkQApp("Radiosonde Example")
-#mw = QtGui.QMainWindow()
-#mw.resize(800,800)
-win = pg.GraphicsLayoutWidget(show=True, title="Life stream RS examples")
-win.resize(1000,600)
-win.setWindowTitle('Radiosonde Example')
 # Enable antialiasing for prettier plots
 pg.setConfigOptions(antialias=True)
-# Pressure
-p3 = win.addPlot(title="Pressure",axisItems = {'bottom': pg.DateAxisItem()})
-c3 = p3.plot(df_ptu.timestamp,df_ptu.pressure,pen=(0,0,0))
-p3.setLabel('left', 'Pressure', units='hPa')
-p3.setLabel('bottom', 'Time')
-p3.showGrid(x=True, y=True)
-# temperature
-p1 = win.addPlot(title="Temperature",axisItems = {'bottom': pg.DateAxisItem()})
-c1 = p1.plot(df_ptu.timestamp,df_ptu.temperature,pen=(0,0,0))
-p1.setLabel('left', 'Temperature', units='K')
-p1.setLabel('bottom', 'Time')
-p1.showGrid(x=True, y=True)
-# windspeed
-p4 = win.addPlot(title="Wind Speed",axisItems = {'bottom': pg.DateAxisItem()})
-c4 = p4.plot(df_ptu.timestamp,df_ptu.windSpeed,pen=(0,0,0))
-p4.setLabel('left', 'Wind Speed', units='m/s')
-p4.setLabel('bottom', 'Time')
-p4.showGrid(x=True, y=True)
-# windDirection
-p8 = win.addPlot(title="Wind Direction",axisItems = {'bottom': pg.DateAxisItem()})
-c8 = p8.plot(df_ptu.timestamp,df_ptu.windDirection,pen=(0,0,0))
-p8.setLabel('left', 'Wind Speed', units='°')
-p8.setLabel('bottom', 'Time')
-p8.showGrid(x=True, y=True)
-win.nextRow()
-
-#humidity 
-p2 = win.addPlot(title="Humidity",axisItems = {'bottom': pg.DateAxisItem()})
-c2 = p2.plot(df_ptu.timestamp,df_ptu.humidity,pen=(0,0,0))
-p2.setLabel('left', 'Humidity', units='%')
-p2.setLabel('bottom', 'Time')
-p2.showGrid(x=True, y=True)
-## frequency of the TWC
-p6 = win.addPlot(title="Frequency TWC",axisItems = {'bottom': pg.DateAxisItem()})
-c6 = p6.plot(df_xdata.timestamp,df_xdata.twc_frequency,pen=(0,0,0))
-p6.setLabel('left', 'Frequency', units='Hz')
-p6.setLabel('bottom', 'Time')
-p6.showGrid(x=True, y=True)
-## frequency of the SLWC
-p7 = win.addPlot(title="Frequency SLWC",axisItems = {'bottom': pg.DateAxisItem()})
-c7 = p7.plot(df_xdata.timestamp,df_xdata.slwc_frequency,pen=(0,0,0))
-p7.setLabel('left', 'Frequency', units='Hz')
-p7.setLabel('bottom', 'Time')
-p7.showGrid(x=True, y=True)
-# position of the radiosonde
-p5 = win.addPlot(title="Position")
-c5 = p5.plot(df_ptu.longitude,df_ptu.latitude,pen=(0,0,0))
-p5.setLabel('left', 'Latitude', units='°')
-p5.setLabel('bottom', 'Longitude', units='°')
-p5.showGrid(x=True, y=True)
-
-# Update Plot every 1000 ms
-timer = QtCore.QTimer()
-timer.timeout.connect(updatePlots)
-timer.start(1000)
+# Files of the soundings being written in dirsOut read in background
+# threads when data are appended, plots updated when new data are ready
+dashboard = Dashboard([os.path.dirname(d) for d in dirsOut],
+                      stats=showStats, stats_path=statsOut,
+                      window=None if windowMinutes is None else windowMinutes * 60,
+                      subscribe=subscribeTo,
+                      cache=None if cacheDir is None else ColumnCache(cacheDir, cacheMB << 20))
+dashboard.show()
+app.aboutToQuit.connect(lambda: dashboard.stop())
 
 
 if __name__ == '__main__':
     pg.mkQApp().exec_()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-